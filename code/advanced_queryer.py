@@ -1,7 +1,14 @@
+import numpy as np
 import pandas as pd
 from nltk.stem import SnowballStemmer
 import os
-from question_two import *
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from search_eng import *
+from bin_index import BinaryIndex, inv_idx_file, read_inv_idx
+from doc_metadata import get_doc_metadata
+from query_cache import ResultCache, canonical_key, object_token
+from term_dict import read_vocab, vocab_file
 import warnings
 pd.options.mode.chained_assignment = None
 # ---------------------------------------------------------------------------- #
@@ -31,26 +38,122 @@ def get_url_from_idx(idx, path='../shared_stuff/url_list.txt'):
     OUTPUT: urls 
     '''
     
-    with open(path, 'r') as f:
-        urls = f.readlines()
-    return urls[idx]
+    # the file is read only once, see doc_metadata.py
+    return get_doc_metadata(path).url(idx)
+
+# ---------------------------------------------------------------------------- #
+#                                  Index store                                 #
+# ---------------------------------------------------------------------------- #
+
+def read_sorted_inv_idx(fname):
+    '''
+        Reads an inverted index, wrapping the JSON ones in a SortedIndex so that the postings
+        are converted in sorted arrays only once and not on every query
+    '''
+    inv_idx = read_inv_idx(fname)
+    return inv_idx if isinstance(inv_idx, BinaryIndex) else SortedIndex(inv_idx)
+
+
+class IndexStore:
+    '''
+        Keeps in memory the vocabularies and the inverted indexes of all the fields, so that
+        they are read from disk only once (the first time a field is queried) and not on every query.
+
+        Each file is reloaded only when its modification time changes, i.e. when the index is rebuilt.
+        If an up to date inv_idx.bin (vocabulary.bin) exists it's used instead of inv_idx.json (vocabulary.json).
+    '''
+
+    def __init__(self, path='../shared_stuff/indexes'):
+        self.path = path
+        self._fields = None
+        self._fields_mtime = None
+        self._files = dict() # (field, name) -> (path, mtime, content)
+
+    def fields(self):
+        '''
+            Same as actual_indexes(path), but the directory is listed again only if it has changed
+        '''
+        mtime = os.stat(self.path).st_mtime_ns
+        if self._fields is None or mtime != self._fields_mtime:
+            self._fields = actual_indexes(self.path)
+            self._fields_mtime = mtime
+        return self._fields
+
+    def _get(self, field, name, fname, loader):
+        '''
+            Returns the content of the file 'fname' of the given field, loading it with 'loader'
+            only if it's not in memory yet or if it has been modified since the last load
+        '''
+        mtime = os.stat(fname).st_mtime_ns
+        cached = self._files.get((field, name))
+        if cached is not None and cached[0] == fname and cached[1] == mtime:
+            return cached[2]
+
+        content = loader(fname)
+        self._files[(field, name)] = (fname, mtime, content)
+        return content
+
+    def vocabulary(self, field):
+        '''
+            Returns the vocabulary of the field
+        '''
+        fname = vocab_file(self.fields()[field])
+        return self._get(field, 'vocabulary', fname, read_vocab)
+
+    def inv_idx(self, field):
+        '''
+            Returns the inverted index of the field
+        '''
+        fname = inv_idx_file(self.fields()[field])
+        return self._get(field, 'inv_idx', fname, read_sorted_inv_idx)
+
+    def version(self, fields):
+        '''
+            Returns the modification times of the vocabularies and inverted indexes of the fields,
+            they change when an index is rebuilt
+        '''
+        ret = []
+        for field in sorted(fields):
+            idx_dir = self.fields()[field]
+            for fname in (vocab_file(idx_dir), inv_idx_file(idx_dir)):
+                ret.append((fname, os.stat(fname).st_mtime_ns))
+        return tuple(ret)
+
+    def preload(self):
+        '''
+            Loads all the fields at once, to avoid paying the loading time on the first queries
+        '''
+        for field in self.fields():
+            self.vocabulary(field)
+            self.inv_idx(field)
+        return self
+
+    def clear(self):
+        self._fields = None
+        self._files = dict()
+
+
+# The store shared by all the queries
+STORE = IndexStore()
 
 # ---------------------------------------------------------------------------- #
 #                                 Let's Parse!                                 #
 # ---------------------------------------------------------------------------- #
 
-def parse_advanced_query(query):
+def parse_advanced_query(query, store=None, verbose=True):
     '''
     function to parse a query splitting word and fields where we are searching the word.
     Return the fields with inverted indexes of the words
 
-    INPUT:query
+    INPUT:query, store (the IndexStore to use, by default the shared one), verbose (print the words)
     OUTPUT:parsed query 
     '''
+    store = STORE if store is None else store
     cum = []
     ret = dict()
-    act_ind = actual_indexes()
-    print(query.split(' '))
+    act_ind = store.fields()
+    if verbose:
+        print(query.split(' '))
     for word in query.split(' '):
         if word.startswith('['):
             k = word[1:-1]
@@ -60,20 +163,20 @@ def parse_advanced_query(query):
             cum = []
         else:
             cum.append(word)
-    return {k: parse_query(v, read_dict_from_file(filename=os.path.join(act_ind[k], 'vocabulary.json'))) for k,v in ret.items()}
+    return {k: parse_query(v, store.vocabulary(k), stemmer) for k,v in ret.items()}
 
 
-def get_advanced_results(query_dict):
+def get_advanced_results(query_dict, store=None):
     '''
     function that uses the parsed query to find all the documents that match the request of the user
 
-    INPUT: parsed query
+    INPUT: parsed query, store (the IndexStore to use, by default the shared one)
     OUTPUT: indexes of the documents that match the query
     '''
+    store = STORE if store is None else store
     ret = dict()
-    act_ind = actual_indexes()
     for k in query_dict:
-        inv_idx = read_dict_from_file(os.path.join(act_ind[k], 'inv_idx.json'))
+        inv_idx = store.inv_idx(k)
         if len(query_dict[k]) != 0:
             ret[k] = get_results(query_dict[k], inv_idx)
     
@@ -113,33 +216,174 @@ def get_printable_doc(df,idx, score):
     ret['score'] = score
     return ret[['title', 'synopsis', 'url', 'score']].to_frame().transpose()
 
-def query_anime(df, query, k=None):
+
+class FieldScorer:
+    '''
+        Vectorized version of score: the lengths of the fields of every document (the same
+        len(df[field].split(' ')) of score) are computed once as numpy arrays, so that the scores of
+        all the candidates of a query are a single numpy expression
+    '''
+
+    def __init__(self, df, weight=None):
+        self.df = df
+        self.weight = WEIGHT if weight is None else weight
+        self.lengths = {f: (df[f].astype(str).str.count(' ') + 1).to_numpy(dtype=np.float64)
+                        for f in self.weight if f in df.columns}
+
+    def scores(self, docs, query_len):
+        '''
+            Returns the array of the scores of the documents docs (array of positions in the df)
+        '''
+        ret = np.zeros(len(docs))
+        for f, q_i in query_len.items():
+            ret += (q_i * self.weight[f]) / self.lengths[f][docs]
+        return ret
+
+    def top_k(self, docs, query_len, k=None):
+        '''
+            Returns the k best documents (all of them if k is None) with their scores, sorted by score
+        '''
+        docs = np.sort(np.asarray(docs, dtype=np.int64))
+        scores = self.scores(docs, query_len)
+        if k is not None and k < len(docs):
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(docs))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return docs[best], scores[best]
+
+
+_EDITS = count(1)
+
+def df_version(df):
+    '''
+        Returns what identifies the content of the dataframe for the scorer and the result cache:
+        the dataframe itself, its length and the number of its last edit (see edited)
+    '''
+    return (object_token(df), len(df), df.attrs.get('edit', 0))
+
+def edited(df):
     '''
-    function to execute the query on the dataframe given the int number k  of elements we want as output
+        To be called after changing the dataframe in place (i.e. df.loc[idx, 'title'] = ...):
+        the scorer and the cached results of the old content are not used anymore
+    '''
+    df.attrs['edit'] = next(_EDITS)
+
+
+_SCORER = None
+
+def get_scorer(df):
+    '''
+        Returns the FieldScorer of the dataframe, built again only when the dataframe changes (see df_version)
+    '''
+    global _SCORER
+    version = df_version(df)
+    if _SCORER is None or _SCORER[0] != version:
+        _SCORER = (version, FieldScorer(df))
+    return _SCORER[1]
+
+
+# The cache shared by all the queries
+RESULT_CACHE = ResultCache()
+
+def rank_anime(df, parsed_query, k=None, store=None):
+    '''
+    function to find and score the documents of a parsed query, returning the first k
+
+    INPUT: dataframe, parsed query, k, store (the IndexStore to use, by default the shared one)
+    OUTPUT: the result in dataframe format (empty if no document matches the query)
+    '''
+    results = get_advanced_results(parsed_query, store)
+    return result_frame(df, [int(idx) for idx in results], parsed_query, k)
 
-    INPUT:dataframe,query, k
+
+def result_frame(df, results, parsed_query, k=None):
+    '''
+    function to score the documents matching a parsed query, returning the first k
+
+    INPUT: dataframe, documents (list or array of ints), parsed query, k
+    OUTPUT: the result in dataframe format (empty if there are no documents)
+    '''
+    if len(results)==0:
+        return pd.DataFrame(columns=['doc_id', 'title', 'description', 'url', 'score'])
+    query_len = {k: len(v) for k, v in parsed_query.items()}
+
+    # Scoring all the results at once and selecting the first k elements
+    docs, scores = get_scorer(df).top_k(results, query_len, k)
+
+    ret = df.iloc[docs][['title', 'synopsis']]
+    ret['url'] = get_doc_metadata().urls(docs)
+    ret['score'] = scores
+    return ret.reset_index().rename(columns={"index": "doc_id", "synopsis": "description"})
+
+
+def query_anime(df, query, k=None, store=None, cache=None):
+    '''
+    function to execute the query on the dataframe given the int number k  of elements we want as output.
+    The results are kept in a cache, so a repeated query (even with the words in another order or
+    inflected differently) is not computed again until the indexes are rebuilt or the dataframe is edited
+    (call edited(df) after changing it in place).
+
+    INPUT:dataframe,query, k, store (the IndexStore to use, by default the shared one),
+          cache (the ResultCache to use, by default the shared one)
     -NOTE- the query has the following shape: ```word1 word2 [where_to_search] word3 word4 [where_t_s2] ...```"<br
     
     OUTPUT: the result in dataframe format 
     '''
+    store = STORE if store is None else store
+    cache = RESULT_CACHE if cache is None else cache
     
-    parsed_query = parse_advanced_query(query)
-    results = list(get_advanced_results(parsed_query))
+    parsed_query = parse_advanced_query(query, store)
+    key = (df_version(df), canonical_key(parsed_query, k))
+    ret = cache.cached(key, store.version(parsed_query), lambda: rank_anime(df, parsed_query, k, store))
 
-    if len(results)==0:
+    if len(ret)==0:
         warnings.warn(f"Cannot find any anime for the query: '{query}'")
-        return pd.DataFrame(columns=['doc_id', 'title', 'description', 'url', 'score'])
-    query_len = {k: len(v) for k, v in parsed_query.items()}
+    # a copy, so the cached result can't be modified
+    return ret.copy()
+
+
+def batch_query_anime(df, queries, k=None, store=None, cache=None, workers=None):
+    '''
+    function to execute many queries at once (i.e. for an evaluation or to warm the cache).
+    The queries are grouped by field so that the postings of each distinct word are decoded only once,
+    then the queries not in the cache are evaluated in parallel by a pool of threads (the postings are
+    shared) and their results are added to the cache.
+
+    INPUT: dataframe, list of queries, k, store, cache (as in query_anime), workers (number of threads)
+    OUTPUT: the list of the results in dataframe format, in the order of the queries
+    '''
+    store = STORE if store is None else store
+    cache = RESULT_CACHE if cache is None else cache
+
+    parsed_queries = [parse_advanced_query(query, store, verbose=False) for query in queries]
+    keys = [(df_version(df), canonical_key(parsed_query, k)) for parsed_query in parsed_queries]
+    versions = [store.version(parsed_query) for parsed_query in parsed_queries]
 
-    scores = [(idx, score(df.iloc[idx], query_len)) for idx in results]
+    ret = [cache.get(key, version) for key, version in zip(keys, versions)]
+    pending = [i for i, res in enumerate(ret) if res is None]
 
-    scores = sorted(scores, key=lambda coppia: -coppia[1])
+    # Grouping by field: the postings of each word of the pending queries, decoded once
+    terms = dict()
+    for i in pending:
+        for field, words in parsed_queries[i].items():
+            terms.setdefault(field, set()).update(words)
+    postings = dict()
+    for field, words in terms.items():
+        inv_idx = store.inv_idx(field)
+        postings[field] = {word: postings_array(inv_idx, word) for word in words}
 
-    # Selecting the first k elements
-    if k is None or k>len(scores):
-        k = len(scores)
-    scores = scores[:k]
+    def evaluate(i):
+        parsed_query = parsed_queries[i]
+        results = [intersect_postings([postings[field][word] for word in words])
+                   for field, words in parsed_query.items() if len(words) != 0]
+        docs = intersect_postings(results) if len(results) != 0 else []
+        return result_frame(df, docs, parsed_query, k)
 
-    return pd.concat(list(map(lambda tupla: get_printable_doc(df, *tupla), scores))).reset_index().rename(columns={"index": "doc_id", "synopsis": "description"})
+    get_scorer(df) # built once, before the threads
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, res in zip(pending, executor.map(evaluate, pending)):
+            cache.put(keys[i], res, versions[i])
+            ret[i] = res
 
-    
\ No newline at end of file
+    return [res.copy() for res in ret]
@@ -0,0 +1,682 @@
+'''
+
+    This file contains the benchmarks used to compare the faster implementations of the
+    search engine with the original ones.
+
+    Every benchmark can be launched from the terminal, i.e.:
+        python benchmarks.py inv_idx --tsv ../data/tsv_files/total_pages.tsv
+
+'''
+
+import argparse
+import contextlib
+import csv
+import heapq
+import io
+import json
+import os
+import tempfile
+import tracemalloc
+import warnings
+from time import perf_counter
+
+import bs4
+import numpy as np
+import pandas as pd
+from nltk.stem import SnowballStemmer
+
+import advanced_queryer
+import bin_index
+import html_parser
+import index_builder
+import page_store
+import query_cache
+import search_eng
+import term_dict
+
+# ---------------------------------------------------------------------------- #
+#                               Support functions                              #
+# ---------------------------------------------------------------------------- #
+
+def import_df(path="../data/tsv_files/total_pages.tsv"):
+    '''
+        Same loader used in the notebook: it reads the total tsv in a dataframe
+    '''
+    return pd.read_table(path,
+                         delimiter="\t",
+                         header="infer",
+                         quoting=csv.QUOTE_NONE,
+                         on_bad_lines="skip")
+
+
+def timeit(fun, *args, repeat=1, **kwargs):
+    '''
+        Runs fun(*args, **kwargs) 'repeat' times and returns the result of the last run
+        together with the best elapsed time in seconds
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        ret = fun(*args, **kwargs)
+        best = min(best, perf_counter() - start)
+    return ret, best
+
+
+def latencies(fun, inputs):
+    '''
+        Calls fun on each input (silencing its prints) and returns the list of latencies in seconds
+    '''
+    ret = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for inp in inputs:
+            start = perf_counter()
+            fun(inp)
+            ret.append(perf_counter() - start)
+    return ret
+
+
+def report_latencies(name, lat, baseline=None):
+    '''
+        Prints the p50 and p99 of a list of latencies (and the speed up of the p50 if a baseline is given)
+    '''
+    p50, p99 = np.percentile(lat, [50, 99]) * 1000
+    line = f"{name:<30} p50 {p50:9.3f} ms   p99 {p99:9.3f} ms"
+    if baseline is not None:
+        line += f"   x{np.percentile(baseline, 50) / np.percentile(lat, 50):.1f}"
+    print(line)
+
+
+def sample_advanced_queries(idx_path, n_queries, fields=('title', 'characters'), seed=0):
+    '''
+        Creates n_queries advanced queries with one word of the vocabulary of each field, i.e.
+            "word1 [title] word2 [characters]"
+    '''
+    rng = np.random.default_rng(seed)
+    vocabs = {f: list(search_eng.read_dict_from_file(os.path.join(idx_path, f, 'vocabulary.json')))
+              for f in fields}
+    return [' '.join(f"{rng.choice(vocabs[f])} [{f}]" for f in fields) for _ in range(n_queries)]
+
+
+def report(name, seconds, baseline=None):
+    '''
+        Prints a line with the elapsed time (and the speed up if a baseline is given)
+    '''
+    line = f"{name:<30} {seconds:10.4f} s"
+    if baseline is not None and seconds > 0:
+        line += f"   x{baseline / seconds:.1f}"
+    print(line)
+
+# ---------------------------------------------------------------------------- #
+#                              Reference versions                              #
+# ---------------------------------------------------------------------------- #
+
+def get_results_sets(query, inv_idx):
+    '''
+        The original implementation of search_eng.get_results: intersection of python sets
+    '''
+    return set.intersection(*[set(inv_idx[str(q)]) for q in query])
+
+
+def tfidf_or_exhaustive(query, index, k=10):
+    '''
+        Disjunctive ranked query scoring every document containing at least one word of the query
+    '''
+    weights = search_eng.query_weights(query, index.idf)
+    scores = np.zeros(index.n_docs)
+    hit = np.zeros(index.n_docs, dtype=bool)
+    for word, q_w in weights.items():
+        docs, d_w = index.postings(word)
+        scores[docs] += q_w * d_w
+        hit[docs] = True
+    candidates = np.flatnonzero(hit)
+    norms = np.sqrt(sum(w * w for w in weights.values())) * index.norms[candidates]
+    norms[norms == 0] = 1
+    scores[candidates] /= norms
+    return search_eng.top_k(scores, candidates, k)
+
+
+def query_anime_rowwise(df, query, k=None, store=None):
+    '''
+        The original query_anime: a score call and a one row frame for each result
+    '''
+    parsed_query = advanced_queryer.parse_advanced_query(query, store)
+    results = [int(idx) for idx in advanced_queryer.get_advanced_results(parsed_query, store)]
+    if len(results) == 0:
+        return pd.DataFrame(columns=['doc_id', 'title', 'description', 'url', 'score'])
+    query_len = {k: len(v) for k, v in parsed_query.items()}
+    scores = sorted([(idx, advanced_queryer.score(df.iloc[idx], query_len)) for idx in results],
+                    key=lambda coppia: -coppia[1])
+    if k is None or k > len(scores):
+        k = len(scores)
+    return pd.concat([advanced_queryer.get_printable_doc(df, *tupla) for tupla in scores[:k]]) \
+        .reset_index().rename(columns={"index": "doc_id", "synopsis": "description"})
+
+
+def create_inv_idx_scan(corpus, vocab):
+    '''
+        The original implementation of search_eng.create_inv_idx:
+        for each word of the vocabulary it scans the whole corpus
+    '''
+    inv_idx = {}
+    for idx, word in zip(vocab.values(), vocab.keys()):
+        inv_idx[idx] = [str(doc_id) for doc_id, doc in enumerate(corpus) if word in doc]
+    return inv_idx
+
+# ---------------------------------------------------------------------------- #
+#                                  Benchmarks                                  #
+# ---------------------------------------------------------------------------- #
+
+def bench_inv_idx(tsv, field='synopsis', limit=None):
+    '''
+        Compares the single pass create_inv_idx with the original one on the given field
+        of the total tsv. Use 'limit' to run the (very slow) original one on the first rows only.
+    '''
+    df = import_df(tsv)
+    if limit is not None:
+        df = df.iloc[:limit]
+
+    stemmer = SnowballStemmer("english")
+    corpus = [search_eng.preprocess(text, stemmer) for text in df[field]]
+    vocab = search_eng.create_vocab(corpus)
+    print(f"[inv_idx]: {len(corpus)} documents, {len(vocab)} words")
+
+    old, old_time = timeit(create_inv_idx_scan, corpus, vocab)
+    new, new_time = timeit(search_eng.create_inv_idx, corpus, vocab, repeat=3)
+
+    assert old == new, "The two inverted indexes are different!"
+    report("create_inv_idx (scan)", old_time)
+    report("create_inv_idx (single pass)", new_time, old_time)
+
+
+def bench_bin_index(idx_dir, n_queries=1000):
+    '''
+        Compares the JSON and the binary inverted index of the given directory:
+        time to open the index and time to answer random conjunctive queries of two terms
+    '''
+    json_file = os.path.join(idx_dir, 'inv_idx.json')
+    bin_file = os.path.join(idx_dir, 'inv_idx.bin')
+    if not os.path.exists(bin_file):
+        bin_index.json_to_binary(json_file, bin_file)
+    print(f"[bin_index]: json {os.path.getsize(json_file)} bytes, bin {os.path.getsize(bin_file)} bytes")
+
+    json_idx, json_time = timeit(search_eng.read_dict_from_file, json_file, repeat=3)
+    bin_idx, bin_time = timeit(bin_index.BinaryIndex, bin_file, repeat=3)
+    report("open (json)", json_time)
+    report("open (bin)", bin_time, json_time)
+
+    rng = np.random.default_rng(0)
+    terms = list(json_idx.keys())
+    queries = [list(rng.choice(terms, 2)) for _ in range(n_queries)]
+
+    def run(inv_idx):
+        return [search_eng.get_results(q, inv_idx) for q in queries]
+
+    json_res, json_time = timeit(run, json_idx)
+    bin_res, bin_time = timeit(run, bin_idx)
+    assert json_res == bin_res, "The two indexes give different results!"
+    report(f"{n_queries} queries (json)", json_time)
+    report(f"{n_queries} queries (bin)", bin_time, json_time)
+
+
+def bench_query_latency(idx_path, n_queries=100):
+    '''
+        Latency of the advanced query (parsing and retrieval) when the indexes are read
+        from disk on every query (as it was) and when they're served by a shared IndexStore
+    '''
+    queries = sample_advanced_queries(idx_path, n_queries)
+
+    def reload_every_time(query):
+        store = advanced_queryer.IndexStore(idx_path)
+        parsed = advanced_queryer.parse_advanced_query(query, store)
+        return advanced_queryer.get_advanced_results(parsed, store)
+
+    store = advanced_queryer.IndexStore(idx_path).preload()
+
+    def shared_store(query):
+        parsed = advanced_queryer.parse_advanced_query(query, store)
+        return advanced_queryer.get_advanced_results(parsed, store)
+
+    old = latencies(reload_every_time, queries)
+    new = latencies(shared_store, queries)
+    report_latencies("reload on every query", old)
+    report_latencies("shared IndexStore", new, old)
+
+
+def bench_field_scoring(tsv, idx_path, n_queries=100, k=10):
+    '''
+        Latency of query_anime with the row by row scoring and with the vectorized FieldScorer,
+        on single word title queries (large result sets)
+    '''
+    df = import_df(tsv)
+    queries = sample_advanced_queries(idx_path, n_queries, fields=('title',))
+    store = advanced_queryer.IndexStore(idx_path).preload()
+    advanced_queryer.get_scorer(df)
+
+    old = latencies(lambda q: query_anime_rowwise(df, q, k, store), queries)
+    no_cache = query_cache.ResultCache(maxsize=0)
+    new = latencies(lambda q: advanced_queryer.query_anime(df, q, k, store, no_cache), queries)
+    report_latencies("row by row scoring", old)
+    report_latencies("FieldScorer", new, old)
+
+
+def bench_batch_query(tsv, idx_path, n_queries=1000, k=10, workers=None):
+    '''
+        Throughput (queries/s) of query_anime called on each query and of batch_query_anime,
+        both without the result cache, checking that they give the same results
+    '''
+    df = import_df(tsv)
+    queries = sample_advanced_queries(idx_path, n_queries)
+    store = advanced_queryer.IndexStore(idx_path).preload()
+    advanced_queryer.get_scorer(df)
+
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        old, old_time = timeit(lambda: [advanced_queryer.query_anime(df, q, k, store, query_cache.ResultCache(0))
+                                        for q in queries])
+        new, new_time = timeit(advanced_queryer.batch_query_anime, df, queries, k, store,
+                               query_cache.ResultCache(0), workers)
+    same = all(o.equals(n) or (len(o) == 0 and len(n) == 0) for o, n in zip(old, new))
+    print(f"[batch_query]: {len(queries)} queries")
+    print(f"{'query_anime':<30} {len(queries) / old_time:10.1f} queries/s")
+    print(f"{'batch_query_anime':<30} {len(queries) / new_time:10.1f} queries/s   x{old_time / new_time:.1f}"
+          f"   same results: {same}")
+
+
+def bench_term_dict(idx_dir, n_lookups=10000):
+    '''
+        Loading time, memory and lookup time of vocabulary.json and of its binary version
+    '''
+    json_file = os.path.join(idx_dir, 'vocabulary.json')
+    with tempfile.TemporaryDirectory() as tmp:
+        bin_file = term_dict.json_to_term_dict(json_file, os.path.join(tmp, 'vocabulary.bin'))
+
+        tracemalloc.start()
+        vocab = search_eng.read_dict_from_file(json_file)
+        json_mem = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        _, json_time = timeit(search_eng.read_dict_from_file, json_file, repeat=3)
+
+        tracemalloc.start()
+        tdict = term_dict.TermDict(bin_file)
+        bin_mem = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        _, bin_time = timeit(term_dict.TermDict, bin_file, repeat=3)
+
+        words = list(np.random.default_rng(0).choice(list(vocab), n_lookups))
+        _, lookup_time = timeit(lambda: [tdict[w] for w in words])
+        same = all(tdict[w] == idx for w, idx in vocab.items())
+
+        print(f"[term_dict]: {len(vocab)} terms, json {os.path.getsize(json_file) / 2**10:.0f} KiB, "
+              f"binary {os.path.getsize(bin_file) / 2**10:.0f} KiB")
+        print(f"{'json':<30} load {json_time * 1000:8.2f} ms   memory {json_mem / 2**20:6.2f} MiB")
+        print(f"{'TermDict':<30} load {bin_time * 1000:8.2f} ms   memory {bin_mem / 2**20:6.2f} MiB"
+              f"   x{json_time / bin_time:.1f}   lookup {lookup_time / n_lookups * 1e6:.1f} us   same ids: {same}")
+        tdict.close()
+
+
+def bench_intersection(idx_dir, n_queries=1000, n_terms=3):
+    '''
+        Compares the set based get_results with the sorted postings engine on conjunctive queries
+        made of one of the most common words and other random words of the index
+    '''
+    inv_idx = search_eng.read_dict_from_file(os.path.join(idx_dir, 'inv_idx.json'))
+    terms = list(inv_idx.keys())
+    common = sorted(terms, key=lambda t: -len(inv_idx[t]))[:50]
+
+    rng = np.random.default_rng(0)
+    queries = [[rng.choice(common)] + list(rng.choice(terms, n_terms - 1)) for _ in range(n_queries)]
+    print(f"[intersection]: {n_queries} queries of {n_terms} terms, "
+          f"the most common word has {len(inv_idx[common[0]])} documents")
+
+    def run(get_results, idx):
+        return [get_results(q, idx) for q in queries]
+
+    sorted_idx = search_eng.SortedIndex(inv_idx)
+    run(search_eng.get_results, sorted_idx) # converting the postings once
+
+    old, old_time = timeit(run, get_results_sets, inv_idx, repeat=3)
+    new, new_time = timeit(run, search_eng.get_results, inv_idx, repeat=3)
+    cached, cached_time = timeit(run, search_eng.get_results, sorted_idx, repeat=3)
+    assert old == new == cached, "The engines give different results!"
+
+    report("python sets", old_time)
+    report("sorted arrays (dict)", new_time, old_time)
+    report("sorted arrays (SortedIndex)", cached_time, old_time)
+
+    bin_file = os.path.join(idx_dir, 'inv_idx.bin')
+    if os.path.exists(bin_file):
+        binary, bin_time = timeit(run, search_eng.get_results, bin_index.BinaryIndex(bin_file), repeat=3)
+        assert binary == old, "The binary index gives different results!"
+        report("sorted arrays (BinaryIndex)", bin_time, old_time)
+
+
+def load_synopsis_corpus(tsv, limit=None):
+    '''
+        Reads the total tsv and returns the preprocessed synopses
+    '''
+    df = import_df(tsv)
+    if limit is not None:
+        df = df.iloc[:limit]
+    stemmer = SnowballStemmer("english")
+    return [search_eng.preprocess(text, stemmer) for text in df['synopsis']]
+
+
+def sample_doc_queries(corpus, vocab, n_queries, n_terms, seed=0):
+    '''
+        Creates queries (lists of word ids) picking n_terms words of a random document,
+        so that every conjunctive query has at least one result
+    '''
+    rng = np.random.default_rng(seed)
+    docs = [doc for doc in corpus if len(set(doc)) >= n_terms]
+    return [[vocab[w] for w in rng.choice(sorted(set(docs[i])), n_terms, replace=False)]
+            for i in rng.integers(len(docs), size=n_queries)]
+
+
+def build_tfidf_index(corpus):
+    '''
+        Builds the tfidf index of the corpus as it is read back from the JSON files
+    '''
+    vocab = search_eng.create_vocab(corpus)
+    inv_idx, idf = search_eng.create_inv_idx2(corpus, vocab)
+    norms = search_eng.create_doc_norms(inv_idx, len(corpus))
+    # same keys and values we would get reading the json files
+    inv_idx, idf = json.loads(json.dumps(inv_idx)), json.loads(json.dumps(idf))
+    return vocab, search_eng.TfidfIndex(inv_idx, idf, norms)
+
+
+def bench_tfidf(tsv, n_queries=200, n_terms=2, k=10, limit=None):
+    '''
+        Compares the ranked search of the notebook (tfidf_query, cosine_similiarity and heapq)
+        with the dense accumulator of tfidf_top_k
+    '''
+    corpus = load_synopsis_corpus(tsv, limit)
+    vocab, index = build_tfidf_index(corpus)
+    queries = sample_doc_queries(corpus, vocab, n_queries, n_terms)
+    print(f"[tfidf]: {len(corpus)} documents, {n_queries} queries of {n_terms} terms, k = {k}")
+
+    def notebook(query):
+        tfidf_q, tfidf_docs = search_eng.tfidf_query(corpus, query, index.inv_idx, index.idf)
+        heap = [(search_eng.cosine_similiarity(tfidf_q, d), key) for key, d in tfidf_docs.items()]
+        return {d: simil for (simil, d) in heapq.nlargest(k, heap)}
+
+    old, old_time = timeit(lambda: [notebook(q) for q in queries])
+    new, new_time = timeit(lambda: [search_eng.tfidf_top_k(q, index, k) for q in queries], repeat=3)
+    report("tfidf_query + heapq", old_time)
+    report("tfidf_top_k", new_time, old_time)
+
+
+def bench_tfidf_or(tsv, n_queries=200, n_terms=6, k=10, limit=None):
+    '''
+        Disjunctive ranked queries: MaxScore (tfidf_query_or) vs scoring every matching document
+    '''
+    corpus = load_synopsis_corpus(tsv, limit)
+    vocab, index = build_tfidf_index(corpus)
+    queries = sample_doc_queries(corpus, vocab, n_queries, n_terms)
+    print(f"[tfidf_or]: {len(corpus)} documents, {n_queries} queries of {n_terms} terms, k = {k}")
+
+    # the postings are converted once, as in a long lived TfidfIndex
+    for q in queries:
+        search_eng.tfidf_query_or(q, index, k)
+
+    old, old_time = timeit(lambda: [tfidf_or_exhaustive(q, index, k) for q in queries], repeat=3)
+    new, new_time = timeit(lambda: [search_eng.tfidf_query_or(q, index, k) for q in queries], repeat=3)
+    for o, n in zip(old, new):
+        assert np.allclose(list(o.values()), list(n.values())), "The two searches give different scores!"
+    report("exhaustive OR", old_time)
+    report("MaxScore OR", new_time, old_time)
+
+
+def bench_preprocess(tsv, field='synopsis', limit=None):
+    '''
+        Throughput (tokens/sec) of preprocess and of the Preprocessor, checking that they give the same tokens
+    '''
+    df = import_df(tsv)
+    if limit is not None:
+        df = df.iloc[:limit]
+    texts = list(df[field])
+
+    stemmer = SnowballStemmer("english")
+    old, old_time = timeit(lambda: [search_eng.preprocess(t, stemmer) for t in texts])
+    n_tokens = sum(len(doc) for doc in old)
+    print(f"[preprocess]: {len(texts)} documents, {n_tokens} tokens")
+    print(f"{'preprocess':<30} {n_tokens / old_time:12.0f} tokens/s")
+
+    prep = search_eng.Preprocessor(stemmer)
+    new, new_time = timeit(lambda: [prep(t) for t in texts])
+    different = sum(o != n for o, n in zip(old, new))
+    print(f"{'Preprocessor':<30} {n_tokens / new_time:12.0f} tokens/s"
+          f"   x{old_time / new_time:.1f}   different documents: {different}")
+
+
+def disk_usage(files):
+    '''
+        Returns the bytes actually allocated on disk for the files (counting the partially used blocks)
+    '''
+    return sum(os.stat(f).st_blocks * 512 for f in files)
+
+
+def bench_page_store(src_dir, limit=None, chunk_size=64):
+    '''
+        Disk footprint and parse throughput of the html pages saved one per file and in the page store,
+        with every available codec
+    '''
+    names = sorted((f for f in os.listdir(src_dir) if f.startswith('article_') and f.endswith('.html')),
+                   key=lambda name: int(name[len('article_'):-len('.html')]))[:limit]
+    indices = [int(name[len('article_'):-len('.html')]) for name in names]
+    files = [os.path.join(src_dir, name) for name in names]
+
+    raw = sum(os.path.getsize(f) for f in files)
+    print(f"[page_store]: {len(files)} pages, {raw / 2**20:.1f} MiB of html")
+    print(f"{'files':<20} disk {disk_usage(files) / 2**20:9.1f} MiB")
+
+    def read_files():
+        for fname in files:
+            with open(fname, 'r') as f:
+                f.read()
+    _, read_time = timeit(read_files)
+    infos, parse_time = timeit(lambda: [html_parser.get_total_info(f) for f in files])
+    print(f"{'':<20} read {len(files) / read_time:9.0f} pages/s   parse {len(files) / parse_time:7.1f} pages/s")
+
+    codecs = ['gzip'] + (['zstd'] if page_store.zstandard is not None else [])
+    for codec in codecs:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'store')
+            _, pack_time = timeit(page_store.pack_pages, src_dir if limit is None else _subset_dir(tmp, files),
+                                  path, codec=codec, chunk_size=chunk_size)
+            store = page_store.PageStore(path)
+            size = disk_usage(os.path.join(path, f) for f in os.listdir(path))
+            print(f"{codec + ' store':<20} disk {size / 2**20:9.1f} MiB   x{disk_usage(files) / size:.1f} smaller"
+                  f"   packed in {pack_time:.1f} s")
+
+            _, seq_time = timeit(lambda: sum(1 for _ in page_store.PageStore(path)))
+            order = np.random.default_rng(0).permutation(indices)
+            rnd_store = page_store.PageStore(path)
+            _, rnd_time = timeit(lambda: [rnd_store[int(idx)] for idx in order])
+            new_infos, store_parse_time = timeit(lambda: [html_parser.get_total_info(idx, store) for idx in indices])
+            print(f"{'':<20} read {len(files) / seq_time:9.0f} pages/s (sequential) "
+                  f"{len(files) / rnd_time:9.0f} pages/s (random)   parse {len(files) / store_parse_time:7.1f} pages/s"
+                  f"   same output: {new_infos == infos}")
+
+
+def _subset_dir(tmp, files):
+    '''
+        Links the given html files in a new directory of tmp, to pack only them
+    '''
+    subset = os.path.join(tmp, 'pages')
+    os.mkdir(subset)
+    for f in files:
+        os.symlink(os.path.abspath(f), os.path.join(subset, os.path.basename(f)))
+    return subset
+
+
+def bench_parser_backends(src_dir, limit=None):
+    '''
+        Per page time of get_total_info with every available parser backend, checking that
+        the output is the same of the html.parser one
+    '''
+    names = sorted((f for f in os.listdir(src_dir) if f.startswith('article_') and f.endswith('.html')),
+                   key=lambda name: int(name[len('article_'):-len('.html')]))[:limit]
+    files = [os.path.join(src_dir, name) for name in names]
+    print(f"[parser_backends]: {len(files)} pages")
+
+    baseline, expected = None, None
+    for backend in html_parser.BACKENDS:
+        try:
+            html_parser.make_soup('<html></html>', backend)
+        except bs4.FeatureNotFound:
+            print(f"{backend:<30} not available")
+            continue
+        infos = []
+        lat = latencies(lambda f: infos.append(html_parser.get_total_info(f, backend=backend)), files)
+        if baseline is None:
+            baseline, expected = lat, infos
+        report_latencies(backend, lat, baseline)
+        print(f"{'':<30} same output: {infos == expected}")
+
+
+def bench_pipeline(src_dir, limit=None, workers=None):
+    '''
+        Indexes of the pages built through the total tsv (save_tsv_info then build_indexes)
+        vs single pass build_from_pages writing the same tsv on the side
+    '''
+    n_pages = len([f for f in os.listdir(src_dir) if f.startswith('article_')])
+    if limit is not None:
+        n_pages = min(n_pages, limit)
+    print(f"[pipeline]: {n_pages} pages")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def two_pass():
+            with contextlib.redirect_stdout(io.StringIO()):
+                html_parser.save_tsv_info(0, n_pages, src_dir, os.path.join(tmp, 'tsv'), workers=workers)
+                return index_builder.build_indexes(os.path.join(tmp, 'tsv', 'total_pages.tsv'),
+                                                   os.path.join(tmp, 'two_pass'), workers)
+
+        def one_pass():
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                ret = index_builder.build_from_pages(0, n_pages, src_dir, os.path.join(tmp, 'one_pass'),
+                                                     os.path.join(tmp, 'one_pass.tsv'), workers)[0]
+            print(out.getvalue().splitlines()[-1])
+            return ret
+
+        expected, t_two = timeit(two_pass)
+        report('save_tsv_info + build_indexes', t_two)
+        indexes, t_one = timeit(one_pass)
+        report('build_from_pages', t_one, t_two)
+
+        with open(os.path.join(tmp, 'tsv', 'total_pages.tsv')) as a, open(os.path.join(tmp, 'one_pass.tsv')) as b:
+            same_tsv = a.read() == b.read()
+        print(f"{'':<30} same indexes: {indexes == expected}, same tsv: {same_tsv}")
+
+
+def parse_args():
+    '''
+        This methods parses the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description="Benchmarks of the search engine")
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    inv = sub.add_parser('inv_idx', help="single pass vs original inverted index builder")
+    inv.add_argument('--tsv', type=str, default=os.path.join('..', 'data', 'tsv_files', 'total_pages.tsv'))
+    inv.add_argument('--field', type=str, default='synopsis')
+    inv.add_argument('--limit', type=int, default=None,
+                     help="number of rows to use (the original builder takes hours on the full corpus)")
+
+    binary = sub.add_parser('bin_index', help="JSON vs binary inverted index")
+    binary.add_argument('--idx_dir', type=str, default=os.path.join('..', 'shared_stuff', 'indexes', 'synopsis'))
+    binary.add_argument('--queries', type=int, default=1000)
+
+    latency = sub.add_parser('query_latency', help="advanced query latency with and without the IndexStore")
+    latency.add_argument('--idx_path', type=str, default=os.path.join('..', 'shared_stuff', 'indexes'))
+    latency.add_argument('--queries', type=int, default=100)
+
+    scoring = sub.add_parser('field_scoring', help="row by row vs vectorized query_anime scoring")
+    scoring.add_argument('--tsv', type=str, default=os.path.join('..', 'data', 'tsv_files', 'total_pages.tsv'))
+    scoring.add_argument('--idx_path', type=str, default=os.path.join('..', 'shared_stuff', 'indexes'))
+    scoring.add_argument('--queries', type=int, default=100)
+    scoring.add_argument('-k', type=int, default=10)
+
+    batch = sub.add_parser('batch_query', help="one query at a time vs batch_query_anime")
+    batch.add_argument('--tsv', type=str, default=os.path.join('..', 'data', 'tsv_files', 'total_pages.tsv'))
+    batch.add_argument('--idx_path', type=str, default=os.path.join('..', 'shared_stuff', 'indexes'))
+    batch.add_argument('--queries', type=int, default=1000)
+    batch.add_argument('-k', type=int, default=10)
+    batch.add_argument('--workers', type=int, default=None)
+
+    tdict = sub.add_parser('term_dict', help="vocabulary.json vs binary term dictionary")
+    tdict.add_argument('--idx_dir', type=str, default=os.path.join('..', 'shared_stuff', 'indexes', 'characters'))
+    tdict.add_argument('--lookups', type=int, default=10000)
+
+    inter = sub.add_parser('intersection', help="set based vs sorted postings conjunctive queries")
+    inter.add_argument('--idx_dir', type=str, default=os.path.join('..', 'shared_stuff', 'indexes', 'synopsis'))
+    inter.add_argument('--queries', type=int, default=1000)
+    inter.add_argument('--terms', type=int, default=3)
+
+    tfidf = sub.add_parser('tfidf', help="notebook ranked search vs tfidf_top_k")
+    tfidf.add_argument('--tsv', type=str, default=os.path.join('..', 'data', 'tsv_files', 'total_pages.tsv'))
+    tfidf.add_argument('--queries', type=int, default=200)
+    tfidf.add_argument('--terms', type=int, default=2)
+    tfidf.add_argument('-k', type=int, default=10)
+    tfidf.add_argument('--limit', type=int, default=None)
+
+    tfidf_or = sub.add_parser('tfidf_or', help="exhaustive vs MaxScore disjunctive ranked queries")
+    tfidf_or.add_argument('--tsv', type=str, default=os.path.join('..', 'data', 'tsv_files', 'total_pages.tsv'))
+    tfidf_or.add_argument('--queries', type=int, default=200)
+    tfidf_or.add_argument('--terms', type=int, default=6)
+    tfidf_or.add_argument('-k', type=int, default=10)
+    tfidf_or.add_argument('--limit', type=int, default=None)
+
+    prep = sub.add_parser('preprocess', help="preprocess vs Preprocessor throughput")
+    prep.add_argument('--tsv', type=str, default=os.path.join('..', 'data', 'tsv_files', 'total_pages.tsv'))
+    prep.add_argument('--field', type=str, default='synopsis')
+    prep.add_argument('--limit', type=int, default=None)
+
+    store = sub.add_parser('page_store', help="html files vs compressed page store")
+    store.add_argument('--src', type=str, default=os.path.join('..', 'data', 'html_pages'))
+    store.add_argument('--limit', type=int, default=None)
+    store.add_argument('--chunk_size', type=int, default=64)
+
+    backends = sub.add_parser('parser_backends', help="get_total_info time with each html parser backend")
+    backends.add_argument('--src', type=str, default=os.path.join('..', 'data', 'html_pages'))
+    backends.add_argument('--limit', type=int, default=None)
+
+    pipeline = sub.add_parser('pipeline', help="html -> tsv -> indexes vs single pass html -> indexes")
+    pipeline.add_argument('--src', type=str, default=os.path.join('..', 'data', 'html_pages'))
+    pipeline.add_argument('--limit', type=int, default=None)
+    pipeline.add_argument('--workers', type=int, default=None)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.bench == 'inv_idx':
+        bench_inv_idx(args.tsv, args.field, args.limit)
+    elif args.bench == 'bin_index':
+        bench_bin_index(args.idx_dir, args.queries)
+    elif args.bench == 'query_latency':
+        bench_query_latency(args.idx_path, args.queries)
+    elif args.bench == 'field_scoring':
+        bench_field_scoring(args.tsv, args.idx_path, args.queries, args.k)
+    elif args.bench == 'batch_query':
+        bench_batch_query(args.tsv, args.idx_path, args.queries, args.k, args.workers)
+    elif args.bench == 'term_dict':
+        bench_term_dict(args.idx_dir, args.lookups)
+    elif args.bench == 'intersection':
+        bench_intersection(args.idx_dir, args.queries, args.terms)
+    elif args.bench == 'tfidf':
+        bench_tfidf(args.tsv, args.queries, args.terms, args.k, args.limit)
+    elif args.bench == 'tfidf_or':
+        bench_tfidf_or(args.tsv, args.queries, args.terms, args.k, args.limit)
+    elif args.bench == 'preprocess':
+        bench_preprocess(args.tsv, args.field, args.limit)
+    elif args.bench == 'page_store':
+        bench_page_store(args.src, args.limit, args.chunk_size)
+    elif args.bench == 'parser_backends':
+        bench_parser_backends(args.src, args.limit)
+    elif args.bench == 'pipeline':
+        bench_pipeline(args.src, args.limit, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+'''
+
+    This file contains a compact binary format for the inverted indexes stored in
+    shared_stuff/indexes/<field>/inv_idx.json and the reader to query it.
+
+    The file (inv_idx.bin) is made of:
+        * a header:            magic, flags, number of terms, size of the postings section
+        * the term dictionary: the sorted term ids (uint32)
+        * the counts table:    the number of documents of each term (uint32)
+        * the offsets table:   where the postings of each term start (uint64, one more than the terms)
+        * the postings:        for each term the sorted document ids, delta and varint encoded
+
+    The reader maps the file in memory (mmap), so opening an index costs nothing and a query
+    decodes only the postings lists of its own terms.
+
+'''
+
+import json
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+
+MAGIC = b'ADMIDX01'
+HEADER = struct.Struct('<8sIIQ')  # magic, flags, n_terms, postings size
+
+# The postings in the JSON indexes built by create_inv_idx are strings,
+# this flag allows to give them back as they were
+FLAG_STR_IDS = 1
+
+# Under this size (in bytes) the postings are decoded without numpy
+SMALL_POSTINGS = 64
+
+# ---------------------------------------------------------------------------- #
+#                                Varint encoding                               #
+# ---------------------------------------------------------------------------- #
+
+def encode_postings(doc_ids):
+    '''
+        Given a sorted list of document ids it returns the bytes of the deltas between
+        consecutive ids, each one encoded as a varint (7 bits per byte, the high bit set
+        on all the bytes but the last one)
+    '''
+    out = bytearray()
+    prev = 0
+    for doc in doc_ids:
+        delta = doc - prev
+        prev = doc
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def _decode_small(buf):
+    '''
+        Plain python version of decode_postings, faster than numpy on short postings lists
+    '''
+    ret = []
+    doc = delta = shift = 0
+    for byte in buf:
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            doc += delta
+            ret.append(doc)
+            delta = shift = 0
+    return ret
+
+
+def decode_postings(buf):
+    '''
+        Inverse of encode_postings: given the encoded bytes it returns the sorted document ids
+        as a numpy int32 array. The decoding is vectorized: each varint ends on the first byte
+        without the high bit, so the bytes are grouped by varint and summed with their shifts
+    '''
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int32)
+
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) == len(data): # every delta fits in a single byte
+        deltas = data.astype(np.int64)
+    else:
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+        deltas = np.add.reduceat((data & 0x7f).astype(np.int64) << shifts, starts)
+
+    return np.cumsum(deltas).astype(np.int32)
+
+
+# ---------------------------------------------------------------------------- #
+#                                    Writer                                    #
+# ---------------------------------------------------------------------------- #
+
+def write_binary_index(inv_idx, filename):
+    '''
+        Given an inverted index in the same shape of the JSON ones
+            {term_id: [doc_id, ...]}
+        (ids can be ints or strings of ints) it writes it in the binary format in 'filename'
+    '''
+    terms = sorted(int(t) for t in inv_idx)
+    str_ids = any(isinstance(doc, str) for docs in inv_idx.values() for doc in docs[:1])
+
+    counts = np.zeros(len(terms), dtype='<u4')
+    offsets = np.zeros(len(terms) + 1, dtype='<u8')
+    postings = bytearray()
+
+    # json keys are strings, the ones built by create_inv_idx are ints
+    key = str if all(isinstance(t, str) for t in inv_idx) else int
+    for i, term in enumerate(terms):
+        docs = sorted(int(doc) for doc in inv_idx[key(term)])
+        counts[i] = len(docs)
+        offsets[i] = len(postings)
+        postings += encode_postings(docs)
+    offsets[-1] = len(postings)
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FLAG_STR_IDS if str_ids else 0, len(terms), len(postings)))
+        f.write(np.array(terms, dtype='<u4').tobytes())
+        f.write(counts.tobytes())
+        f.write(offsets.tobytes())
+        f.write(postings)
+
+
+def json_to_binary(json_file, bin_file=None):
+    '''
+        Converts an existing inv_idx.json into the binary format.
+        If bin_file is not given the output is stored next to the json file as inv_idx.bin
+    '''
+    if bin_file is None:
+        bin_file = os.path.join(os.path.dirname(json_file), 'inv_idx.bin')
+
+    with open(json_file, 'r') as f:
+        inv_idx = json.load(f)
+    write_binary_index(inv_idx, bin_file)
+    return bin_file
+
+
+def convert_indexes(path=os.path.join('..', 'shared_stuff', 'indexes')):
+    '''
+        Converts the inv_idx.json of every index directory in 'path' in the binary format
+    '''
+    for idx_dir in os.listdir(path):
+        json_file = os.path.join(path, idx_dir, 'inv_idx.json')
+        if idx_dir.startswith('.') or not os.path.exists(json_file):
+            continue
+        print(f"[{idx_dir}]: converted in {json_to_binary(json_file)}")
+
+# ---------------------------------------------------------------------------- #
+#                                    Reader                                    #
+# ---------------------------------------------------------------------------- #
+
+class BinaryIndex(Mapping):
+    '''
+        Read only view of an inv_idx.bin file.
+
+        It behaves as the dictionary read from the corresponding JSON file, so it can be
+        passed as it is to get_results and get_advanced_results:
+            inv_idx[str(term_id)] -> list of document ids
+        The postings are decoded only when they are requested, the arrays of the last
+        'cache_size' terms asked with postings_array are kept in memory.
+    '''
+
+    def __init__(self, filename, cache_size=4096):
+        self.filename = filename
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, flags, n_terms, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a binary index")
+        self.str_ids = bool(flags & FLAG_STR_IDS)
+
+        pos = HEADER.size
+        self._terms = np.frombuffer(self._mm, dtype='<u4', count=n_terms, offset=pos)
+        pos += 4 * n_terms
+        self._counts = np.frombuffer(self._mm, dtype='<u4', count=n_terms, offset=pos)
+        pos += 4 * n_terms
+        self._offsets = np.frombuffer(self._mm, dtype='<u8', count=n_terms + 1, offset=pos)
+        self._postings_start = pos + 8 * (n_terms + 1)
+
+    def _position(self, term):
+        '''
+            Returns the position of the term in the term dictionary, raising a KeyError if missing
+        '''
+        try:
+            term_id = int(term)
+        except (TypeError, ValueError):
+            raise KeyError(term)
+        pos = int(np.searchsorted(self._terms, term_id))
+        if pos == len(self._terms) or self._terms[pos] != term_id:
+            raise KeyError(term)
+        return pos
+
+    def _raw(self, pos):
+        start = self._postings_start + int(self._offsets[pos])
+        end = self._postings_start + int(self._offsets[pos + 1])
+        return self._mm[start:end]
+
+    def postings_array(self, term):
+        '''
+            Returns the postings of the term as a sorted numpy int32 array
+        '''
+        key = str(term)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        docs = decode_postings(self._raw(self._position(term)))
+        if self.cache_size > 0:
+            self._cache[key] = docs
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return docs
+
+    def doc_freq(self, term):
+        '''
+            Returns the number of documents containing the term without decoding its postings
+        '''
+        return int(self._counts[self._position(term)])
+
+    def __getitem__(self, term):
+        raw = self._raw(self._position(term))
+        docs = _decode_small(raw) if len(raw) < SMALL_POSTINGS else decode_postings(raw).tolist()
+        if self.str_ids:
+            return [str(doc) for doc in docs]
+        return docs
+
+    def __contains__(self, term):
+        try:
+            self._position(term)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return (str(term) for term in self._terms)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def close(self):
+        # the numpy views keep a reference to the map, drop them first
+        self._terms = self._counts = self._offsets = None
+        self._cache.clear()
+        self._mm.close()
+
+
+def inv_idx_file(idx_dir):
+    '''
+        Given the directory of an index it returns the file its inverted index should be read from:
+        the binary version if it exists and it's not older than the JSON one, otherwise the JSON file
+    '''
+    json_file = os.path.join(idx_dir, 'inv_idx.json')
+    bin_file = os.path.join(idx_dir, 'inv_idx.bin')
+
+    if os.path.exists(bin_file) and \
+            (not os.path.exists(json_file) or os.path.getmtime(bin_file) >= os.path.getmtime(json_file)):
+        return bin_file
+    return json_file
+
+
+def read_inv_idx(filename):
+    '''
+        Reads an inverted index from a binary or JSON file
+    '''
+    if filename.endswith('.bin'):
+        return BinaryIndex(filename)
+
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def load_inv_idx(idx_dir):
+    '''
+        Given the directory of an index it returns its inverted index (see inv_idx_file)
+    '''
+    return read_inv_idx(inv_idx_file(idx_dir))
+
+
+if __name__ == '__main__':
+    convert_indexes()
@@ -0,0 +1,189 @@
+'''
+
+    This file contains the typed columnar version of total_pages.tsv: the info of the animes are
+    stored in a Parquet (or Arrow IPC) file where
+        * the lists (related_anime, characters, voices, staff, top_reviews) are native list columns
+        * the dates are timestamps and the numbers are nullable integers or floats
+    so nothing has to be decoded with ast.literal_eval when the file is loaded and a loader can read
+    only the columns it needs (i.e. just synopsis for the indexes or top_reviews for the sentiment).
+
+    A table written range by range (see html_parser.save_tsv_info) is a directory with the same name,
+    total_pages.parquet/part-<first row>.parquet, with a part file for every range: appending a range
+    writes only its own rows and the parts are read back in the order of their first row.
+
+    It needs the pyarrow package.
+
+'''
+
+import os
+import shutil
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FIELDS = ['title', 'type', 'episodes', 'start_date', 'end_date', 'score', 'users', 'ranked', 'popularity', 'members',
+          'synopsis', 'related_anime', 'characters', 'voices', 'staff', 'top_reviews']
+
+LIST_FIELDS = ['related_anime', 'characters', 'voices', 'staff', 'top_reviews']
+
+
+def _check_pyarrow():
+    if pa is None:
+        raise ImportError("the columnar output needs the pyarrow package")
+
+
+def schema():
+    '''
+        Returns the arrow schema of the anime table
+    '''
+    _check_pyarrow()
+    return pa.schema([
+        ('title', pa.string()),
+        ('type', pa.string()),
+        ('episodes', pa.int32()),
+        ('start_date', pa.timestamp('s')),
+        ('end_date', pa.timestamp('s')),
+        ('score', pa.float64()),
+        ('users', pa.int64()),
+        ('ranked', pa.int64()),
+        ('popularity', pa.int64()),
+        ('members', pa.int64()),
+        ('synopsis', pa.string()),
+        ('related_anime', pa.list_(pa.string())),
+        ('characters', pa.list_(pa.string())),
+        ('voices', pa.list_(pa.string())),
+        ('staff', pa.list_(pa.struct([('name', pa.string()), ('roles', pa.list_(pa.string()))]))),
+        ('top_reviews', pa.list_(pa.string())),
+    ])
+
+
+def infos_to_table(infos):
+    '''
+        Given the list of dictionaries returned by html_parser.get_total_info it returns an arrow table
+    '''
+    columns = {f: [info.get(f) for info in infos] for f in FIELDS}
+    columns['staff'] = [[{'name': name, 'roles': roles} for name, roles in staff] if staff is not None else None
+                        for staff in columns['staff']]
+    return pa.Table.from_pydict(columns, schema=schema())
+
+
+def table_format(path):
+    '''
+        Returns 'parquet' or 'arrow' according to the extension of the file
+    '''
+    ext = os.path.splitext(path)[1]
+    if ext == '.parquet':
+        return 'parquet'
+    if ext in ('.arrow', '.feather'):
+        return 'arrow'
+    raise ValueError(f"unknown columnar format: {path}")
+
+
+def part_name(path, first_row):
+    '''
+        Returns the part file of the table in path (a directory) that starts from first_row
+    '''
+    return os.path.join(path, f"part-{first_row:09d}{os.path.splitext(path)[1]}")
+
+
+def parts(path):
+    '''
+        Returns the files of the table saved in path in the order of their rows:
+        the part files if path is a directory, path itself if it's a single file, none if there is no table
+    '''
+    if os.path.isdir(path):
+        ext = os.path.splitext(path)[1]
+        return [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.startswith('part-') and f.endswith(ext)]
+    if os.path.exists(path):
+        return [path]
+    return []
+
+
+def _num_rows(file):
+    if table_format(file) == 'parquet':
+        return pq.read_metadata(file).num_rows
+    return feather.read_table(file, memory_map=True).num_rows
+
+
+def num_rows(path):
+    '''
+        Returns the number of rows of the table saved in path (0 if there is no table)
+    '''
+    _check_pyarrow()
+    return sum(_num_rows(part) for part in parts(path))
+
+
+def _write(table, file):
+    # written under another name first: a run killed while writing doesn't leave half a part
+    tmp = file + '.tmp'
+    if table_format(file) == 'parquet':
+        pq.write_table(table, tmp, compression='zstd')
+    else:
+        feather.write_feather(table, tmp, compression='zstd')
+    os.replace(tmp, file)
+
+
+def write_table(infos, path, first_row=None):
+    '''
+        Saves the info of the animes in path (.parquet or .arrow), replacing the table already there.
+        With first_row they are appended to the table in path (if any) as a new part file, see parts:
+        the table must have exactly first_row rows, so that the row of an anime stays the index of its page
+    '''
+    _check_pyarrow()
+    table = infos_to_table(infos)
+    if first_row is None:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        _write(table, path)
+        return
+
+    n_rows = num_rows(path)
+    if n_rows != first_row:
+        raise ValueError(f"{path} has {n_rows} rows, the new rows can't start from row {first_row}")
+    if os.path.isfile(path):
+        # a table saved in a single file becomes the first part
+        os.replace(path, path + '.tmp')
+        os.mkdir(path)
+        os.replace(path + '.tmp', part_name(path, 0))
+    os.makedirs(path, exist_ok=True)
+    _write(table, part_name(path, first_row))
+
+
+def read_table(path, columns=None):
+    '''
+        Reads the arrow table of path (all its parts), only the given columns if any
+    '''
+    _check_pyarrow()
+    files = parts(path)
+    if not files:
+        raise FileNotFoundError(path)
+    if table_format(path) == 'parquet':
+        tables = [pq.read_table(file, columns=columns) for file in files]
+    else:
+        tables = [feather.read_table(file, columns=columns) for file in files]
+    return pa.concat_tables(tables)
+
+
+def load_df(path="../data/tsv_files/total_pages.parquet", columns=None):
+    '''
+        Loads the anime table (or just the given columns) in a dataframe.
+        The list columns are python lists, as after the literal_eval of the tsv cells
+        (the staff as [name, roles] pairs), the missing numbers are <NA>
+    '''
+    table = read_table(path, columns)
+    df = table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype()}.get)
+    for col in LIST_FIELDS:
+        if col in table.column_names:
+            values = table.column(col).to_pylist()
+            if col == 'staff':
+                values = [[[el['name'], el['roles']] for el in staff] if staff is not None else None
+                          for staff in values]
+            df[col] = values
+    return df
+
@@ -0,0 +1,84 @@
+'''
+
+    This file contains the store of the per document metadata shown with the results of the
+    queries (the url of each anime, and optionally its title), shared by search_eng and advanced_queryer.
+
+    The url file is mapped in memory and the offsets of its lines are computed once with numpy,
+    so the url of a document is a slice of the map (O(1)) and the file is read only when it changes.
+
+'''
+
+import mmap
+import os
+
+import numpy as np
+
+URL_FILE = os.path.join('..', 'shared_stuff', 'url_list.txt')
+
+
+class DocMetadata:
+    '''
+        Metadata of the documents, addressed by document id (the line of the url file):
+            meta.url(doc_id), meta.urls(doc_ids), meta.title(doc_id)
+        The titles are available only after set_titles.
+    '''
+
+    def __init__(self, url_file=URL_FILE):
+        self.url_file = url_file
+        with open(url_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+
+        data = np.frombuffer(self._mm, dtype=np.uint8)
+        ends = np.flatnonzero(data == ord('\n'))
+        if len(data) > 0 and data[-1] != ord('\n'): # last line without the new line
+            ends = np.append(ends, len(data))
+        self._starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64) if len(ends) else ends
+        self._ends = ends.astype(np.int64)
+
+        self.titles = None
+
+    def __len__(self):
+        return len(self._starts)
+
+    def url(self, doc_id):
+        '''
+            Returns the url of the document
+        '''
+        doc_id = int(doc_id)
+        return self._mm[self._starts[doc_id]:self._ends[doc_id]].decode().rstrip('\r')
+
+    def urls(self, doc_ids):
+        '''
+            Returns the list of the urls of the documents
+        '''
+        return [self.url(doc_id) for doc_id in doc_ids]
+
+    def set_titles(self, df):
+        '''
+            Keeps the titles of the dataframe (one row per document) as an array
+        '''
+        self.titles = df['title'].to_numpy()
+        return self
+
+    def title(self, doc_id):
+        '''
+            Returns the title of the document
+        '''
+        if self.titles is None:
+            raise ValueError("the titles haven't been set, see set_titles")
+        return self.titles[int(doc_id)]
+
+
+_CACHE = dict() # url file -> (mtime, DocMetadata)
+
+def get_doc_metadata(url_file=URL_FILE):
+    '''
+        Returns the DocMetadata of the url file, loaded only the first time it's asked
+        (or again if the file has been modified)
+    '''
+    mtime = os.stat(url_file).st_mtime_ns
+    cached = _CACHE.get(url_file)
+    if cached is None or cached[0] != mtime:
+        cached = _CACHE[url_file] = (mtime, DocMetadata(url_file))
+    return cached[1]
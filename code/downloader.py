@@ -1,10 +1,22 @@
 import requests
 import os
 import argparse
+import asyncio
+import aiohttp
+from functools import partial
+from urllib.parse import urlparse
 from time import *
 from random import *
+from manifest import DownloadManifest, DONE, FAILED, CAPTCHA
+from page_store import PageStore
 
-def download_pages(f_path, out_path='', base=0, to=-1):
+# to make requests in a safer way
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36'}
+
+# The button in the page the site gives back when it thinks we are a robot
+ERROR_BTN = "<button type=\"submit\" class=\"g-recaptcha\" data-sitekey=\"6Ld_1aIZAAAAAF6bNdR67ICKIaeXLKlbhE7t2Qz4\" data-callback='onSubmit' data-action='submit'>Submit</button>"
+
+def download_pages(f_path, out_path='', base=0, to=-1, manifest=None, refresh=False, store=None):
     '''
         This funtion dowloads the html pages going from 'base' to 'to'-1 that corresponds to the url of the file located in fpath.
         
@@ -29,11 +41,18 @@ def download_pages(f_path, out_path='', base=0, to=-1):
                 The index of the url from which start the download
             end=len(url file): int
                 The index of the file on which stop
+            manifest=None: DownloadManifest
+                If given, the pages already downloaded are skipped and every download is recorded in it
+            refresh=False: bool
+                With a manifest, download again the pages already downloaded, but with conditional
+                requests: only the pages changed since the last time are transferred
+            store=None: PageStore
+                If given, the pages are saved in the compressed store instead of out_path.
+                A page is recorded in the manifest only when its chunk is flushed: close the store at the end
     '''
 
     number=base
-    # to make requests in a safer way
-    headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36'}
+    headers = HEADERS
     
     # Getting all the urls
     with open(f_path) as file:
@@ -45,30 +64,242 @@ def download_pages(f_path, out_path='', base=0, to=-1):
     while idx<to:
 
         url = lines[idx]
-        response=requests.get(url, headers=headers)
+        name=('article_%d.html' % (number))
+        req_headers = headers
+
+        if manifest is not None:
+            # Already downloaded in a previous run
+            if not refresh and (manifest.is_done(idx, url) or (store is None and
+                                manifest.adopt_existing(idx, url, os.path.join(out_path, name), is_blocked))):
+                print(f"request: {number} already downloaded")
+                number+=1
+                idx+=1
+                continue
+            if refresh:
+                req_headers = {**headers, **manifest.conditional_headers(idx, url)}
+
+        response=requests.get(url.strip(), headers=req_headers)
+
+        error_btn = ERROR_BTN
 
         # Ops.. We've done too much requests, let's sleep for a while hoping to be free to ask again
-        if response.status_code==403:
+        if is_blocked(response.status_code, response.text):
+            if manifest is not None:
+                manifest.record(idx, url, FAILED if response.status_code==403 else CAPTCHA, response.status_code)
             sleep_time =  randint(5,25)
-            print(f"An error occoured, I'll sleep for {sleep_time} seconds")
+            print(f"An error occoured (response code: {response.status_code} error button in text?: {error_btn in response.text}), I'll sleep for {sleep_time} seconds")
             sleep(sleep_time)
             continue
         
-        error_btn = "<button type=\"submit\" class=\"g-recaptcha\" data-sitekey=\"6Ld_1aIZAAAAAF6bNdR67ICKIaeXLKlbhE7t2Qz4\" data-callback='onSubmit' data-action='submit'>Submit</button>"
-        
         # Some output log, just to be up to date
-        print(f"request: {number} response code: {response.status_code} error button in text?: {error_btn in response.text}")
+        print(f"request: {number} response code: {response.status_code}")
         
+        # The page hasn't changed since the last download
+        if response.status_code==304:
+            manifest.record(idx, url, DONE, 304, response.headers)
+            number+=1
+            idx+=1
+            continue
         
-        # Everithing is going well, let's save
-        name=('article_%d.html' % (number))
-        html_file = open(os.path.join(out_path,name),"w")
-        html_file.write(response.text)
-        html_file.close()
+        # Everithing is going well, let's save (the page is recorded as done only once it's on disk)
+        on_saved = None
+        if manifest is not None:
+            on_saved = partial(manifest.record, idx, url, DONE, response.status_code, dict(response.headers), response.text)
+        save_page(out_path, number, response.text, store, on_saved)
         number+=1
         idx+=1
 
 
+# ---------------------------------------------------------------------------- #
+#                                 Async engine                                 #
+# ---------------------------------------------------------------------------- #
+
+class TokenBucket:
+    '''
+        Rate limiter for the requests to a host: a request can start only when there's a token
+        in the bucket, and the tokens are refilled at 'rate' per second (up to 'capacity').
+
+        The rate is adaptive: every time the host blocks us (403 or captcha page) it's halved
+        and the bucket stays closed for a while, then it grows back slowly after each success.
+    '''
+
+    def __init__(self, rate, capacity=None, min_rate=0.05):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.last = monotonic()
+        self.paused_until = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        '''
+            Waits until a request can be made
+        '''
+        async with self.lock:
+            while True:
+                now = monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def slow_down(self, pause):
+        '''
+            Called when the host blocks us: halves the rate and stops the requests for 'pause' seconds
+        '''
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, monotonic() + pause)
+
+    def speed_up(self):
+        '''
+            Called after a successful request: the rate grows back (additively) to the initial one
+        '''
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def save_page(out_path, idx, text, store=None, on_saved=None):
+    '''
+        Saves the page in article_idx.html in out_path or, if given, in the page store.
+        If given, on_saved() is called once the page is on disk: right away for a file,
+        when its chunk is flushed for the store
+    '''
+    if store is not None:
+        store.put(idx, text, on_saved)
+        return
+    with open(os.path.join(out_path, 'article_%d.html' % (idx)), "w") as html_file:
+        html_file.write(text)
+    if on_saved is not None:
+        on_saved()
+
+
+def is_blocked(status, text):
+    '''
+        Returns True if the response means that the site is blocking us (too many requests)
+    '''
+    return status == 403 or ERROR_BTN in text
+
+
+async def fetch_page(session, buckets, url, idx, out_path, min_pause, max_pause, max_errors,
+                     manifest=None, refresh=False, store=None):
+    '''
+        Downloads the page of url in article_idx.html, waiting for its host's bucket
+        and retrying (after slowing down) every time the site blocks us.
+        With a manifest the outcome is recorded and the pages already downloaded are skipped
+        (or, when refreshing, requested again only if they have changed).
+        It returns True if the page has been saved (or it was already).
+    '''
+    fname = os.path.join(out_path, 'article_%d.html' % (idx))
+    headers = dict()
+    if manifest is not None:
+        if not refresh and (manifest.is_done(idx, url) or
+                            (store is None and manifest.adopt_existing(idx, url, fname, is_blocked))):
+            return True
+        if refresh:
+            headers = manifest.conditional_headers(idx, url)
+
+    bucket = buckets[urlparse(url).netloc]
+    errors = 0
+    while True:
+        await bucket.acquire()
+        try:
+            async with session.get(url.strip(), headers=headers) as response:
+                status = response.status
+                resp_headers = dict(response.headers)
+                text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            errors += 1
+            print(f"request: {idx} failed ({errors}/{max_errors}): {e!r}")
+            if errors >= max_errors:
+                if manifest is not None:
+                    manifest.record(idx, url, FAILED)
+                return False
+            await asyncio.sleep(min_pause)
+            continue
+
+        if is_blocked(status, text):
+            if manifest is not None:
+                manifest.record(idx, url, FAILED if status == 403 else CAPTCHA, status)
+            sleep_time = randint(min_pause, max_pause)
+            print(f"request: {idx} response code: {status} blocked, slowing down for {sleep_time} seconds")
+            bucket.slow_down(sleep_time)
+            continue
+
+        bucket.speed_up()
+        print(f"request: {idx} response code: {status}")
+        if status == 304: # not changed since the last download
+            manifest.record(idx, url, DONE, status, resp_headers)
+            return True
+
+        # recorded as done only once the page is on disk
+        on_saved = partial(manifest.record, idx, url, DONE, status, resp_headers, text) if manifest is not None else None
+        save_page(out_path, idx, text, store, on_saved)
+        return True
+
+
+async def download_pages_async(f_path, out_path='', base=0, to=-1, concurrency=8, rate=2.0,
+                               min_pause=5, max_pause=25, max_errors=5, timeout=60,
+                               manifest=None, refresh=False, store=None):
+    '''
+        Same as download_pages, but the pages are downloaded concurrently.
+
+        Arguments
+        _________
+
+            f_path, out_path, base, to:
+                As in download_pages
+            concurrency=8: int
+                The max number of requests (and of open connections) at the same time
+            rate=2.0: float
+                The max number of requests per second to the same host
+            min_pause, max_pause: int
+                The range of the seconds to wait when the site blocks us
+            max_errors=5: int
+                After so many network errors a page is skipped
+            timeout=60: int
+                Seconds before giving up a request
+            manifest, refresh, store:
+                As in download_pages
+
+        It returns the list of the indices of the pages that couldn't be downloaded
+    '''
+    with open(f_path) as file:
+        lines = file.read().splitlines()
+
+    to = min(to, len(lines)) if to >=0 else len(lines)
+
+    buckets = {urlparse(url).netloc: TokenBucket(rate) for url in lines[base:to]}
+    queue = asyncio.Queue()
+    for idx in range(base, to):
+        queue.put_nowait(idx)
+    failed = []
+
+    async def worker(session):
+        while True:
+            try:
+                idx = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if not await fetch_page(session, buckets, lines[idx], idx, out_path, min_pause, max_pause, max_errors,
+                                    manifest, refresh, store):
+                failed.append(idx)
+
+    # a single session: the connections are pooled and reused among the requests
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(headers=HEADERS, connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+
+    return sorted(failed)
+
+
 def parse_args():
     '''
         This methods parses the arguments from the command line
@@ -78,7 +309,7 @@ def parse_args():
     # Instantiating the parser 
 
     parser = argparse.ArgumentParser(description="This script will download the html pages in the url of the f_path given in input",
-                                    usage="\n -fp F_PATH [-h] [--out OUT_PATH] [--base FROM] [--to TO]")
+                                    usage="\n -fp F_PATH [-h] [--out OUT_PATH] [--base FROM] [--to TO] [--concurrency N] [--rate R] [--sync] [--manifest PATH] [--refresh] [--store]")
     
     # Setting up the arguments
 
@@ -95,6 +326,24 @@ def parse_args():
     parser.add_argument('--to', type=int,
                         help='the index of the url on wich to stop (excluded)')
 
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="The max number of pages downloaded at the same time")
+
+    parser.add_argument('--rate', type=float, default=2.0,
+                        help="The max number of requests per second to the site (it's lowered automatically when the site blocks us)")
+
+    parser.add_argument('--sync', action='store_true',
+                        help="Download the pages one at a time, without the async engine")
+
+    parser.add_argument('--manifest', type=str,
+                        help="The file where the downloads are recorded (by default manifest.sqlite in the output directory)")
+
+    parser.add_argument('--refresh', action='store_true',
+                        help="Download again the pages already downloaded, if they have changed")
+
+    parser.add_argument('--store', action='store_true',
+                        help="Save the pages in a compressed page store in the output directory instead of one file per page")
+
     args = parser.parse_args()
 
     if args.fp is None:
@@ -126,7 +375,27 @@ def main():
     else:
         raise ValueError("You need to provide a valid path in order to use this tool")
     
+    manifest = DownloadManifest(args.manifest if args.manifest is not None else os.path.join(out, 'manifest.sqlite'))
+    store = PageStore(out if out else '.') if args.store else None
+
     # Actually start the program
-    download_pages(args.fp, out_path=out, base=base, to=to)
+    try:
+        if args.sync:
+            download_pages(args.fp, out_path=out, base=base, to=to, manifest=manifest, refresh=args.refresh,
+                           store=store)
+        else:
+            failed = asyncio.run(download_pages_async(args.fp, out_path=out, base=base, to=to,
+                                                      concurrency=args.concurrency, rate=args.rate,
+                                                      manifest=manifest, refresh=args.refresh, store=store))
+            if failed:
+                print(f"These pages couldn't be downloaded: {failed}")
+    finally:
+        # the pages still in memory are written even if the download is interrupted
+        if store is not None:
+            store.close()
+    print(f"Manifest: {manifest.summary()}")
+    manifest.close()
+
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -21,25 +21,109 @@
 '''
 
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import bs4
+import contextlib
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from time import perf_counter
+
+import columnar
+from page_store import is_page_store, open_store
 
 # ---------------------------------------------------------------------------- #
 #                                  HTML PARSER                                 #
 # ---------------------------------------------------------------------------- #
 
+# ------------------------------ Parser backends ----------------------------- #
+
+# The only elements read by the scraping functions below (tag, attribute, value)
+RELEVANT_ELEMENTS = [('title', None, None),
+                     ('div', 'class', 'spaceit_pad'),
+                     ('p', 'itemprop', 'description'),
+                     ('table', 'class', 'anime_detail_related_anime'),
+                     ('div', 'class', 'spaceit textReadability word-break pt8 mt8'),
+                     ('div', 'class', 'detail-characters-list clearfix')]
+
+
+def is_relevant(tag, attrs=None):
+    '''
+        True if the tag (a Tag or a name and its attributes) is one of the RELEVANT_ELEMENTS,
+        matched as find_all does (the whole class attribute or one of its classes)
+    '''
+    if attrs is None:
+        if not isinstance(tag, bs4.element.Tag):
+            return False
+        name, attrs = tag.name, tag.attrs
+    else:
+        name, attrs = tag, dict(attrs)
+
+    for el_name, attr, value in RELEVANT_ELEMENTS:
+        if name != el_name:
+            continue
+        if attr is None:
+            return True
+        found = attrs.get(attr)
+        if found is None:
+            continue
+        words = found if isinstance(found, list) else found.split()
+        if value == ' '.join(words) or value in words:
+            return True
+    return False
+
+
+class RelevantStrainer(SoupStrainer):
+    '''
+        SoupStrainer letting the parser build only the RELEVANT_ELEMENTS (and their content)
+    '''
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return is_relevant(name, attrs if attrs is not None else dict())
+
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        # bs4 < 4.13 asks this one instead of allow_tag_creation
+        if isinstance(markup_name, bs4.element.Tag):
+            return markup_name if is_relevant(markup_name) else None
+        return markup_name if is_relevant(markup_name, markup_attrs) else None
+
+
+# name: (BeautifulSoup tree builder, parse only the relevant elements?)
+# The lxml backends need the lxml package
+BACKENDS = {
+    'html.parser': ('html.parser', False),
+    'strainer': ('html.parser', True),
+    'lxml': ('lxml', False),
+    'lxml-strainer': ('lxml', True),
+}
+
+DEFAULT_BACKEND = 'html.parser'
+
+
+def make_soup(text, backend=DEFAULT_BACKEND):
+    '''
+        Parses the html text with one of the BACKENDS. The strainer ones build the tree only for the
+        RELEVANT_ELEMENTS (and their content), so both the parsing and the following find_all are faster
+    '''
+    builder, strain = BACKENDS[backend]
+    if strain:
+        return BeautifulSoup(text, builder, parse_only=RelevantStrainer())
+    return BeautifulSoup(text, builder)
+
 # ----------------------------- Support functions ---------------------------- #
 
-def get_soup(fname):
+def get_soup(fname, store=None, backend=DEFAULT_BACKEND):
     '''
         Given the path of a html file this function returns a BeautifulSoup object paserd with the html.parser
-        with the content of the file
+        (or another of the BACKENDS) with the content of the file.
+        If a PageStore is given, fname is the index of the page in the store
     ''' 
 
+    if store is not None:
+        return make_soup(store[fname], backend)
+
     f = open(fname, 'r')
-    soup = BeautifulSoup(f.read(), 'html.parser')
+    soup = make_soup(f.read(), backend)
     f.close()
     return soup
 
@@ -231,13 +315,13 @@ def get_characters_voices(div, ret):
 
 # --------------------------- Putting all togheter --------------------------- #
 
-def get_total_info(fname):
+def get_total_info(fname, store=None, backend=DEFAULT_BACKEND):
     ''' 
-        Putting all togheter here we take a fname containing an html.
+        Putting all togheter here we take a fname containing an html (or the index of a page in the store).
         So this function returns a dictionary containing all the info of interest with the functions above
     '''
     ret = dict()
-    soup = get_soup(fname)
+    soup = get_soup(fname, store, backend)
     get_title(soup, ret)
     get_left_attributes(soup, ret)
     get_synopsis(soup, ret)
@@ -267,27 +351,36 @@ def get_total_info(fname):
 
 # -------------------------- Employing the functions ------------------------- #
 
-def get_total_info_from_idx(idx, base_dir=os.path.join('..', 'data', 'html_pages')):
+def get_total_info_from_idx(idx, base_dir=os.path.join('..', 'data', 'html_pages'), backend=DEFAULT_BACKEND):
     ''' 
-        Given the index of an anime this function returns the dictionary with the information about that
+        Given the index of an anime this function returns the dictionary with the information about that.
+        The base_dir can be a directory of html files or a page store
     '''
 
+    if is_page_store(base_dir):
+        return get_total_info(idx, open_store(base_dir), backend)
+
     fname = f"article_{str(idx)}.html"
-    return get_total_info(os.path.join(base_dir, fname))
+    return get_total_info(os.path.join(base_dir, fname), backend=backend)
 
 
-def get_tsv_from_idx(idx, base_dir=os.path.join('..', 'data', 'html_pages')):
+def get_tsv_from_idx(idx, base_dir=os.path.join('..', 'data', 'html_pages'), backend=DEFAULT_BACKEND):
     ''' 
         Given an index and a base_dir this function retrieves the info of the i-th anime in tsv format
         using its file in the base_dir directory
     '''
+    return info_to_tsv(get_total_info_from_idx(idx, base_dir, backend))
+
+
+def info_to_tsv(info_dict):
+    '''
+        Given the dictionary of get_total_info it returns the header and the row of the tsv
+    '''
     # Fields of the tsv
     fields = ['title', 'type', 'episodes', 'start_date', 'end_date', 'score', 'users', 'ranked', 'popularity', 'members', 'synopsis', 'related_anime', 'characters', 'voices', 'staff', 'top_reviews']
     head = '\t'.join(fields)
     ret = '' 
     
-    # Getting the dictionary info
-    info_dict = get_total_info_from_idx(idx, base_dir)
     for f in fields:
         val = str(info_dict[f])
         if val is None:
@@ -298,35 +391,131 @@ def get_tsv_from_idx(idx, base_dir=os.path.join('..', 'data', 'html_pages')):
     return head, ret[:-1]
 
 
-def save_tsv_info(start, end, src_dir='../data/html_pages', dst_dir='../data/tsv_files'):
+def empty_info():
+    '''
+        The info of a page that couldn't be parsed: all the fields are missing (the lists are empty)
+    '''
+    return {f: [] if f in columnar.LIST_FIELDS else None for f in columnar.FIELDS}
+
+
+def tsv_row_job(args):
+    '''
+        Worker of save_tsv_info: given (idx, src_dir, backend) it returns (idx, tsv row, None),
+        or (idx, None, error) if the page couldn't be parsed
+    '''
+    idx, src_dir, backend = args
+    try:
+        return idx, get_tsv_from_idx(idx, src_dir, backend)[1], None
+    except Exception as e:
+        return idx, None, repr(e)
+
+
+def plain_value(value):
+    '''
+        Returns the value with the strings of the soup (NavigableString, that keep a reference to the
+        whole tree) converted to plain str, also inside the lists
+    '''
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [plain_value(v) for v in value]
+    return value
+
+
+def info_job(args):
+    '''
+        Same as tsv_row_job, but it returns the dictionary of get_total_info_from_idx
+        (with plain values, so that it can be sent back from the worker process)
+    '''
+    idx, src_dir, backend = args
+    try:
+        info = get_total_info_from_idx(idx, src_dir, backend)
+        return idx, {field: plain_value(value) for field, value in info.items()}, None
+    except Exception as e:
+        return idx, None, repr(e)
+
+
+def save_tsv_info(start, end, src_dir='../data/html_pages', dst_dir='../data/tsv_files', workers=1, chunksize=16,
+                  backend=DEFAULT_BACKEND, fmt='tsv'):
     '''
         This function retrieves the info from the files in the src_dir directory and saves the relative tsv in the dst_dir.
         You can pass a start, end indexes from which start and stop (remember that last is not included).
 
         These info in tsv format will be stored in a total_pages.tsv too containing the info for all the pages.
+        With fmt='parquet' or fmt='arrow' the info are instead stored only in a typed columnar
+        total_pages.parquet (or .arrow) table, see columnar.py: as for the tsv the ranges are appended (each one
+        in its own part file), so the existing table must have exactly 'start' rows (a ValueError is raised
+        before parsing otherwise).
+
+        With workers > 1 (None to use all the cpus) the pages are parsed by a pool of processes, the rows are
+        anyway written in the order of the indices. A page that can't be parsed doesn't stop the run: it gets
+        a row of the total (or of the table) with all the fields missing (see empty_info), so that every row stays aligned with
+        the index of its page (and with the url list), and the function returns the list of (idx, error)
+        of the failed pages.
+        The backend is the parser used for the pages (see BACKENDS).
     '''
     if not os.path.exists(dst_dir):
         os.mkdir(dst_dir)
     
     fields = ['title', 'type', 'episodes', 'start_date', 'end_date', 'score', 'users', 'ranked', 'popularity', 'members', 'synopsis', 'related_anime', 'characters', 'voices', 'staff', 'top_reviews']
+    head = '\t'.join(fields)
     
     # Creating the total tsv 
     total_tsv = os.path.join(dst_dir, 'total_pages.tsv')
-    if not os.path.exists(total_tsv):
+    table_file = os.path.join(dst_dir, f'total_pages.{fmt}')
+    if fmt != 'tsv' and columnar.num_rows(table_file) != start:
+        raise ValueError(f"{table_file} has {columnar.num_rows(table_file)} rows, "
+                         f"the next pages must start from that idx to stay aligned with the rows, not from {start}")
+    if fmt == 'tsv' and not os.path.exists(total_tsv):
         with open(total_tsv, 'x') as out:
-            out.write('\t'.join(fields)+'\n')
+            out.write(head+'\n')
+
+    jobs = [(idx, src_dir, backend) for idx in range(start, end)]
+    job = tsv_row_job if fmt == 'tsv' else info_job
+    failed = []
+    infos = []
+    begin = perf_counter()
+
+    # A single writer for the total, the rows arrive in the order of the indices
+    with contextlib.ExitStack() as stack:
+        if fmt == 'tsv':
+            total = stack.enter_context(open(total_tsv, 'a', buffering=2**20))
+        if workers == 1:
+            results = map(job, jobs)
+        else:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            results = executor.map(job, jobs, chunksize=chunksize)
+
+        # Iterating over the desired indices
+        # value is the tsv row of the page, or its info dictionary with fmt != 'tsv'
+        for idx, value, error in results:
+            if error is not None:
+                failed.append((idx, error))
+                print(f"idx: {idx} FAILED! {error}")
+                # an empty row keeps the next ones aligned with their pages
+                if fmt == 'tsv':
+                    total.write('\n' + info_to_tsv(empty_info())[1])
+                else:
+                    infos.append(empty_info())
+                continue
+            if fmt != 'tsv':
+                infos.append(value)
+                continue
+            tsv_row = value
+            out_name = f"article_{str(idx).zfill(5)}.tsv"
+            
+            # Creating the output file
+            with open(os.path.join(dst_dir, out_name), 'w') as f:
+                f.write(head + '\n' + tsv_row)
+            
+            # adding a line to the total
+            total.write('\n'+tsv_row)
+            print(f"idx: {idx} DONE!")
 
-    # Iterating over the desired indices
-    for idx in range(start, end):
-        # Getting the tsv data
-        tsv_h, tsv_c = get_tsv_from_idx(idx, src_dir)
-        out_name = f"article_{str(idx).zfill(5)}.tsv"
-        
-        # Creating the output file
-        with open(os.path.join(dst_dir, out_name), 'w') as f:
-            f.write(tsv_h + '\n' + tsv_c)
-        
-        # adding a line to the total
-        with open(os.path.join(total_tsv), 'a') as f:
-            f.write('\n'+tsv_c)     
-        print(f"idx: {idx} DONE!")   
\ No newline at end of file
+    if fmt != 'tsv':
+        columnar.write_table(infos, table_file, first_row=start)
+
+    elapsed = perf_counter() - begin
+    print(f"{len(jobs) - len(failed)} pages saved in {elapsed:.1f} s ({len(jobs) / max(elapsed, 1e-9):.1f} pages/s), "
+          f"{len(failed)} failed: {[idx for idx, _ in failed]}")
+    return failed
@@ -0,0 +1,665 @@
+'''
+
+    This file contains the pipeline that builds the vocabularies and the inverted indexes of all the
+    fields used by the search engines (synopsis, staff, voices, characters and title) in one go.
+
+    The rows of total_pages.tsv are streamed in shards (see tsv_reader.py) to a pool of processes:
+    each worker preprocesses the five fields of its rows and builds the partial postings,
+    then the partial indexes are merged and saved in the usual layout:
+        <out_dir>/<field>/vocabulary.json
+        <out_dir>/<field>/inv_idx.json
+        <out_dir>/<field>/doc_terms.json   (the words of each document with their counts, for the updates)
+    and the synopsis has also its tf-idf index (inv_idx_tfldf.json, idf.json and doc_norms.npy,
+    see search_eng.TfidfIndex), keyed by the same word ids.
+
+    They can also be built straight from the html pages (build_from_pages): the dictionaries of
+    html_parser.get_total_info are preprocessed as soon as they are parsed and go directly into the
+    postings, in one pass and without writing and reading back the tsv (that can be written on the side).
+
+    The indexes can then be updated incrementally when new pages are scraped, passing only the
+    ids of the new or changed documents (or deleting some documents): the existing words keep
+    their ids and the synopsis idf.json (and tf-idf index) is updated from the counts in doc_terms.json.
+
+    It can be launched from the terminal, i.e.:
+        python index_builder.py --tsv ../data/tsv_files/total_pages.tsv --workers 8
+        python index_builder.py --tsv ../data/tsv_files/total_pages.tsv --update 19123 19124
+        python index_builder.py --delete 42
+        python index_builder.py --pages 0 19123 --src ../data/html_pages --save_tsv ../data/tsv_files/total_pages.tsv
+
+'''
+
+import argparse
+import ast
+import contextlib
+import csv
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+import html_parser
+from columnar import FIELDS as TSV_FIELDS
+from search_eng import Preprocessor, create_doc_norms, read_dict_from_file, save_dict_to_file
+from tsv_reader import NULLS, iter_chunks, iter_records
+
+FIELDS = ['synopsis', 'staff', 'voices', 'characters', 'title']
+
+# the tf-idf index of the synopsis (see search_eng.TfidfIndex), saved next to its inverted index
+TFIDF_FILES = ['inv_idx_tfldf.json', 'doc_norms.npy']
+
+# ---------------------------------------------------------------------------- #
+#                               Support functions                              #
+# ---------------------------------------------------------------------------- #
+
+def field_text(field, value):
+    '''
+        Given a field and its value as read from the tsv (the lists are saved as their str)
+        it returns the text to preprocess, as done in the notebook:
+            -staff: the names of the staff members
+            -voices, characters: all the names
+            -title, synopsis: the text itself
+        A missing value (None, or '' and 'None' as written in the tsv) is an empty text.
+    '''
+    if value is None or (isinstance(value, str) and value in NULLS):
+        return ''
+    if field in ('staff', 'voices', 'characters'):
+        names = ast.literal_eval(value) if isinstance(value, str) else value
+        if not names:
+            return ''
+        if field == 'staff':
+            return ' '.join(el[0] for el in names)
+        return ' '.join(names)
+    return value
+
+
+def read_fields(tsv):
+    '''
+        Reads the columns of the fields from the total tsv (same options used in the notebook)
+    '''
+    return pd.read_table(tsv,
+                         delimiter="\t",
+                         header="infer",
+                         quoting=csv.QUOTE_NONE,
+                         on_bad_lines="skip",
+                         usecols=FIELDS)
+
+def iter_preprocessed(tsv='../data/tsv_files/total_pages.tsv', fields=FIELDS):
+    '''
+        Yields (doc_id, {field: preprocessed words}) for each document of the total tsv,
+        reading one row at a time
+    '''
+    prep = Preprocessor()
+    for record in iter_records(tsv, fields):
+        yield record.doc_id, {field: prep(field_text(field, record[field])) for field in fields}
+
+# ---------------------------------------------------------------------------- #
+#                                    Workers                                   #
+# ---------------------------------------------------------------------------- #
+
+# The preprocessor of the worker process, created at the first shard
+_PREPROCESSOR = None
+
+def bounded_map(executor, fn, iterable, window):
+    '''
+        As executor.map, but the items are taken from the iterable only when less than
+        'window' of them are waiting or running: a generator of shards is not read all at once
+    '''
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def get_preprocessor():
+    global _PREPROCESSOR
+    if _PREPROCESSOR is None:
+        _PREPROCESSOR = Preprocessor()
+    return _PREPROCESSOR
+
+
+def index_shard(shard):
+    '''
+        Given a shard (first_doc, columns), where columns maps each field to the list of
+        the values of consecutive documents starting from first_doc, it returns the partial postings
+            {field: {word: [(doc_id, number of times the word is in the document), ...]}}
+        with the doc ids in increasing order
+    '''
+    first_doc, columns = shard
+    prep = get_preprocessor()
+
+    partial = dict()
+    for field, values in columns.items():
+        postings = dict()
+        for doc_id, value in enumerate(values, first_doc):
+            for word, count in Counter(prep(field_text(field, value))).items():
+                postings.setdefault(word, []).append((doc_id, count))
+        partial[field] = postings
+    return partial
+
+# ---------------------------------------------------------------------------- #
+#                                    Merging                                   #
+# ---------------------------------------------------------------------------- #
+
+def merge_partials(partials, n_docs):
+    '''
+        Merges the partial postings of the shards (in the order of their documents) of n_docs documents
+        into a vocabulary and an inverted index, as the ones of create_vocab and create_inv_idx, and the
+        words of each document (doc_terms, see doc_terms_from_inv_idx).
+        The words are numbered in alphabetical order.
+    '''
+    merged = dict()
+    for partial in partials:
+        for word, postings in partial.items():
+            merged.setdefault(word, []).extend(postings)
+
+    vocab = {word: idx for idx, word in enumerate(sorted(merged))}
+    inv_idx = dict()
+    doc_terms = {str(doc): dict() for doc in range(n_docs)}
+    for word, term in vocab.items():
+        inv_idx[term] = [str(doc) for doc, _ in merged[word]]
+        for doc, count in merged[word]:
+            doc_terms[str(doc)][str(term)] = count
+    return vocab, inv_idx, doc_terms
+
+
+def doc_terms_from_inv_idx(inv_idx, n_docs=None):
+    '''
+        Inverts an inverted index: it returns the dictionary doc_id -> {word id: count} of all the
+        documents from 0 to n_docs-1 (by default the largest document id in the index), where count is
+        the number of times the word is in the document. The index has only the documents, so the
+        counts are None (unknown).
+    '''
+    doc_terms = dict()
+    for term, docs in inv_idx.items():
+        for doc in docs:
+            doc_terms.setdefault(int(doc), []).append(int(term))
+    if n_docs is None:
+        n_docs = max(doc_terms, default=-1) + 1
+    return {str(doc): dict.fromkeys(map(str, sorted(doc_terms.get(doc, [])))) for doc in range(n_docs)}
+
+
+def build_tfidf(doc_terms):
+    '''
+        Computes the tf-idf index of a field from the words of each document with their counts (doc_terms):
+        it returns the same tf-idf inverted index and idf of create_inv_idx2 and the norms of create_doc_norms
+    '''
+    tf = dict()
+    for doc, terms in sorted(doc_terms.items(), key=lambda item: int(item[0])):
+        length = sum(terms.values())
+        for term, count in terms.items():
+            tf.setdefault(term, []).append((int(doc), count / length))
+
+    n_docs = len(doc_terms)
+    idf = {term: float(np.log(n_docs / len(postings))) for term, postings in tf.items()}
+    tfidf = {term: sorted(((d, t * idf[term]) for d, t in postings), key=lambda p: -p[1])
+             for term, postings in sorted(tf.items(), key=lambda item: int(item[0]))}
+    n_norms = max((int(doc) for doc in doc_terms), default=-1) + 1
+    return tfidf, idf, create_doc_norms(tfidf, n_norms)
+
+
+def save_tfidf(field_dir, tfidf, idf, norms):
+    '''
+        Saves the tf-idf index of a field (inv_idx_tfldf.json, idf.json and doc_norms.npy) in its directory
+    '''
+    save_dict_to_file(tfidf, os.path.join(field_dir, 'inv_idx_tfldf.json'))
+    save_dict_to_file(idf, os.path.join(field_dir, 'idf.json'))
+    np.save(os.path.join(field_dir, 'doc_norms.npy'), norms)
+
+
+def save_index(field_dir, vocab, inv_idx, doc_terms=None):
+    '''
+        Saves the vocabulary, the inverted index and the words of each document of a field in its directory
+    '''
+    if not os.path.exists(field_dir):
+        os.makedirs(field_dir)
+    save_dict_to_file(vocab, os.path.join(field_dir, 'vocabulary.json'))
+    save_dict_to_file(inv_idx, os.path.join(field_dir, 'inv_idx.json'))
+    if doc_terms is not None:
+        save_dict_to_file(doc_terms, os.path.join(field_dir, 'doc_terms.json'))
+
+
+def save_field(field_dir, field, vocab, inv_idx, doc_terms):
+    '''
+        Saves a newly built index of a field and, for the synopsis, its tf-idf index: the files of
+        the previous index (with the old word ids) are all replaced
+    '''
+    save_index(field_dir, vocab, inv_idx, doc_terms)
+    if field == 'synopsis':
+        save_tfidf(field_dir, *build_tfidf(doc_terms))
+
+# ---------------------------------------------------------------------------- #
+#                                 The pipeline                                 #
+# ---------------------------------------------------------------------------- #
+
+def build_indexes(tsv='../data/tsv_files/total_pages.tsv', out_dir='../shared_stuff/indexes',
+                  workers=None, shard_size=500, fields=FIELDS):
+    '''
+        Builds and saves the vocabulary and the inverted index of each field of the total tsv,
+        preprocessing the rows in parallel over 'workers' processes (by default one per core).
+
+        It returns the dictionary field -> (vocabulary, inverted index)
+    '''
+    start = perf_counter()
+    # the shards are read from the tsv while the workers preprocess the previous ones
+    # (the lists are parsed by the workers), only a few of them are in memory at a time
+    sizes = []
+    def shards():
+        for first, columns in iter_chunks(tsv, fields, shard_size, parse=False):
+            sizes.append(len(columns[fields[0]]))
+            yield first, columns
+
+    # the partials come back in the order of the shards, so the postings stay sorted
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = list(bounded_map(executor, index_shard, shards(), 2 * (workers or os.cpu_count() or 1)))
+    n_docs = sum(sizes)
+    print(f"[Index builder]: {n_docs} documents in {len(partials)} shards preprocessed ({perf_counter() - start:.1f} s)")
+
+    ret = dict()
+    for field in fields:
+        vocab, inv_idx, doc_terms = merge_partials((p[field] for p in partials), n_docs)
+        save_field(os.path.join(out_dir, field), field, vocab, inv_idx, doc_terms)
+        ret[field] = (vocab, inv_idx)
+        print(f"[{field.capitalize()}]: {len(vocab)} words, all saved ({perf_counter() - start:.1f} s)")
+    return ret
+
+
+# ---------------------------------------------------------------------------- #
+#                            From the html pages                               #
+# ---------------------------------------------------------------------------- #
+
+def pages_shard(shard):
+    '''
+        Given a shard (indices, src_dir, backend, fields, with_tsv) it parses the pages and
+        preprocesses their fields. It returns the list of (idx, {field: Counter of the words}, tsv row, error)
+        in the order of the indices (error is not None for the pages that couldn't be parsed, the row
+        is None if with_tsv is False) and the seconds spent parsing and preprocessing.
+    '''
+    indices, src_dir, backend, fields, with_tsv = shard
+    prep = get_preprocessor()
+
+    results = []
+    parse_time = prep_time = 0.
+    for idx in indices:
+        t0 = perf_counter()
+        try:
+            info = html_parser.get_total_info_from_idx(idx, src_dir, backend)
+            row = html_parser.info_to_tsv(info)[1] if with_tsv else None
+        except Exception as e:
+            parse_time += perf_counter() - t0
+            results.append((idx, None, None, repr(e)))
+            continue
+        t1 = perf_counter()
+        words = {field: Counter(prep(field_text(field, info[field]))) for field in fields}
+        parse_time += t1 - t0
+        prep_time += perf_counter() - t1
+        results.append((idx, words, row, None))
+    return results, parse_time, prep_time
+
+
+def build_from_pages(start, end, src_dir='../data/html_pages', out_dir='../shared_stuff/indexes', tsv=None,
+                     workers=None, shard_size=64, backend=html_parser.DEFAULT_BACKEND, fields=FIELDS):
+    '''
+        Builds and saves the indexes of the fields from the html pages from start to end (excluded) in
+        a single pass: the pages are parsed and preprocessed by 'workers' processes (1 to do everything
+        in this process) and their words are added to the postings as the shards come back.
+        The document id of a page is idx - start, as the row of the tsv save_tsv_info would write: a page
+        that can't be parsed is an empty document (and an empty row, see html_parser.empty_info), so the
+        ids stay aligned with the pages and the urls. With tsv not None that total tsv is also written on the side.
+
+        Only a few shards at a time and the postings are in memory. The time spent in each stage
+        is printed (parse and preprocess are summed over the workers).
+
+        It returns the dictionary field -> (vocabulary, inverted index) and the list of (idx, error)
+        of the pages that couldn't be parsed
+    '''
+    begin = perf_counter()
+    timings = dict.fromkeys(['parse', 'preprocess', 'postings', 'tsv', 'save'], 0.)
+    postings = {field: dict() for field in fields}
+    failed = []
+    n_docs = max(end - start, 0)
+
+    shards = ((range(first, min(first + shard_size, end)), src_dir, backend, fields, tsv is not None)
+              for first in range(start, end, shard_size))
+
+    with contextlib.ExitStack() as stack:
+        if tsv is not None:
+            out = stack.enter_context(open(tsv, 'w', buffering=2**20))
+            out.write('\t'.join(TSV_FIELDS) + '\n')
+        if workers == 1:
+            results = map(pages_shard, shards)
+        else:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            results = bounded_map(executor, pages_shard, shards, 2 * (workers or os.cpu_count() or 1))
+
+        # the shards come back in their order, so the postings stay sorted
+        for shard_results, parse_time, prep_time in results:
+            timings['parse'] += parse_time
+            timings['preprocess'] += prep_time
+
+            t0 = perf_counter()
+            rows = []
+            for idx, words, row, error in shard_results:
+                if error is not None:
+                    failed.append((idx, error))
+                    print(f"idx: {idx} FAILED! {error}")
+                    if tsv is not None:
+                        rows.append(html_parser.info_to_tsv(html_parser.empty_info())[1])
+                    continue
+                for field in fields:
+                    field_postings = postings[field]
+                    for word, count in words[field].items():
+                        field_postings.setdefault(word, []).append((idx - start, count))
+                rows.append(row)
+            t1 = perf_counter()
+            timings['postings'] += t1 - t0
+
+            if tsv is not None:
+                out.write(''.join('\n' + row for row in rows))
+                timings['tsv'] += perf_counter() - t1
+
+    t0 = perf_counter()
+    ret = dict()
+    for field in fields:
+        vocab, inv_idx, doc_terms = merge_partials([postings.pop(field)], n_docs)
+        save_field(os.path.join(out_dir, field), field, vocab, inv_idx, doc_terms)
+        ret[field] = (vocab, inv_idx)
+        print(f"[{field.capitalize()}]: {len(vocab)} words, all saved")
+    timings['save'] = perf_counter() - t0
+
+    print(f"[Index builder]: {n_docs} documents indexed, {len(failed)} failed, {perf_counter() - begin:.1f} s in total")
+    print("[Index builder]: " + ', '.join(f"{stage} {seconds:.2f} s" for stage, seconds in timings.items()))
+    return ret, failed
+
+
+# ---------------------------------------------------------------------------- #
+#                              Incremental updates                             #
+# ---------------------------------------------------------------------------- #
+
+def find_position(postings, doc):
+    '''
+        Binary search of doc in a sorted postings list (whose ids can be ints or strings):
+        it returns the position where doc is or should be inserted
+    '''
+    lo, hi = 0, len(postings)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if int(postings[mid]) < doc:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def load_field(field_dir):
+    '''
+        Loads vocabulary, inverted index and words of each document of a field.
+        If doc_terms.json doesn't exist yet (indexes built in the notebook) it's computed from the index.
+    '''
+    vocab = read_dict_from_file(os.path.join(field_dir, 'vocabulary.json'))
+    inv_idx = read_dict_from_file(os.path.join(field_dir, 'inv_idx.json'))
+    doc_terms_file = os.path.join(field_dir, 'doc_terms.json')
+    if os.path.exists(doc_terms_file):
+        doc_terms = read_dict_from_file(doc_terms_file)
+        # the lists of word ids written before the counts were saved
+        doc_terms = {doc: dict.fromkeys(map(str, terms)) if isinstance(terms, list) else terms
+                     for doc, terms in doc_terms.items()}
+    else:
+        doc_terms = doc_terms_from_inv_idx(inv_idx)
+    return vocab, inv_idx, doc_terms
+
+
+def remove_doc(inv_idx, doc_terms, doc):
+    '''
+        Removes a document from the postings of its words, it returns the words left without documents
+    '''
+    emptied = []
+    for term in doc_terms.pop(str(doc), []):
+        postings = inv_idx[str(term)]
+        pos = find_position(postings, doc)
+        if pos < len(postings) and int(postings[pos]) == doc:
+            del postings[pos]
+            if len(postings) == 0:
+                emptied.append(str(term))
+    return emptied
+
+
+def drop_words(vocab, inv_idx, terms):
+    '''
+        Removes from the vocabulary the words (ids) that are in no document, as if they had never been
+        indexed. Their ids stay in the inverted index with no documents, so they aren't given to other words.
+    '''
+    terms = {term for term in terms if len(inv_idx[term]) == 0}
+    if terms:
+        for word in [word for word, term in vocab.items() if str(term) in terms]:
+            del vocab[word]
+
+
+def add_doc(vocab, inv_idx, doc_terms, doc, words, str_ids):
+    '''
+        Adds a document with the given (preprocessed) words: the new words are appended
+        to the vocabulary with new ids, the document is inserted in the sorted postings
+    '''
+    terms = dict()
+    for word, count in Counter(words).items():
+        if word not in vocab:
+            vocab[word] = len(inv_idx) # the ids go from 0 to len-1, as in create_vocab
+            inv_idx[str(vocab[word])] = []
+        term = vocab[word]
+        terms[term] = count
+
+        postings = inv_idx[str(term)]
+        postings.insert(find_position(postings, doc), str(doc) if str_ids else doc)
+    doc_terms[str(doc)] = {str(term): terms[term] for term in sorted(terms)}
+
+
+def update_idf(inv_idx, n_docs, field_dir):
+    '''
+        Recomputes the idf of the words (as in create_inv_idx2) and saves it in idf.json
+    '''
+    idf = {term: float(np.log(n_docs / len(docs))) for term, docs in inv_idx.items() if len(docs) != 0}
+    save_dict_to_file(idf, os.path.join(field_dir, 'idf.json'))
+
+
+def has_counts(doc_terms):
+    '''
+        True if the words of each document have their counts (not the case for doc_terms.json
+        written before the counts were saved or computed from the inverted index)
+    '''
+    return all(count is not None for terms in doc_terms.values() for count in terms.values())
+
+
+def count_words(tsv, vocab, doc_terms):
+    '''
+        Fills the missing counts of the words of the synopsis of the documents in doc_terms from the tsv
+    '''
+    prep = Preprocessor()
+    for record in iter_records(tsv, ['synopsis']):
+        terms = doc_terms.get(str(record.doc_id))
+        if terms is None or all(count is not None for count in terms.values()):
+            continue
+        counts = Counter(vocab[word] for word in prep(field_text('synopsis', record['synopsis'])) if word in vocab)
+        doc_terms[str(record.doc_id)] = {str(term): counts[term] for term in sorted(counts)}
+    if not has_counts(doc_terms):
+        raise IndexError(f"some documents of the index are not in {tsv}")
+
+
+def update_tfidf(field_dir, inv_idx, doc_terms, terms, docs, n_before):
+    '''
+        Updates the tf-idf index of the synopsis (inv_idx_tfldf.json, idf.json and doc_norms.npy) after
+        the documents docs were removed or added, where terms are the words (ids) of the removed or added
+        documents and n_before the number of documents before the changes. The weights are computed
+        from the counts in doc_terms, the text of the documents is never read again:
+            -the postings of the given words are computed again (their idf and documents changed)
+            -if the number of documents changed, the idf of every word changed by the same
+             log(n_docs / n_before): the other weights are only rescaled and all the norms are recomputed,
+             otherwise only the norms of the documents with the given words are
+    '''
+    tfidf = read_dict_from_file(os.path.join(field_dir, 'inv_idx_tfldf.json'))
+    idf = read_dict_from_file(os.path.join(field_dir, 'idf.json'))
+    norms = np.load(os.path.join(field_dir, 'doc_norms.npy'))
+    n_docs = len(doc_terms)
+
+    lengths = dict()
+    def tf(doc, term):
+        doc = str(doc)
+        if doc not in lengths:
+            lengths[doc] = sum(doc_terms[doc].values())
+        return doc_terms[doc][term] / lengths[doc]
+
+    def weights(term, docs):
+        return sorted(([int(d), tf(d, term) * idf[term]] for d in docs), key=lambda p: (-p[1], p[0]))
+
+    for term in map(str, terms):
+        if len(inv_idx[term]) == 0:
+            tfidf.pop(term, None)
+            idf.pop(term, None)
+        else:
+            idf[term] = float(np.log(n_docs / len(inv_idx[term])))
+            tfidf[term] = weights(term, inv_idx[term])
+
+    n_norms = max((int(doc) for doc in doc_terms), default=-1) + 1
+    if n_docs != n_before:
+        for term, postings in tfidf.items():
+            if term in terms:
+                continue
+            old, idf[term] = idf[term], float(np.log(n_docs / len(postings)))
+            if old != 0 and idf[term] != 0:
+                ratio = idf[term] / old
+                tfidf[term] = [[d, w * ratio] for d, w in postings]
+            else: # the order of the ties is by document
+                tfidf[term] = weights(term, (d for d, _ in postings))
+        norms = create_doc_norms(tfidf, n_norms)
+    else:
+        norms = np.concatenate([norms, np.zeros(max(n_norms - len(norms), 0))])[:n_norms]
+        affected = {int(d) for term in terms for d in inv_idx[term]} | {int(doc) for doc in docs if int(doc) < n_norms}
+        for doc in affected:
+            terms_of_doc = doc_terms.get(str(doc), dict())
+            norms[doc] = np.sqrt(sum((tf(doc, term) * idf[term]) ** 2 for term in terms_of_doc))
+
+    save_tfidf(field_dir, tfidf, idf, norms)
+
+
+def update_indexes(docs, idx_dir='../shared_stuff/indexes', fields=FIELDS, delete=(), tsv=None):
+    '''
+        Updates the saved indexes of the fields without rebuilding them:
+            -docs: dictionary doc_id -> {field: value as in the tsv} of the new or changed documents
+            -delete: ids of the documents to remove
+        The words already in the vocabularies keep their ids, the new ones get the next free ids.
+        The words left without documents are removed from the vocabularies (see drop_words).
+        The changes to the postings depend only on the words of the changed documents, but the files
+        of each field are still read and written whole.
+
+        If the synopsis has a tf-idf index too it's updated from the counts of the words in doc_terms.json
+        (see update_tfidf). If the index was saved without the counts, they are computed once from the
+        total tsv, so the tsv must be given (otherwise a ValueError is raised before anything is changed).
+    '''
+    start = perf_counter()
+    prep = Preprocessor()
+
+    synopsis_dir = os.path.join(idx_dir, 'synopsis')
+    has_tfidf = 'synopsis' in fields and any(os.path.exists(os.path.join(synopsis_dir, f)) for f in TFIDF_FILES)
+
+    # the synopsis first, so that nothing is saved if its counts are missing
+    for field in sorted(fields, key=lambda f: f != 'synopsis'):
+        field_dir = os.path.join(idx_dir, field)
+        vocab, inv_idx, doc_terms = load_field(field_dir)
+        n_before = len(doc_terms)
+        missing_counts = field == 'synopsis' and has_tfidf and not has_counts(doc_terms)
+        if missing_counts and tsv is None:
+            raise ValueError(f"{field_dir}/doc_terms.json has no counts of the words, they are needed to update "
+                             "the tf-idf index: pass the total tsv (i.e. use update_from_tsv) or build the indexes again")
+
+        # the ids are saved as strings by create_inv_idx, but the indexes can contain ints too
+        str_ids = next((isinstance(p[0], str) for p in inv_idx.values() if len(p) != 0), True)
+
+        changed = set() # the words of the removed and added documents
+        emptied = []
+        for doc in delete:
+            changed.update(doc_terms.get(str(doc), ()))
+            emptied += remove_doc(inv_idx, doc_terms, int(doc))
+
+        for doc, row in docs.items():
+            changed.update(doc_terms.get(str(doc), ()))
+            emptied += remove_doc(inv_idx, doc_terms, int(doc))
+            add_doc(vocab, inv_idx, doc_terms, int(doc), prep(field_text(field, row[field])), str_ids)
+            changed.update(doc_terms[str(doc)])
+        drop_words(vocab, inv_idx, emptied)
+
+        if field == 'synopsis' and has_tfidf:
+            if missing_counts:
+                count_words(tsv, vocab, doc_terms)
+                save_tfidf(field_dir, *build_tfidf(doc_terms))
+            else:
+                update_tfidf(field_dir, inv_idx, doc_terms, changed, list(delete) + list(docs), n_before)
+        elif field == 'synopsis':
+            update_idf(inv_idx, len(doc_terms), field_dir)
+        save_index(field_dir, vocab, inv_idx, doc_terms)
+        print(f"[{field.capitalize()}]: {len(docs)} documents updated, {len(delete)} deleted "
+              f"({perf_counter() - start:.2f} s)")
+
+
+def update_from_tsv(doc_ids, tsv='../data/tsv_files/total_pages.tsv', idx_dir='../shared_stuff/indexes',
+                    fields=FIELDS):
+    '''
+        Updates the indexes with the rows of the total tsv of the given document ids
+    '''
+    wanted = {int(doc) for doc in doc_ids}
+    docs = dict()
+    for record in iter_records(tsv, fields, stop=max(wanted, default=-1) + 1):
+        if record.doc_id in wanted:
+            docs[record.doc_id] = record
+    if len(docs) != len(wanted):
+        raise IndexError(f"documents {sorted(wanted - set(docs))} not in {tsv}")
+    update_indexes(docs, idx_dir, fields, tsv=tsv)
+
+
+def parse_args():
+    '''
+        This methods parses the arguments from the command line
+    '''
+    parser = argparse.ArgumentParser(description="This script builds the vocabularies and the inverted indexes of all the fields")
+
+    parser.add_argument('--tsv', type=str, default=os.path.join('..', 'data', 'tsv_files', 'total_pages.tsv'),
+                        help="The path of the total tsv")
+    parser.add_argument('--out', type=str, default=os.path.join('..', 'shared_stuff', 'indexes'),
+                        help="The directory where the indexes will be stored")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="The number of processes (by default the number of cores)")
+    parser.add_argument('--shard_size', type=int, default=500,
+                        help="The number of documents of each shard")
+    parser.add_argument('--update', type=int, nargs='+',
+                        help="Only update the indexes with the documents of these ids (new or changed)")
+    parser.add_argument('--delete', type=int, nargs='+',
+                        help="Only remove the documents of these ids from the indexes")
+    parser.add_argument('--pages', type=int, nargs=2, metavar=('START', 'END'),
+                        help="Build the indexes straight from the html pages from START to END (excluded)")
+    parser.add_argument('--src', type=str, default=os.path.join('..', 'data', 'html_pages'),
+                        help="The directory (or page store) of the html pages, with --pages")
+    parser.add_argument('--save_tsv', type=str, default=None,
+                        help="With --pages, also write the total tsv of the pages in this file")
+    parser.add_argument('--backend', type=str, default=html_parser.DEFAULT_BACKEND, choices=html_parser.BACKENDS,
+                        help="The html parser, with --pages")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.update is not None:
+        update_from_tsv(args.update, args.tsv, args.out)
+    if args.delete is not None:
+        update_indexes(dict(), args.out, delete=args.delete, tsv=args.tsv)
+    if args.pages is not None:
+        build_from_pages(*args.pages, args.src, args.out, args.save_tsv, args.workers, backend=args.backend)
+    elif args.update is None and args.delete is None:
+        build_indexes(args.tsv, args.out, args.workers, args.shard_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''
+
+    This file contains the manifest of the downloads: a small SQLite database that records, for each
+    index of the url file, what happened the last time its page was downloaded:
+        * status: 'done', 'failed' or 'captcha'
+        * the http status code
+        * ETag and Last-Modified headers, to make conditional requests when refreshing
+        * size and sha256 of the saved page
+
+    In this way a new run of the downloader skips the pages already downloaded, retries only the
+    failed (or captcha) ones and, when refreshing, only transfers the pages that have changed.
+
+'''
+
+import hashlib
+import os
+import sqlite3
+from time import time
+
+DONE = 'done'
+FAILED = 'failed'
+CAPTCHA = 'captcha'
+
+
+def content_hash(text):
+    '''
+        Returns the size in bytes and the sha256 of a page
+    '''
+    data = text.encode()
+    return len(data), hashlib.sha256(data).hexdigest()
+
+
+class DownloadManifest:
+    '''
+        Persistent record of the downloaded pages, stored in the SQLite file 'path'
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS pages (
+                                    idx INTEGER PRIMARY KEY,
+                                    url TEXT,
+                                    status TEXT,
+                                    http_status INTEGER,
+                                    etag TEXT,
+                                    last_modified TEXT,
+                                    size INTEGER,
+                                    sha256 TEXT,
+                                    updated REAL)''')
+
+    def get(self, idx):
+        '''
+            Returns the record of the index as a dictionary (None if it was never downloaded)
+        '''
+        row = self.conn.execute('SELECT * FROM pages WHERE idx = ?', (idx,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def is_done(self, idx, url):
+        '''
+            Returns True if the page of the index has been downloaded from the same url
+        '''
+        row = self.get(idx)
+        return row is not None and row['status'] == DONE and row['url'] == url.strip()
+
+    def conditional_headers(self, idx, url):
+        '''
+            Returns the headers for a conditional request of a page already downloaded
+            (If-None-Match / If-Modified-Since), so that the site answers 304 if it hasn't changed
+        '''
+        row = self.get(idx)
+        if row is None or row['status'] != DONE or row['url'] != url.strip():
+            return dict()
+        headers = dict()
+        if row['etag']:
+            headers['If-None-Match'] = row['etag']
+        if row['last_modified']:
+            headers['If-Modified-Since'] = row['last_modified']
+        return headers
+
+    def record(self, idx, url, status, http_status=None, headers=None, text=None):
+        '''
+            Records the outcome of the download of a page. If the page hasn't changed (304)
+            the previous ETag, Last-Modified, size and hash are kept.
+        '''
+        headers = {k.lower(): v for k, v in headers.items()} if headers is not None else dict()
+        old = self.get(idx) or dict()
+        size, digest = content_hash(text) if text is not None else (old.get('size'), old.get('sha256'))
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (idx, url.strip(), status, http_status,
+                               headers.get('etag', old.get('etag')),
+                               headers.get('last-modified', old.get('last_modified')),
+                               size, digest, time()))
+
+    def adopt_existing(self, idx, url, fname, is_blocked):
+        '''
+            Pages downloaded before the manifest existed: if the file of the index is on disk
+            and it's not a captcha page, it's recorded as done. Returns True in that case.
+        '''
+        if self.get(idx) is not None or not os.path.exists(fname):
+            return False
+        with open(fname, 'r') as f:
+            text = f.read()
+        if is_blocked(200, text):
+            return False
+        self.record(idx, url, DONE, 200, text=text)
+        return True
+
+    def summary(self):
+        '''
+            Returns the number of pages for each status
+        '''
+        return {row[0]: row[1] for row in self.conn.execute('SELECT status, COUNT(*) FROM pages GROUP BY status')}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,283 @@
+'''
+
+    This file contains a compressed store for the downloaded html pages, to be used instead of
+    one article_<n>.html file per anime.
+
+    A store is a directory with:
+        * store.json:  the codec used ('zstd' if the zstandard package is installed, otherwise 'gzip')
+        * pages.dat:   the compressed chunks, one after the other. Every chunk holds the text of
+                       'chunk_size' consecutive pages (so the boilerplate they share is compressed once)
+        * pages.idx:   the offset index, a record for each page:
+                       page index, offset and size of its chunk, offset and size of the page in the chunk
+
+    Both files are only appended to: a page written again is simply recorded again and the last
+    record wins. A page is read decompressing only its own chunk (random access) and iterating over
+    the store decompresses every chunk once (sequential streaming).
+
+'''
+
+import gzip
+import json
+import os
+import struct
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+META = 'store.json'
+DATA = 'pages.dat'
+INDEX = 'pages.idx'
+
+# page index, chunk offset, chunk size, offset in the chunk, page size
+RECORD = struct.Struct('<IQIII')
+
+DEFAULT_CODEC = 'zstd' if zstandard is not None else 'gzip'
+
+
+def compress(data, codec, level=None):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level if level is not None else 9).compress(data)
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=level if level is not None else 6)
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def is_page_store(path):
+    '''
+        Returns True if path is the directory of a page store
+    '''
+    return os.path.isfile(os.path.join(path, META))
+
+
+class PageStore:
+    '''
+        Compressed store of html pages, addressed by the index of their url:
+            store[idx] -> text of the page
+            store.put(idx, text)
+        The pages put are kept in memory until 'chunk_size' of them are ready (or flush is called),
+        remember to close the store (or to use it in a with statement) after writing.
+        A page is safe on disk only after the flush of its chunk: put can be given a function that
+        is called at that moment (i.e. to record the page as downloaded).
+    '''
+
+    def __init__(self, path, codec=None, chunk_size=64, level=None):
+        if not os.path.exists(path):
+            os.mkdir(path)
+
+        meta_file = os.path.join(path, META)
+        if os.path.exists(meta_file):
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            if codec is not None and codec != meta['codec']:
+                raise ValueError(f"the store {path} uses {meta['codec']}, not {codec}")
+        else:
+            meta = {'codec': codec if codec is not None else DEFAULT_CODEC}
+            with open(meta_file, 'w') as f:
+                json.dump(meta, f)
+
+        self.path = path
+        self.codec = meta['codec']
+        if self.codec == 'zstd' and zstandard is None:
+            raise ImportError(f"the store {path} needs the zstandard package")
+        self.chunk_size = chunk_size
+        self.level = level
+
+        self._pending = []
+        self._callbacks = [] # the on_flush of the pending pages
+        self._chunk = (None, None) # offset and content of the last decompressed chunk
+        self._index = dict()
+        self._read_index()
+
+    def _read_index(self):
+        index_file = os.path.join(self.path, INDEX)
+        if not os.path.exists(index_file):
+            return
+        with open(index_file, 'rb') as f:
+            data = f.read()
+        # a truncated last record (interrupted write) is ignored
+        for rec in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+            self._index[rec[0]] = rec[1:]
+
+    # ---------------------------------- Writing --------------------------------- #
+
+    def put(self, idx, text, on_flush=None):
+        '''
+            Adds (or replaces) the page of index idx. If given, on_flush() is called
+            when the page has been written on disk (see flush)
+        '''
+        self._pending.append((idx, text.encode()))
+        self._callbacks.append(on_flush)
+        if len(self._pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''
+            Compresses the pages put so far in a new chunk and appends it to the store.
+            When the chunk and its records in the offset index are on disk, the on_flush of its pages
+            are called (in the order they were put). It returns the indices of the pages written.
+        '''
+        if not self._pending:
+            return []
+        chunk = b''.join(page for _, page in self._pending)
+        data = compress(chunk, self.codec, self.level)
+
+        with open(os.path.join(self.path, DATA), 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        records = []
+        start = 0
+        for idx, page in self._pending:
+            rec = (offset, len(data), start, len(page))
+            self._index[idx] = rec
+            records.append(RECORD.pack(idx, *rec))
+            start += len(page)
+        # the index is written after the data, so it never points to a missing chunk
+        with open(os.path.join(self.path, INDEX), 'ab') as f:
+            f.write(b''.join(records))
+            f.flush()
+            os.fsync(f.fileno())
+
+        written = [idx for idx, _ in self._pending]
+        callbacks = self._callbacks
+        self._pending = []
+        self._callbacks = []
+        for on_flush in callbacks:
+            if on_flush is not None:
+                on_flush()
+        return written
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------------------------------- Reading --------------------------------- #
+
+    def _read_chunk(self, offset, size):
+        if self._chunk[0] != offset:
+            with open(os.path.join(self.path, DATA), 'rb') as f:
+                f.seek(offset)
+                self._chunk = (offset, decompress(f.read(size), self.codec))
+        return self._chunk[1]
+
+    def __getitem__(self, idx):
+        for pending_idx, page in reversed(self._pending):
+            if pending_idx == idx:
+                return page.decode()
+        offset, size, start, length = self._index[idx]
+        return self._read_chunk(offset, size)[start:start + length].decode()
+
+    def get(self, idx, default=None):
+        try:
+            return self[idx]
+        except KeyError:
+            return default
+
+    def __contains__(self, idx):
+        return idx in self._index or any(pending_idx == idx for pending_idx, _ in self._pending)
+
+    def __len__(self):
+        return len(self._index.keys() | {idx for idx, _ in self._pending})
+
+    def indices(self):
+        '''
+            Returns the sorted indices of the pages in the store
+        '''
+        return sorted(self._index)
+
+    def __iter__(self):
+        '''
+            Yields (idx, text) for every page in the store, in the order they are stored:
+            every chunk is decompressed once
+        '''
+        self.flush()
+        by_chunk = sorted(self._index.items(), key=lambda item: item[1])
+        for idx, (offset, size, start, length) in by_chunk:
+            yield idx, self._read_chunk(offset, size)[start:start + length].decode()
+
+    def disk_size(self):
+        '''
+            Returns the bytes used by the store on disk
+        '''
+        return sum(os.path.getsize(os.path.join(self.path, f)) for f in (META, DATA, INDEX)
+                   if os.path.exists(os.path.join(self.path, f)))
+
+
+_STORES = dict() # path -> (size and modification time of the offset index, PageStore)
+
+def open_store(path):
+    '''
+        Returns the PageStore of path to read the pages, opened only the first time it's asked
+        (or again if pages have been added to the store since then, i.e. by another run of the downloader)
+    '''
+    index_file = os.path.join(path, INDEX)
+    if os.path.exists(index_file):
+        stat = os.stat(index_file)
+        version = (stat.st_size, stat.st_mtime_ns)
+    else:
+        version = None
+    cached = _STORES.get(path)
+    if cached is None or cached[0] != version:
+        cached = _STORES[path] = (version, PageStore(path))
+    return cached[1]
+
+
+def pack_pages(src_dir, dst, codec=None, chunk_size=64):
+    '''
+        Moves the article_<n>.html files of src_dir in the page store dst (the files are not deleted).
+        It returns the store.
+    '''
+    names = [f for f in os.listdir(src_dir) if f.startswith('article_') and f.endswith('.html')]
+    names.sort(key=lambda name: int(name[len('article_'):-len('.html')]))
+
+    with PageStore(dst, codec=codec, chunk_size=chunk_size) as store:
+        for name in names:
+            with open(os.path.join(src_dir, name), 'r') as f:
+                store.put(int(name[len('article_'):-len('.html')]), f.read())
+    return store
+
+
+def unpack_pages(src, dst_dir):
+    '''
+        Writes every page of the store src in dst_dir as article_<n>.html
+    '''
+    if not os.path.exists(dst_dir):
+        os.mkdir(dst_dir)
+    for idx, text in PageStore(src):
+        with open(os.path.join(dst_dir, f"article_{idx}.html"), 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Packs the downloaded html pages in a compressed page store (or back)")
+    parser.add_argument('src', help="The directory of the html pages (or of the store with --unpack)")
+    parser.add_argument('dst', help="The directory of the store (or of the html pages with --unpack)")
+    parser.add_argument('--codec', choices=['zstd', 'gzip'], help=f"default: {DEFAULT_CODEC}")
+    parser.add_argument('--chunk_size', type=int, default=64, help="The number of pages compressed together")
+    parser.add_argument('--unpack', action='store_true')
+    args = parser.parse_args()
+
+    if args.unpack:
+        unpack_pages(args.src, args.dst)
+    else:
+        store = pack_pages(args.src, args.dst, codec=args.codec, chunk_size=args.chunk_size)
+        print(f"{len(store)} pages stored in {store.disk_size() / 2**20:.1f} MiB")
@@ -0,0 +1,115 @@
+'''
+
+    This file contains the cache of the query results used by query_anime and by the tf-idf search.
+
+    A result is stored under a canonical key (the sorted term ids of the parsed query of each field
+    and k, so two queries with the same words in a different order or with different inflections
+    share it) together with the version of the indexes it was computed on (their modification times):
+    when an index is rebuilt its version changes and the old results are not used anymore.
+    The cache is a LRU bounded both in size and in time (ttl).
+    The objects the results depend on (the dataframe, the tf-idf index) are identified by object_token.
+
+'''
+
+import itertools
+import weakref
+from collections import OrderedDict, namedtuple
+from time import monotonic
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+_TOKENS = dict() # id of an object -> (weak reference to it, its token)
+_COUNTER = itertools.count()
+
+def object_token(obj):
+    '''
+        Returns a number identifying obj for the whole life of the process: unlike id(obj),
+        it's never given to another object after obj has been garbage collected
+    '''
+    key = id(obj)
+    entry = _TOKENS.get(key)
+    if entry is None or entry[0]() is not obj:
+        def forget(ref):
+            if key in _TOKENS and _TOKENS[key][0] is ref:
+                del _TOKENS[key]
+        entry = _TOKENS[key] = (weakref.ref(obj, forget), next(_COUNTER))
+    return entry[1]
+
+
+def canonical_term(term):
+    '''
+        A term id as a sorted tuple of ints (the prefixes of parse_query are already tuples of ids)
+    '''
+    return tuple(sorted(int(t) for t in term)) if isinstance(term, tuple) else (int(term),)
+
+
+def canonical_key(parsed_query, k):
+    '''
+        Given a parsed query {field: [term ids]} (or a list of term ids) and k, it returns a hashable key
+        that doesn't depend on the order of the fields and of the terms
+    '''
+    if isinstance(parsed_query, dict):
+        terms = tuple(sorted((field, tuple(sorted(canonical_term(t) for t in ids)))
+                             for field, ids in parsed_query.items()))
+    else:
+        terms = tuple(sorted(canonical_term(t) for t in parsed_query))
+    return terms, k
+
+
+class ResultCache:
+    '''
+        LRU cache of the query results with at most maxsize entries, each one valid for ttl seconds
+        (None for no time limit) and only as long as the version of the indexes doesn't change
+    '''
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (expiration, version, value)
+
+    def get(self, key, version=None, default=None):
+        '''
+            Returns the value of the key if it's still valid, otherwise default
+        '''
+        entry = self._entries.get(key)
+        if entry is None or entry[1] != version or (entry[0] is not None and entry[0] < monotonic()):
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key, value, version=None):
+        if self.maxsize <= 0:
+            return
+        expiration = monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (expiration, version, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def cached(self, key, version, compute):
+        '''
+            Returns the value of the key, calling compute() (and storing its result) on a miss
+        '''
+        missing = object()
+        value = self.get(key, version, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value, version)
+        return value
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
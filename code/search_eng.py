@@ -1,14 +1,22 @@
 import pandas as pd
 import numpy as np
 import math
+import re
 import string
 import json
+import os
+from functools import lru_cache
 from operator import itemgetter
 
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 from nltk.stem import SnowballStemmer
 
+from doc_metadata import get_doc_metadata
+from query_cache import ResultCache, canonical_key, object_token
+from term_dict import prefix_ids
+
+
 def has_digits(s):
     """
     This function checks whether a string
@@ -48,6 +56,29 @@ def bad_words():
     return punct + stops + other_suffixes
 
 
+# the set of bad words, built only once
+_BAD_WORDS = None
+
+def bad_words_set():
+    """
+    This function returns the words of 'bad_words'
+    as a set, building it only the first time
+    
+    Arguments
+        none
+        
+    Returns
+        (frozenset)
+    """
+    
+    global _BAD_WORDS
+    
+    if _BAD_WORDS is None:
+        _BAD_WORDS = frozenset(bad_words())
+    
+    return _BAD_WORDS
+
+
 def preprocess(text, stemmer):
     """
     This function preprocesses some text (a document)
@@ -66,9 +97,51 @@ def preprocess(text, stemmer):
     text = str(text).replace("/"," ") 
     
     tokens = word_tokenize(text)
-        
+    
+    bad = bad_words_set()
+    
     return [stemmer.stem(w) for w in tokens 
-            if w not in bad_words() and not has_digits(w) and len(w) == len(w.encode())]
+            if w not in bad and not has_digits(w) and len(w) == len(w.encode())]
+
+
+DIGIT = re.compile(r"\d")
+
+
+class Preprocessor:
+    """
+    This class preprocesses documents as 'preprocess' does,
+    with the same output, but faster:
+    - the set of bad words is built only once
+    - the stems are memoized in a bounded LRU cache
+    
+    Arguments
+        stemmer    : stemmer object, by default SnowballStemmer("english")
+        cache_size : max number of stems kept in memory
+    """
+    
+    def __init__(self, stemmer = None, cache_size = 2**16):
+        self.stemmer = SnowballStemmer("english") if stemmer is None else stemmer
+        self.bad = bad_words_set()
+        self.stem = lru_cache(maxsize = cache_size)(self.stemmer.stem)
+    
+    def tokenize(self, text):
+        """
+        Splits the text in words, as 'preprocess'
+        """
+        return word_tokenize(str(text).replace("/"," "))
+    
+    def __call__(self, text):
+        """
+        Returns the preprocessed text, as 'preprocess'
+        """
+        bad = self.bad
+        stem = self.stem
+        
+        return [stem(w) for w in self.tokenize(text) 
+                if w.isascii() and w not in bad and not DIGIT.search(w)]
+    
+    def cache_info(self):
+        return self.stem.cache_info()
 
 
 def create_vocab(corpus):
@@ -141,11 +214,19 @@ def create_inv_idx(corpus, vocab):
                   and the lists of the documents each word is in as values       
     """
     
-    inv_idx = {}
-    
-    for idx, word in zip(vocab.values(), vocab.keys()):
-        inv_idx[idx] = [str(doc_id) for doc_id, doc in enumerate(corpus) if word in doc]
-    
+    # one empty postings list for each word, in the same order as 'vocab'
+    inv_idx = {idx: [] for idx in vocab.values()}
+
+    # a single pass over the corpus: each document adds its id
+    # to the postings of every (distinct) word it contains,
+    # so the postings end up sorted by document id
+    for doc_id, doc in enumerate(corpus):
+        str_id = str(doc_id)
+
+        for word in set(doc):
+            if word in vocab:
+                inv_idx[vocab[word]].append(str_id)
+
     return inv_idx
 
 
@@ -155,10 +236,15 @@ def parse_query(query, vocab, stemmer):
     input by the user into the list of the IDs
     the words are saved as in the vocabulary
     
+    A word ending with '*' is a prefix: it becomes the
+    tuple of the IDs of all the words starting with it,
+    whose documents are joined (OR) by 'get_results'
+    
     Arguments
         query : list of words
         vocab : vocabulary of words with the words as keys
-                and their IDs as values
+                and their IDs as values (dictionary or
+                'term_dict.TermDict')
     Returns
         list of the IDs of the words in the query
     """
@@ -166,6 +252,13 @@ def parse_query(query, vocab, stemmer):
     parsed_query = []
     
     for word in query:
+        if word.endswith("*") and len(word) > 1:
+            ids = prefix_ids(vocab, word[:-1].lower())
+            if ids:
+                parsed_query.append(tuple(ids))
+            else:
+                print(f"No term starting with '{word[:-1]}' was found anywhere!")
+            continue
         try:
             parsed_query.append(vocab[stemmer.stem(word)])
         except KeyError:
@@ -179,20 +272,157 @@ def get_results(query, inv_idx):
     This functions finds the documents all the words
     in the query are in.
     
-    It finds them in four steps:
-    1. retrieves the list of docs each word is in from the inverted index
-    2. converts that list into a set
-    3. creates a list of all these sets (one for each word)
-    4. intersects all those sets into a single set
+    It finds them in three steps:
+    1. retrieves the sorted array of docs each word is in from the inverted index
+    2. intersects the arrays starting from the shortest one (see 'intersect_postings')
+    3. converts the result into a set with the same type of ids of the index
        
     Arguments
-        query : list of words as parsed by 'parse_query'
+        query   : list of words as parsed by 'parse_query'
+        inv_idx : inverted index, e.g. dictionary read from a JSON file,
+                  'SortedIndex' or 'bin_index.BinaryIndex'
         
     Returns
         set with the documents that contain all the words in the query
     """
     
-    return set.intersection(*[set(inv_idx[str(q)]) for q in query])
+    if not query:
+        return set()
+    
+    docs = intersect_postings([postings_array(inv_idx, q) for q in query]).tolist()
+    
+    if has_str_ids(inv_idx, query):
+        return {str(doc) for doc in docs}
+    return set(docs)
+
+
+def postings_array(inv_idx, term):
+    """
+    This function returns the postings of a word
+    as a sorted numpy int32 array
+    
+    Arguments
+        inv_idx : inverted index
+        term    : word ID, or tuple of word IDs (a prefix
+                  in 'parse_query') to get the documents
+                  any of the words is in
+    
+    Returns
+        (numpy array) the documents the word is in
+    """
+    
+    if isinstance(term, tuple):
+        return np.unique(np.concatenate([postings_array(inv_idx, t) for t in term]))
+    
+    if hasattr(inv_idx, "postings_array"):
+        return inv_idx.postings_array(term)
+    
+    return np.sort(np.array(inv_idx[str(term)], dtype = np.int32))
+
+
+def has_str_ids(inv_idx, query):
+    """
+    This function checks whether the documents
+    are saved as strings in the inverted index
+    (as created by 'create_inv_idx') or as integers
+    
+    Arguments
+        inv_idx : inverted index
+        query   : list of words IDs
+    
+    Returns
+        (bool) True / False
+    """
+    
+    if hasattr(inv_idx, "str_ids"):
+        return inv_idx.str_ids
+    
+    for q in query:
+        docs = inv_idx[str(q[0] if isinstance(q, tuple) else q)]
+        if len(docs) != 0:
+            return isinstance(docs[0], str)
+    return False
+
+
+def intersect_postings(postings):
+    """
+    This function intersects a list of sorted arrays
+    of documents.
+    
+    The arrays are intersected from the shortest to
+    the longest: each document of the running result
+    is looked for in the next array by binary search
+    (so the cost depends on the size of the result
+    and only logarithmically on the longest arrays),
+    and the function stops as soon as the result is empty
+    
+    Arguments
+        postings : list of sorted numpy arrays
+    
+    Returns
+        (numpy array) sorted documents in all the arrays
+    """
+    
+    postings = sorted(postings, key = len)
+    result = postings[0]
+    
+    for docs in postings[1:]:
+        if len(result) == 0:
+            break
+        
+        pos = np.searchsorted(docs, result)
+        # the documents greater than the last one can't be in 'docs'
+        found = pos < len(docs)
+        result = result[found]
+        result = result[docs[pos[found]] == result]
+    
+    return result
+
+
+class SortedIndex:
+    """
+    This class wraps an inverted index (e.g. the
+    dictionary read from a JSON file) and keeps the
+    postings of each word as a sorted numpy array,
+    converting them only the first time they are needed
+    
+    It can be used everywhere the wrapped index is used
+    """
+    
+    def __init__(self, inv_idx):
+        self.inv_idx = inv_idx
+        self.str_ids = any(isinstance(docs[0], str) 
+                           for docs in inv_idx.values() if len(docs) != 0)
+        self._arrays = {}
+    
+    def postings_array(self, term):
+        term = str(term)
+        
+        if term not in self._arrays:
+            self._arrays[term] = np.sort(np.array(self.inv_idx[term], dtype = np.int32))
+        
+        return self._arrays[term]
+    
+    def __getitem__(self, term):
+        return self.inv_idx[term]
+    
+    def __contains__(self, term):
+        return term in self.inv_idx
+    
+    def __iter__(self):
+        return iter(self.inv_idx)
+    
+    def __len__(self):
+        return len(self.inv_idx)
+    
+    def keys(self):
+        return self.inv_idx.keys()
+    
+    def values(self):
+        return self.inv_idx.values()
+    
+    def items(self):
+        return self.inv_idx.items()
 
 
 def get_df_entries(df, results,
@@ -217,15 +447,14 @@ def get_df_entries(df, results,
         print("No results!")
         return pd.DataFrame()
     
-    with open(url_file, 'r') as file:
-        url_list = file.read().split("\n")
-
-    df = df.iloc[[*results]]
+    # the url file is read only once, see doc_metadata.py
+    results = [*results]
+    df = df.iloc[results]
     df = df[["title", "synopsis"]]
     df = df.rename(columns = {"title": "animeTitle", 
                               "synopsis": "animeDescription"})
     
-    df['animeUrl'] = itemgetter(*results)(url_list)
+    df['animeUrl'] = get_doc_metadata(url_file).urls(results)
     
     #in case we need a colum for Similarity
     if simil is not None: 
@@ -255,11 +484,30 @@ def create_inv_idx2(corpus, vocab):
     idf = {i: np.log(len(corpus)/len(tf[i])) for i in tf}    #idf
     
     #from nested dictionary to dict of tuples and tfidf = tf*idf
-    tfidf = {k:list((d, (t*(idf[k]))) for d, t in v.items()) for (k, v) in tf.items()}
+    #the postings are impact-ordered: the documents with the largest tfidf come first
+    tfidf = {k:sorted(((d, (t*(idf[k]))) for d, t in v.items()), key = lambda p: -p[1]) for (k, v) in tf.items()}
     
     return tfidf, idf 
 
 
+def create_doc_norms(inv_idx, n_docs):
+    """
+    This function computes the norm of the tfidf vector of every document,
+    to be saved together with the tfidf index (the norms don't depend on the query)
+    
+    Arguments
+        inv_idx : tfidf inverted index, as created by create_inv_idx2
+        n_docs  : number of documents in the corpus
+    Returns
+        numpy array, ith element is the norm of the ith document
+    """
+    norms = np.zeros(n_docs)
+    for postings in inv_idx.values():
+        for d, w in postings:
+            norms[int(d)] += w*w
+    return np.sqrt(norms)
+
+
 def tfidf_query(corpus, query, inv_idx, idf):
     """
     This functions receives query and outputs tfidfs for words in this query
@@ -303,3 +551,265 @@ def cosine_similiarity(q, d):
     This function counts cosine similiarity between two vectors q and d
     '''
     return (sum([q[i]*d[i] for i in range(len(q))]) / math.sqrt(sum(qi * qi for qi in q) * sum(di * di for di in d)))
+
+
+class TfidfIndex:
+    """
+    This class keeps in memory the tfidf inverted index, the idf and the document norms,
+    converting the postings of each word in numpy arrays (documents, tfidf) the first time they are used
+    
+    Arguments
+        inv_idx : tfidf inverted index, as created by create_inv_idx2
+        idf     : idf of each word, as created by create_inv_idx2
+        norms   : norms of the documents, as created by create_doc_norms
+    """
+    
+    def __init__(self, inv_idx, idf, norms):
+        self.inv_idx = inv_idx
+        self.idf = idf
+        self.norms = np.asarray(norms, dtype = float)
+        self.n_docs = len(self.norms)
+        self.files = []
+        self._arrays = {}
+        self._doc_sorted = {}
+    
+    @classmethod
+    def load(cls, idx_dir = "../shared_stuff/indexes/synopsis"):
+        """
+        Reads inv_idx_tfldf.json, idf.json and doc_norms.npy from idx_dir
+        """
+        files = [os.path.join(idx_dir, f) for f in ("inv_idx_tfldf.json", "idf.json", "doc_norms.npy")]
+        index = cls(read_dict_from_file(files[0]), read_dict_from_file(files[1]), np.load(files[2]))
+        index.files = files
+        return index
+    
+    def version(self):
+        """
+        Returns what identifies the content of the index for the result cache:
+        the index itself and the modification times of its files, if it was loaded from disk
+        """
+        return (object_token(self),) + tuple(os.stat(f).st_mtime_ns for f in self.files)
+    
+    def postings(self, word):
+        """
+        Returns the documents containing the word and their tfidf as two numpy arrays,
+        in the impact order of the index
+        """
+        word = str(word)
+        if word not in self._arrays:
+            postings = self.inv_idx[word]
+            self._arrays[word] = (np.array([d for d, w in postings], dtype = np.int32),
+                                  np.array([w for d, w in postings], dtype = float))
+        return self._arrays[word]
+    
+    def doc_postings(self, word):
+        """
+        Returns the documents containing the word sorted by id, the tfidf of the word in each
+        of them divided by the norm of the document, and the largest of these values
+        (the upper bound of the contribution of the word to the cosine similiarity)
+        """
+        word = str(word)
+        if word not in self._doc_sorted:
+            docs, weights = self.postings(word)
+            order = np.argsort(docs, kind = "stable")
+            docs = docs[order]
+            norms = self.norms[docs]
+            contribs = np.divide(weights[order], norms, out = np.zeros(len(docs)), where = norms > 0)
+            self._doc_sorted[word] = (docs, contribs, float(contribs.max()) if len(docs) else 0.)
+        return self._doc_sorted[word]
+
+
+def query_weights(query, idf):
+    """
+    This function computes the tfidf of the words in the query, as in tfidf_query.
+    A prefix (a tuple of words, see parse_query) counts as one word of the query
+    and each of its words gets its tf. The words without an idf (in no document
+    of the index) are skipped
+    
+    Arguments
+        query : list of words
+        idf
+    Returns
+        dict, word -> tfidf of the word in the query
+    """
+    l = len(query)
+    tf_q = {}
+    for word in query:
+        for w in (word if isinstance(word, tuple) else (word,)):
+            if str(w) not in idf:
+                continue
+            tf_q[w] = tf_q.get(w, 0) + 1/l #dividing by l - to obtain tf score
+    return {word: tf * idf[str(word)] for word, tf in tf_q.items()}
+
+
+def query_groups(query):
+    """
+    This function returns the distinct groups of words of the query that a document
+    must match (at least one word of each group): a group for each word and
+    one for each prefix (tuple of words, see parse_query)
+    
+    Arguments
+        query : list of words
+    Returns
+        list of tuples of words
+    """
+    return list(dict.fromkeys(word if isinstance(word, tuple) else (word,) for word in query))
+
+
+def top_k(scores, candidates, k):
+    """
+    This function selects the k candidates with the largest score with argpartition
+    
+    Returns
+        dict, doc -> score, sorted by descending score
+    """
+    if k < len(candidates):
+        part = np.argpartition(-scores[candidates], k - 1)[:k]
+        candidates = candidates[part]
+    best = candidates[np.argsort(-scores[candidates], kind = "stable")]
+    return {int(d): float(scores[d]) for d in best}
+
+
+def tfidf_top_k(query, index, k = 10):
+    """
+    This function finds the k documents containing all the words in the query
+    with the largest cosine similiarity with the query.
+    
+    The scores are accumulated word by word in a dense array over all the documents
+    and divided by the (precomputed) norms of the documents, so no per-document python loop is needed.
+    A prefix (see parse_query) is matched by the documents with any of its words,
+    a word that isn't in the index by no document
+    
+    Arguments
+        query : list of words
+        index : TfidfIndex
+        k     : number of documents to return
+    Returns
+        dict, doc -> cosine similiarity, sorted by descending similiarity
+    """
+    weights = query_weights(query, index.idf)
+    
+    scores = np.zeros(index.n_docs)
+    for word, q_w in weights.items():
+        docs, d_w = index.postings(word)
+        scores[docs] += q_w * d_w
+    
+    groups = query_groups(query)
+    hits = np.zeros(index.n_docs, dtype = np.int32) #number of groups of the query matched by each doc
+    for group in groups:
+        group = [word for word in group if str(word) in index.idf]
+        if len(group) == 0:
+            return {}
+        if len(group) == 1:
+            hits[index.postings(group[0])[0]] += 1
+        else:
+            matched = np.zeros(index.n_docs, dtype = bool)
+            for word in group:
+                matched[index.postings(word)[0]] = True
+            hits += matched
+    
+    #conjunctive query: only the docs that have all words from query
+    candidates = np.flatnonzero(hits == len(groups))
+    if len(candidates) == 0:
+        return {}
+    
+    norms = math.sqrt(sum(w*w for w in weights.values())) * index.norms[candidates]
+    norms[norms == 0] = 1 #words with idf = 0 (in every doc), the scores are 0 anyway
+    scores[candidates] /= norms
+    
+    return top_k(scores, candidates, k)
+
+
+def tfidf_query_or(query, index, k = 10):
+    """
+    This function finds the k documents containing at least one word of the query
+    with the largest cosine similiarity with the query (disjunctive query, OR).
+    
+    It uses the MaxScore idea: every word has an upper bound of what it can add to the score
+    of a document. The words are processed from the one with the largest upper bound, accumulating
+    the scores of their documents; as soon as the k-th best score is larger than the sum of the upper
+    bounds of the remaining words, no new document can enter the top k, so the remaining words
+    (usually the most common ones, with the longest postings) are only looked up (binary search)
+    for the documents that can still reach the top k, and these are pruned after every word.
+    A prefix (see parse_query) adds all its words to the query, see query_weights.
+    
+    Arguments
+        query : list of words
+        index : TfidfIndex
+        k     : number of documents to return
+    Returns
+        dict, doc -> cosine similiarity, sorted by descending similiarity
+    """
+    weights = query_weights(query, index.idf)
+    q_norm = math.sqrt(sum(w*w for w in weights.values()))
+    if q_norm == 0 or k <= 0:
+        return {}
+    
+    #one entry for each word: documents, contributions, weight in the query, upper bound
+    terms = []
+    for word, q_w in weights.items():
+        docs, contribs, max_contrib = index.doc_postings(word)
+        if len(docs):
+            terms.append((docs, contribs, q_w / q_norm, q_w / q_norm * max_contrib))
+    terms.sort(key = lambda t: -t[3]) #by decreasing upper bound
+    
+    #rest_ub[i] = sum of the upper bounds of the words i, i+1, ...
+    rest_ub = list(np.cumsum([t[3] for t in terms[::-1]])[::-1]) + [0.]
+    
+    scores = np.zeros(index.n_docs)
+    hit = np.zeros(index.n_docs, dtype = bool)
+    threshold = 0.
+    
+    #essential words: all their documents are scored
+    i = 0
+    while i < len(terms):
+        if i > 0:
+            seen = np.flatnonzero(hit)
+            if len(seen) >= k:
+                threshold = np.partition(scores[seen], -k)[-k]
+                if rest_ub[i] <= threshold:
+                    break
+        docs, contribs, q_w, _ = terms[i]
+        scores[docs] += q_w * contribs
+        hit[docs] = True
+        i += 1
+    
+    candidates = np.flatnonzero(hit)
+    
+    #non essential words: only the documents which can still reach the top k are looked up
+    for j in range(i, len(terms)):
+        candidates = candidates[scores[candidates] + rest_ub[j] >= threshold]
+        
+        docs, contribs, q_w, _ = terms[j]
+        pos = np.searchsorted(docs, candidates)
+        found = pos < len(docs)
+        found[found] = docs[pos[found]] == candidates[found]
+        scores[candidates[found]] += q_w * contribs[pos[found]]
+        
+        threshold = np.partition(scores[candidates], -k)[-k]
+    
+    candidates = candidates[scores[candidates] >= threshold]
+    return top_k(scores, candidates, k)
+
+
+# The cache shared by the ranked searches
+TFIDF_CACHE = ResultCache()
+
+def cached_search(query, index, k = 10, search = tfidf_top_k, cache = None):
+    """
+    Runs search (tfidf_top_k or tfidf_query_or) through a result cache, the results are
+    computed again only if the query (as a multiset of word ids) or k are new, if they are too old
+    or if the index has changed
+    
+    Arguments
+        query  : list of words
+        index  : TfidfIndex
+        k      : number of documents to return
+        search : the ranked search to run
+        cache  : ResultCache, by default the shared one
+    Returns
+        dict, doc -> cosine similiarity, sorted by descending similiarity
+    """
+    cache = TFIDF_CACHE if cache is None else cache
+    key = (search.__name__, canonical_key(query, k))
+    return dict(cache.cached(key, index.version(), lambda: search(query, index, k)))
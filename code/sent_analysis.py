@@ -1,10 +1,14 @@
+import contextlib
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib.lines import Line2D
 from nltk.sentiment import SentimentIntensityAnalyzer
 from nltk.tokenize import sent_tokenize
 
+from tsv_reader import TSV_FILE, iter_chunks
+
 
 def filter_by_length(lst, length):
     """
@@ -41,22 +45,31 @@ def norm_col(lst, new_min = 0, new_max = 1):
     return new_min + (new_max - new_min) * (np.array(lst) - lst_min) / (lst_max - lst_min)
 
 
-def compound_score(text, sia):
+def compound_score(text, sia, cache = None):
     """
     This function computes VADER's compound score
     of some text
     
     Arguments:
-        text : (string)
-        sia: nltk.SentimentIntensityAnalyzer() object
+        text  : (string)
+        sia   : nltk.SentimentIntensityAnalyzer() object
+        cache : sentiment_cache.SentimentCache, the score
+                is computed only if the text is not in it
     Returns:
         float between -1 and 1
     """
+    
+    if cache is not None:
+        score = cache.get(text)
+        if score is None:
+            score = sia.polarity_scores(text)['compound']
+            cache.put(text, score)
+        return score
         
     return sia.polarity_scores(text)['compound']
 
 
-def score_of_review(review, sia):
+def score_of_review(review, sia, cache = None):
     """
     This function computes the mean compound score
     for a review, by averaging the scores for each sentence
@@ -64,15 +77,16 @@ def score_of_review(review, sia):
     Arguments:
         review : (string)
         sia    : nltk.SentimentIntensityAnalyzer() object
+        cache  : sentiment_cache.SentimentCache (optional)
     Returns:
         float between -1 and 1
     """
     
-    return np.mean([compound_score(sentence, sia) 
+    return np.mean([compound_score(sentence, sia, cache) 
                     for sentence in sent_tokenize(review) if sentence])
 
 
-def score_of_anime(reviews, sia):
+def score_of_anime(reviews, sia, cache = None):
     """
     This function computes the mean compound score
     for an anime, by averaging the scores for each review
@@ -80,14 +94,181 @@ def score_of_anime(reviews, sia):
     Arguments:
         reviews : list of strings
         sia     : nltk.SentimentIntensityAnalyzer() object
+        cache   : sentiment_cache.SentimentCache (optional)
     Returns:
         float between -1 and 1
     """
     
-    return np.mean([score_of_review(review, sia) 
+    return np.mean([score_of_review(review, sia, cache) 
                     for review in reviews])
 
 
+def flatten_reviews(reviews):
+    """
+    This function splits all the reviews of all the
+    animes into a single list of sentences
+    
+    Arguments:
+        reviews : list-like (i.e. the top_reviews column),
+                  a list of strings for each anime
+    Returns:
+        sentences         : list of strings
+        review_of_sentence : (numpy array) index of the review of each sentence
+        anime_of_review   : (numpy array) index of the anime of each review
+    """
+    
+    sentences = []
+    review_of_sentence = []
+    anime_of_review = []
+    
+    for anime, anime_reviews in enumerate(reviews):
+        for review in anime_reviews:
+            review_idx = len(anime_of_review)
+            anime_of_review.append(anime)
+            for sentence in sent_tokenize(review):
+                if sentence:
+                    sentences.append(sentence)
+                    review_of_sentence.append(review_idx)
+    
+    return (sentences,
+            np.array(review_of_sentence, dtype = np.int64),
+            np.array(anime_of_review, dtype = np.int64))
+
+
+#the analyzer of each worker process of bulk_scores
+_worker_sia = None
+
+def _init_worker():
+    global _worker_sia
+    _worker_sia = SentimentIntensityAnalyzer()
+
+
+def _score_sentences(sentences):
+    """
+    This function computes the compound score of each
+    sentence with the analyzer of the worker
+    """
+    
+    return np.array([compound_score(sentence, _worker_sia) for sentence in sentences])
+
+
+def group_means(values, groups, n_groups):
+    """
+    This function computes the mean of the values of
+    each group (nan for the groups without values,
+    as np.mean of an empty list)
+    
+    Arguments:
+        values   : (numpy array) floats
+        groups   : (numpy array) group of each value
+        n_groups : (int)
+    Returns:
+        (numpy array) mean of each group
+    """
+    
+    sums = np.bincount(groups, weights = values, minlength = n_groups)
+    counts = np.bincount(groups, minlength = n_groups)
+    
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return sums / counts
+
+
+def bulk_scores(reviews, workers = None, chunk_size = 2000, cache = None, executor = None):
+    """
+    This function computes the same scores of score_of_review
+    and score_of_anime for all the animes at once: the reviews
+    are flattened into sentences, the sentences are scored in
+    chunks by a pool of processes (each one with its own analyzer)
+    and the scores are averaged back per review and per anime
+    
+    Arguments:
+        reviews    : list-like (i.e. the top_reviews column),
+                     a list of strings for each anime
+        workers    : (int) number of processes, None to use all the cpus
+                     and 1 to score in this process
+        chunk_size : (int) number of sentences sent to a worker at a time
+        cache      : sentiment_cache.SentimentCache, only the sentences
+                     not in it are scored (and then added to it)
+        executor   : a ProcessPoolExecutor created with initializer = _init_worker
+                     to use instead of a new pool (workers is then ignored)
+    Returns:
+        anime_scores  : (numpy array) mean compound score of each anime
+        review_scores : list with the scores of the reviews of each anime
+    """
+    
+    sentences, review_of_sentence, anime_of_review = flatten_reviews(reviews)
+    n_animes = len(reviews)
+    
+    scores = np.zeros(len(sentences))
+    todo = np.arange(len(sentences))
+    if cache is not None:
+        cached = np.array([np.nan if s is None else s for s in cache.get_many(sentences)], dtype = float)
+        todo = np.flatnonzero(np.isnan(cached))
+        scores[:] = cached
+    new_sentences = [sentences[i] for i in todo]
+    
+    chunks = [new_sentences[i:i + chunk_size] for i in range(0, len(new_sentences), chunk_size)]
+    if not chunks:
+        new_scores = []
+    elif executor is not None:
+        new_scores = list(executor.map(_score_sentences, chunks))
+    elif workers == 1:
+        _init_worker()
+        new_scores = list(map(_score_sentences, chunks))
+    else:
+        with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker) as executor:
+            new_scores = list(executor.map(_score_sentences, chunks))
+    new_scores = np.concatenate(new_scores) if new_scores else np.zeros(0)
+    scores[todo] = new_scores
+    
+    if cache is not None:
+        cache.put_many(new_sentences, new_scores)
+        cache.flush()
+    
+    review_means = group_means(scores, review_of_sentence, len(anime_of_review))
+    anime_means = group_means(review_means, anime_of_review, n_animes)
+    
+    #the reviews of each anime are contiguous
+    bounds = np.searchsorted(anime_of_review, np.arange(n_animes + 1))
+    review_scores = [review_means[bounds[i]:bounds[i + 1]] for i in range(n_animes)]
+    
+    return anime_means, review_scores
+
+
+def stream_scores(tsv = TSV_FILE, min_length = 100, workers = None, 
+                  animes_per_chunk = 500, chunk_size = 2000, cache = None):
+    """
+    This function computes the mean compound score of every anime
+    of the total tsv as bulk_scores, but reading the top reviews 
+    of only animes_per_chunk animes at a time, so that the memory
+    used doesn't depend on the size of the file
+    
+    Arguments:
+        tsv              : path of the total tsv
+        min_length       : (int) the reviews not longer than this
+                           are ignored (see filter_by_length)
+        workers          : (int) number of processes, None to use
+                           all the cpus and 1 to score in this process
+        animes_per_chunk : (int) number of animes read at a time
+        chunk_size       : (int) see bulk_scores
+        cache            : sentiment_cache.SentimentCache (optional)
+    Yields:
+        first_doc   : (int) doc id of the first anime of the chunk
+        anime_means : (numpy array) mean compound score of each anime
+                      of the chunk (nan for the ones without reviews)
+    """
+    
+    with contextlib.ExitStack() as stack:
+        executor = None
+        if workers != 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers = workers, initializer = _init_worker))
+        
+        for first_doc, columns in iter_chunks(tsv, ['top_reviews'], animes_per_chunk):
+            reviews = [filter_by_length(r or [], min_length) for r in columns['top_reviews']]
+            anime_means, _ = bulk_scores(reviews, 1, chunk_size, cache, executor)
+            yield first_doc, anime_means
+
+
 def sent_of_anime(score):
     """
     This function sets the thresholds to classify
@@ -0,0 +1,124 @@
+'''
+
+    This file contains a persistent cache of the sentiment scores of the sentences of the reviews:
+    a SQLite database mapping the hash of a sentence to its VADER compound score.
+
+    The top reviews rarely change between two scrapes, so when the sentiment analysis is run again
+    only the new sentences are scored. The cache keeps at most max_entries sentences, the least
+    recently used ones are evicted first, and it counts its hits and misses.
+
+'''
+
+import hashlib
+import sqlite3
+from time import time
+
+
+def sentence_key(sentence):
+    '''
+        Returns the hash of a sentence (16 bytes)
+    '''
+    return hashlib.blake2b(sentence.encode(), digest_size=16).digest()
+
+
+class SentimentCache:
+    '''
+        Persistent cache sentence -> compound score, stored in the SQLite file 'path'.
+        The new scores and the accesses are written in batches: call flush (or close, or use it
+        in a with statement) to make them persistent.
+    '''
+
+    def __init__(self, path, max_entries=1_000_000, batch_size=10_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._pending = dict() # key -> score, not written yet
+        self._touched = set()  # keys read since the last flush
+
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS scores (
+                                    key BLOB PRIMARY KEY,
+                                    compound REAL,
+                                    used REAL)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS scores_used ON scores (used)')
+
+    def get_many(self, sentences):
+        '''
+            Returns the list of the scores of the sentences, None for the ones not in the cache
+        '''
+        keys = [sentence_key(sentence) for sentence in sentences]
+        found = {key: self._pending[key] for key in keys if key in self._pending}
+
+        missing = list({key for key in keys if key not in found})
+        for i in range(0, len(missing), 500): # sqlite limits the number of parameters
+            chunk = missing[i:i + 500]
+            rows = self.conn.execute(f'SELECT key, compound FROM scores WHERE key IN ({",".join("?" * len(chunk))})',
+                                     chunk)
+            found.update(rows)
+
+        ret = [found.get(key) for key in keys]
+        hits = sum(score is not None for score in ret)
+        self.hits += hits
+        self.misses += len(ret) - hits
+        self._touched.update(key for key in keys if key in found)
+        return ret
+
+    def get(self, sentence):
+        return self.get_many([sentence])[0]
+
+    def put_many(self, sentences, scores):
+        for sentence, score in zip(sentences, scores):
+            self._pending[sentence_key(sentence)] = float(score)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def put(self, sentence, score):
+        self.put_many([sentence], [score])
+
+    def flush(self):
+        '''
+            Writes the new scores and the accesses, then evicts the least recently used
+            sentences beyond max_entries
+        '''
+        now = time()
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?)',
+                                  ((key, score, now) for key, score in self._pending.items()))
+            self.conn.executemany('UPDATE scores SET used = ? WHERE key = ?',
+                                  ((now, key) for key in self._touched if key not in self._pending))
+            excess = self.conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute('DELETE FROM scores WHERE key IN '
+                                  '(SELECT key FROM scores ORDER BY used LIMIT ?)', (excess,))
+        self._pending = dict()
+        self._touched = set()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def stats(self):
+        '''
+            Returns hits, misses, hit rate and number of sentences in the cache
+        '''
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate(), 'size': len(self)}
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0] + \
+            sum(1 for key in self._pending if not self._in_db(key))
+
+    def _in_db(self, key):
+        return self.conn.execute('SELECT 1 FROM scores WHERE key = ?', (key,)).fetchone() is not None
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
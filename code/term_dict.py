@@ -0,0 +1,206 @@
+'''
+
+    This file contains a compact format for the vocabularies stored in
+    shared_stuff/indexes/<field>/vocabulary.json and the reader to query it.
+
+    The file (vocabulary.bin) is made of:
+        * a header:      magic, number of terms, size of the terms section
+        * the offsets:   where each term starts in the terms section (uint32, one more than the terms)
+        * the ids:       the id of each term (uint32)
+        * the terms:     the terms sorted and utf-8 encoded, one after the other
+
+    The reader maps the file in memory (mmap): opening a vocabulary doesn't parse anything and
+    a term is found by binary search. Since the terms are sorted, all the terms starting with a
+    prefix are next to each other, so prefix queries (i.e. goh*) are two binary searches.
+
+'''
+
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+import numpy as np
+
+MAGIC = b'ADMVOC01'
+HEADER = struct.Struct('<8sIQ')  # magic, n_terms, terms size
+
+# ---------------------------------------------------------------------------- #
+#                                    Writer                                    #
+# ---------------------------------------------------------------------------- #
+
+def write_term_dict(vocab, filename):
+    '''
+        Given a vocabulary {term: id} it writes it in the binary format in 'filename'
+    '''
+    # the utf-8 encoding keeps the order of the strings
+    terms = sorted(vocab)
+    encoded = [term.encode() for term in terms]
+
+    offsets = np.zeros(len(terms) + 1, dtype='<u4')
+    offsets[1:] = np.cumsum([len(term) for term in encoded])
+    ids = np.array([vocab[term] for term in terms], dtype='<u4')
+    blob = b''.join(encoded)
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(terms), len(blob)))
+        f.write(offsets.tobytes())
+        f.write(ids.tobytes())
+        f.write(blob)
+
+
+def json_to_term_dict(json_file, bin_file=None):
+    '''
+        Converts an existing vocabulary.json into the binary format.
+        If bin_file is not given the output is stored next to the json file as vocabulary.bin
+    '''
+    if bin_file is None:
+        bin_file = os.path.join(os.path.dirname(json_file), 'vocabulary.bin')
+
+    with open(json_file, 'r') as f:
+        vocab = json.load(f)
+    write_term_dict(vocab, bin_file)
+    return bin_file
+
+
+def convert_vocabularies(path=os.path.join('..', 'shared_stuff', 'indexes')):
+    '''
+        Converts the vocabulary.json of every index directory in 'path' in the binary format
+    '''
+    for idx_dir in os.listdir(path):
+        json_file = os.path.join(path, idx_dir, 'vocabulary.json')
+        if idx_dir.startswith('.') or not os.path.exists(json_file):
+            continue
+        print(f"[{idx_dir}]: converted in {json_to_term_dict(json_file)}")
+
+# ---------------------------------------------------------------------------- #
+#                                    Reader                                    #
+# ---------------------------------------------------------------------------- #
+
+class TermDict(Mapping):
+    '''
+        Read only view of a vocabulary.bin file.
+
+        It behaves as the dictionary read from the corresponding JSON file, so it can be
+        passed as it is to parse_query:
+            vocab[term] -> id of the term
+        and it also gives the terms starting with a prefix:
+            vocab.prefix(prefix) -> ids of the terms
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, n_terms, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a binary vocabulary")
+
+        pos = HEADER.size
+        self._offsets = np.frombuffer(self._mm, dtype='<u4', count=n_terms + 1, offset=pos)
+        pos += 4 * (n_terms + 1)
+        self._ids = np.frombuffer(self._mm, dtype='<u4', count=n_terms, offset=pos)
+        self._terms_start = pos + 4 * n_terms
+        # plain lists: indexing them in the binary search is faster than indexing numpy arrays
+        self._starts = (self._offsets + self._terms_start).tolist()
+
+    def _term(self, pos):
+        return self._mm[self._starts[pos]:self._starts[pos + 1]]
+
+    def _lower_bound(self, key, prefix=False):
+        '''
+            Returns the position of the first term not smaller than key
+            (with prefix=True, the position of the first term that doesn't start with key and is larger)
+        '''
+        lo, hi = 0, len(self._ids)
+        n = len(key)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            term = self._term(mid)
+            if (term[:n] <= key) if prefix else (term < key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __getitem__(self, term):
+        if not isinstance(term, str):
+            raise KeyError(term)
+        key = term.encode()
+        pos = self._lower_bound(key)
+        if pos == len(self._ids) or self._term(pos) != key:
+            raise KeyError(term)
+        return int(self._ids[pos])
+
+    def prefix_range(self, prefix):
+        '''
+            Returns the positions (start, end) of the terms starting with prefix
+        '''
+        key = prefix.encode()
+        return self._lower_bound(key), self._lower_bound(key, prefix=True)
+
+    def prefix(self, prefix):
+        '''
+            Returns the ids of the terms starting with prefix
+        '''
+        start, end = self.prefix_range(prefix)
+        return self._ids[start:end].tolist()
+
+    def prefix_items(self, prefix):
+        '''
+            Returns the list of (term, id) of the terms starting with prefix
+        '''
+        start, end = self.prefix_range(prefix)
+        return [(self._term(pos).decode(), int(self._ids[pos])) for pos in range(start, end)]
+
+    def __iter__(self):
+        return (self._term(pos).decode() for pos in range(len(self._ids)))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def close(self):
+        # the numpy views keep a reference to the map, drop them first
+        self._offsets = self._ids = None
+        self._mm.close()
+
+
+def prefix_ids(vocab, prefix):
+    '''
+        Returns the ids of the terms of the vocabulary starting with prefix,
+        with a TermDict or with a dictionary read from a JSON file (scanning all its terms)
+    '''
+    if isinstance(vocab, TermDict):
+        return vocab.prefix(prefix)
+    return [idx for term, idx in vocab.items() if term.startswith(prefix)]
+
+
+def vocab_file(idx_dir):
+    '''
+        Given the directory of an index it returns the file its vocabulary should be read from:
+        the binary version if it exists and it's not older than the JSON one, otherwise the JSON file
+    '''
+    json_file = os.path.join(idx_dir, 'vocabulary.json')
+    bin_file = os.path.join(idx_dir, 'vocabulary.bin')
+
+    if os.path.exists(bin_file) and \
+            (not os.path.exists(json_file) or os.path.getmtime(bin_file) >= os.path.getmtime(json_file)):
+        return bin_file
+    return json_file
+
+
+def read_vocab(filename):
+    '''
+        Reads a vocabulary from a binary or JSON file
+    '''
+    if filename.endswith('.bin'):
+        return TermDict(filename)
+
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    convert_vocabularies()
@@ -0,0 +1,92 @@
+import os
+import random
+import re
+import sys
+
+import pytest
+
+# the modules are in code/, imported as in the notebook
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import html_parser
+import index_builder
+import search_eng
+
+WORDS = "the of hero magic school girl boy fight dragon world story love friend battle ninja pirate".split()
+
+
+@pytest.fixture
+def simple_preprocessing(monkeypatch):
+    '''
+        Splits the words with a regex and uses a few stop words, so that the tests of the indexes
+        don't need the nltk data (punkt and the stop words)
+    '''
+    monkeypatch.setattr(search_eng, 'word_tokenize', lambda text: re.findall(r"\w+|[^\w\s]", text))
+    monkeypatch.setattr(search_eng, 'stopwords',
+                        type('Stopwords', (), {'words': staticmethod(lambda lang: ['the', 'of', 'a', 'and'])}))
+    monkeypatch.setattr(search_eng, '_BAD_WORDS', None)
+    monkeypatch.setattr(index_builder, '_PREPROCESSOR', None)
+
+
+def sentence(rng, n_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + '.'
+
+
+def make_page(idx, rng):
+    '''
+        Returns the html of a small anime page with the parts read by html_parser.get_total_info
+    '''
+    characters = ''.join(f"<tr><td class='borderClass'>img</td><td class='borderClass'><a href='/c'>Char {idx} {j}</a></td>"
+                         f"<td class='borderClass'><a href='/p'>Voice {rng.choice(WORDS)}</a></td></tr>"
+                         for j in range(rng.randint(0, 3)))
+    staff = ''.join(f"<tr><td class='borderClass'>img</td><td class='borderClass'><a href='/s'>Staff {rng.choice(WORDS)}</a>"
+                    f"<small>Director, Producer</small></td></tr>" for _ in range(rng.randint(0, 2)))
+    reviews = ''.join(f"<div class='spaceit textReadability word-break pt8 mt8'><div>x</div><div>y</div> {sentence(rng, 12)} </div>"
+                      for _ in range(rng.randint(0, 2)))
+    return f"""<html><head><title>Anime {idx} {sentence(rng, 2)} - MyAnimeList.net</title></head><body>
+<div class="spaceit_pad">
+<span class="dark_text">Type:</span>
+<a href="/t">TV</a>
+</div>
+<div class="spaceit_pad">
+<span class="dark_text">Episodes:</span> {rng.choice(['12', '24', 'Unknown'])} </div>
+<div class="spaceit_pad">
+<span class="dark_text">Aired:</span> {rng.choice(['Apr 3, 2010 to Sep 2011', '2005', 'Jan 2001 to ?'])} </div>
+<div class="spaceit_pad">
+<span class="dark_text">Score:</span> <span itemprop="ratingValue">{rng.randint(100, 999) / 100}</span> <span itemprop="ratingCount">{rng.randint(1, 99999)}</span></div>
+<div class="spaceit_pad">
+<span class="dark_text">Ranked:</span> #{rng.randint(1, 9999)}<sup>2</sup></div>
+<div class="spaceit_pad">
+<span class="dark_text">Popularity:</span> #{rng.randint(1, 9999)} </div>
+<div class="spaceit_pad">
+<span class="dark_text">Members:</span> {rng.randint(1, 999999):,} </div>
+<p itemprop="description">{sentence(rng, 20)}</p>
+{"<table class='anime_detail_related_anime'><tr><td><a href='/r'>Rel A</a><a href='/r'>Rel B</a></td></tr></table>" if idx % 3 else ""}
+{reviews}
+<div class="detail-characters-list clearfix"><h3 class="h3_characters_voice_actors">C</h3><table>{characters}</table></div>
+<div class="detail-characters-list clearfix"><table>{staff}</table></div>
+</body></html>"""
+
+
+@pytest.fixture
+def pages_dir(tmp_path):
+    '''
+        A directory with the html pages article_0.html ... article_11.html
+    '''
+    rng = random.Random(0)
+    pages = tmp_path / 'html_pages'
+    pages.mkdir()
+    for idx in range(12):
+        (pages / f'article_{idx}.html').write_text(make_page(idx, rng))
+    return str(pages)
+
+
+def write_tsv(path, infos):
+    '''
+        Writes the total tsv of the infos (dictionaries with some of the fields), as save_tsv_info
+    '''
+    with open(path, 'w') as f:
+        f.write(html_parser.info_to_tsv(html_parser.empty_info())[0])
+        for info in infos:
+            f.write('\n' + html_parser.info_to_tsv({**html_parser.empty_info(), **info})[1])
+    return str(path)
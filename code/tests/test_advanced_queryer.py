@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+import advanced_queryer
+
+
+def frame():
+    return pd.DataFrame({'title': ['Dragon ball', 'Naruto', 'One piece film'], 'synopsis': ['a b c', 'a', 'a b'],
+                         'staff': ['x'] * 3, 'voices': ['y'] * 3, 'characters': ['z'] * 3})
+
+
+def test_scorer_is_rebuilt_after_an_edit():
+    df = frame()
+    scorer = advanced_queryer.get_scorer(df)
+    assert advanced_queryer.get_scorer(df) is scorer
+    assert list(scorer.lengths['title']) == [2, 1, 3]
+
+    # same object and same length, only the content changes
+    df.loc[1, 'title'] = 'Naruto shippuden the movie'
+    advanced_queryer.edited(df)
+    scorer = advanced_queryer.get_scorer(df)
+    assert list(scorer.lengths['title']) == [2, 4, 3]
+    docs, scores = scorer.top_k([0, 1, 2], {'title': 1})
+    assert list(docs) == [0, 2, 1]
+    assert np.allclose(scores, [0.7 / 2, 0.7 / 3, 0.7 / 4])
+
+    # another dataframe with the same length gets its own scorer
+    other = frame()
+    assert list(advanced_queryer.get_scorer(other).lengths['title']) == [2, 1, 3]
+
+
+def test_the_results_of_an_edited_frame_are_not_cached():
+    df = frame()
+    version = advanced_queryer.df_version(df)
+    assert advanced_queryer.df_version(df) == version
+    advanced_queryer.edited(df)
+    assert advanced_queryer.df_version(df) != version
+    assert advanced_queryer.df_version(frame()) != advanced_queryer.df_version(df)
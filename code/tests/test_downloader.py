@@ -0,0 +1,150 @@
+import asyncio
+import os
+from time import monotonic
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import downloader
+from manifest import DONE, DownloadManifest
+from page_store import PageStore
+
+
+class Site:
+    '''
+        A local stand-in of the site: /anime/<idx> gives the page of the anime, with an ETag.
+        The statuses of 'blocks' are answered to the first requests of a page (403, or 200 with the captcha)
+    '''
+
+    def __init__(self, blocks=None):
+        self.blocks = {idx: list(statuses) for idx, statuses in (blocks or dict()).items()}
+        self.versions = dict()
+        self.requests = [] # (time, idx, status)
+        self.port = None # the same urls in every run
+
+    def page(self, idx):
+        return f"<html><body>anime {idx} version {self.versions.get(idx, 1)}</body></html>"
+
+    async def handle(self, request):
+        idx = int(request.match_info['idx'])
+        if self.blocks.get(idx):
+            status = self.blocks[idx].pop(0)
+            self.requests.append((monotonic(), idx, status))
+            if status == 403:
+                return web.Response(status=403, text="Forbidden")
+            return web.Response(text=f"<html>{downloader.ERROR_BTN}</html>", content_type='text/html')
+
+        etag = f'"{idx}-{self.versions.get(idx, 1)}"'
+        if request.headers.get('If-None-Match') == etag:
+            self.requests.append((monotonic(), idx, 304))
+            return web.Response(status=304, headers={'ETag': etag})
+        self.requests.append((monotonic(), idx, 200))
+        return web.Response(text=self.page(idx), content_type='text/html', headers={'ETag': etag})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/anime/{idx}', self.handle)
+        return app
+
+
+def download(site, tmp_path, n_pages, **kwargs):
+    '''
+        Runs download_pages_async of n_pages pages of the site in tmp_path/pages,
+        it returns the failed pages and the seconds it took
+    '''
+    out = tmp_path / 'pages'
+    out.mkdir(exist_ok=True)
+
+    async def run():
+        async with TestServer(site.app(), port=site.port) as server:
+            site.port = server.port
+            urls = tmp_path / 'url_list.txt'
+            urls.write_text(''.join(f"{server.make_url(f'/anime/{idx}')}\n" for idx in range(n_pages)))
+            start = monotonic()
+            failed = await downloader.download_pages_async(str(urls), str(out), timeout=10, **kwargs)
+            return failed, monotonic() - start
+
+    return asyncio.run(run())
+
+
+def site_url(site, idx):
+    return f"http://127.0.0.1:{site.port}/anime/{idx}"
+
+
+def read_page(tmp_path, idx):
+    with open(os.path.join(tmp_path, 'pages', f'article_{idx}.html')) as f:
+        return f.read()
+
+
+def test_rate_limit(tmp_path):
+    site = Site()
+    failed, seconds = download(site, tmp_path, 30, concurrency=8, rate=20.)
+
+    assert failed == []
+    assert all(read_page(tmp_path, idx) == site.page(idx) for idx in range(30))
+    # a burst of 'capacity' (20) requests, then 20 per second
+    assert seconds >= 10 / 20 * 0.9
+    start = site.requests[0][0]
+    assert sum(t - start < 0.2 for t, _, _ in site.requests) <= 20 + 0.2 * 20 + 1
+
+
+def test_retry_when_blocked(tmp_path):
+    site = Site(blocks={1: [403], 2: [200, 403]}) # 200 with the captcha button
+    failed, _ = download(site, tmp_path, 4, concurrency=2, rate=50., min_pause=0, max_pause=0)
+
+    assert failed == []
+    statuses = [(idx, status) for _, idx, status in site.requests]
+    assert statuses.count((1, 403)) == 1 and statuses.count((2, 403)) == 1
+    assert [status for idx, status in statuses if idx == 2] == [200, 403, 200]
+    # the captcha page isn't saved, the page of the retry is
+    assert all(read_page(tmp_path, idx) == site.page(idx) for idx in range(4))
+
+
+def test_token_bucket_slows_down_and_recovers():
+    bucket = downloader.TokenBucket(8.)
+    bucket.slow_down(0)
+    bucket.slow_down(0)
+    assert bucket.rate == 2. and bucket.tokens == 0
+    for _ in range(100):
+        bucket.speed_up()
+    assert bucket.rate == 8.
+
+
+def test_refresh_with_conditional_requests(tmp_path):
+    site = Site()
+    manifest = DownloadManifest(str(tmp_path / 'manifest.sqlite'))
+    assert download(site, tmp_path, 3, manifest=manifest)[0] == []
+    assert all(manifest.get(idx)['etag'] == f'"{idx}-1"' for idx in range(3))
+
+    # a second run skips the pages already downloaded
+    site.requests.clear()
+    assert download(site, tmp_path, 3, manifest=manifest)[0] == []
+    assert site.requests == []
+
+    # refreshing, only the page that changed is transferred
+    site.versions[1] = 2
+    assert download(site, tmp_path, 3, manifest=manifest, refresh=True)[0] == []
+    assert sorted((idx, status) for _, idx, status in site.requests) == [(0, 304), (1, 200), (2, 304)]
+    assert read_page(tmp_path, 1) == site.page(1)
+    assert read_page(tmp_path, 0) == site.page(0)
+    assert manifest.get(0)['status'] == DONE and manifest.get(0)['http_status'] == 304
+    assert manifest.get(1)['etag'] == '"1-2"'
+    manifest.close()
+
+
+def test_resume_downloads_the_pages_not_flushed(tmp_path):
+    site = Site()
+    manifest = DownloadManifest(str(tmp_path / 'manifest.sqlite'))
+    store = PageStore(str(tmp_path / 'store'), codec='gzip', chunk_size=4)
+    assert download(site, tmp_path, 6, concurrency=1, manifest=manifest, store=store)[0] == []
+    # killed before closing the store: the last 2 pages were only in memory
+    del store
+    assert [idx for idx in range(6) if manifest.is_done(idx, site_url(site, idx))] == [0, 1, 2, 3]
+
+    site.requests.clear()
+    with PageStore(str(tmp_path / 'store')) as store:
+        assert download(site, tmp_path, 6, manifest=manifest, store=store)[0] == []
+    assert sorted(idx for _, idx, _ in site.requests) == [4, 5]
+    assert all(manifest.is_done(idx, site_url(site, idx)) for idx in range(6))
+    assert [PageStore(str(tmp_path / 'store'))[idx] for idx in range(6)] == [site.page(idx) for idx in range(6)]
+    manifest.close()
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import columnar
+import html_parser
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_parallel_columnar_output(tmp_path, pages_dir, fmt):
+    for workers in (1, 2):
+        failed = html_parser.save_tsv_info(0, 12, pages_dir, str(tmp_path / f'workers_{workers}'), workers=workers,
+                                           chunksize=3, fmt=fmt)
+        assert failed == []
+
+    serial = columnar.read_table(str(tmp_path / 'workers_1' / f'total_pages.{fmt}'))
+    parallel = columnar.read_table(str(tmp_path / 'workers_2' / f'total_pages.{fmt}'))
+    assert parallel.num_rows == 12
+    assert parallel.equals(serial)
+    assert parallel.column('title').to_pylist() == [html_parser.get_total_info_from_idx(idx, pages_dir)['title']
+                                                    for idx in range(12)]
+
+
+def test_info_job_returns_plain_values(pages_dir):
+    # the NavigableStrings keep the whole soup: pickling them fails on the real (deep) pages
+    for idx in range(12):
+        _, info, error = html_parser.info_job((idx, pages_dir, html_parser.DEFAULT_BACKEND))
+        assert error is None
+        for value in info.values():
+            for v in (value if isinstance(value, list) else [value]):
+                assert not isinstance(v, str) or type(v) is str
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_ranges_are_appended_as_parts(tmp_path, pages_dir, fmt):
+    dst = str(tmp_path / 'tsv')
+    table_file = str(tmp_path / 'tsv' / f'total_pages.{fmt}')
+    html_parser.save_tsv_info(0, 5, pages_dir, dst, fmt=fmt)
+    first_part = columnar.part_name(table_file, 0)
+    written = os.stat(first_part).st_mtime_ns
+    with pytest.raises(ValueError):
+        html_parser.save_tsv_info(6, 12, pages_dir, dst, fmt=fmt)
+    html_parser.save_tsv_info(5, 9, pages_dir, dst, fmt=fmt)
+    html_parser.save_tsv_info(9, 12, pages_dir, dst, fmt=fmt)
+
+    # every range wrote only its own rows
+    assert [columnar.num_rows(part) for part in columnar.parts(table_file)] == [5, 4, 3]
+    assert os.stat(first_part).st_mtime_ns == written
+    assert columnar.num_rows(table_file) == 12
+    html_parser.save_tsv_info(0, 12, pages_dir, str(tmp_path / 'all'), fmt=fmt)
+    assert columnar.read_table(table_file).equals(columnar.read_table(str(tmp_path / 'all' / f'total_pages.{fmt}')))
+    assert [title.split()[1] for title in columnar.load_df(table_file, ['title'])['title']] == [str(idx) for idx in range(12)]
+
+
+def test_single_file_table_becomes_the_first_part(tmp_path, pages_dir):
+    path = str(tmp_path / 'total_pages.parquet')
+    infos = [html_parser.get_total_info_from_idx(idx, pages_dir) for idx in range(4)]
+    columnar.write_table(infos[:3], path)
+    assert os.path.isfile(path)
+    columnar.write_table(infos[3:], path, first_row=3)
+    assert [os.path.basename(part) for part in columnar.parts(path)] == ['part-000000000.parquet', 'part-000000003.parquet']
+    table = columnar.read_table(path)
+    assert table.equals(columnar.infos_to_table(infos).cast(table.schema))
+    # without first_row the table is replaced
+    columnar.write_table(infos[:1], path)
+    assert os.path.isfile(path) and columnar.num_rows(path) == 1
@@ -0,0 +1,154 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import index_builder
+import search_eng
+from conftest import write_tsv
+from tsv_reader import read_column
+
+SYNOPSES = ['Dragon ball goku fight', 'Dragon slayer', 'Drama school', 'Ball school goku goku',
+            'Ninja school', None, 'Pirate world pirate story', 'Giraffe love story']
+
+
+def read(field_dir, name):
+    with open(os.path.join(field_dir, name)) as f:
+        return json.load(f)
+
+
+def expected_tfidf(tsv, vocab):
+    '''
+        The tf-idf index of the synopsis computed as in the notebook
+    '''
+    prep = search_eng.Preprocessor()
+    corpus = [prep(index_builder.field_text('synopsis', value)) for value in read_column(tsv, 'synopsis')]
+    inv_idx, idf = search_eng.create_inv_idx2(corpus, vocab)
+    return (json.loads(json.dumps(inv_idx)), json.loads(json.dumps(idf)),
+            search_eng.create_doc_norms(inv_idx, len(corpus)))
+
+
+def assert_same_tfidf(field_dir, expected):
+    inv_idx, idf, norms = expected
+    assert read(field_dir, 'idf.json') == pytest.approx(idf)
+    saved = read(field_dir, 'inv_idx_tfldf.json')
+    assert saved.keys() == inv_idx.keys()
+    for term, postings in inv_idx.items():
+        assert dict(map(tuple, saved[term])) == pytest.approx(dict(map(tuple, postings)))
+    assert np.allclose(np.load(os.path.join(field_dir, 'doc_norms.npy')), norms)
+
+
+@pytest.fixture
+def tsv(tmp_path):
+    return write_tsv(tmp_path / 'total_pages.tsv', [{'title': f'Anime {i}', 'synopsis': s} for i, s in enumerate(SYNOPSES)])
+
+
+def test_build_replaces_the_old_tfidf_index(tmp_path, tsv, simple_preprocessing):
+    out = tmp_path / 'indexes'
+    synopsis_dir = str(out / 'synopsis')
+    os.makedirs(synopsis_dir)
+    # a tf-idf index of other word ids, i.e. built before with another vocabulary
+    search_eng.save_dict_to_file({str(t): [[0, 1.]] for t in range(100)}, os.path.join(synopsis_dir, 'inv_idx_tfldf.json'))
+    search_eng.save_dict_to_file({str(t): 1. for t in range(100)}, os.path.join(synopsis_dir, 'idf.json'))
+    np.save(os.path.join(synopsis_dir, 'doc_norms.npy'), np.ones(3))
+
+    index_builder.build_indexes(tsv, str(out), workers=2, shard_size=3)
+
+    vocab = read(synopsis_dir, 'vocabulary.json')
+    assert_same_tfidf(synopsis_dir, expected_tfidf(tsv, vocab))
+    index = search_eng.TfidfIndex.load(synopsis_dir)
+    assert set(search_eng.tfidf_top_k([vocab['goku']], index)) == {0, 3}
+
+
+def test_build_from_pages_writes_the_tfidf_index(tmp_path, pages_dir, simple_preprocessing):
+    out = tmp_path / 'indexes'
+    tsv = str(tmp_path / 'total_pages.tsv')
+    index_builder.build_from_pages(0, 12, pages_dir, str(out), tsv, workers=1)
+
+    synopsis_dir = str(out / 'synopsis')
+    assert_same_tfidf(synopsis_dir, expected_tfidf(tsv, read(synopsis_dir, 'vocabulary.json')))
+
+
+def test_deleted_words_leave_the_vocabulary(tmp_path, tsv, simple_preprocessing):
+    out = str(tmp_path / 'indexes')
+    index_builder.build_indexes(tsv, out, workers=1)
+    synopsis_dir = os.path.join(out, 'synopsis')
+    giraffe = read(synopsis_dir, 'vocabulary.json')['giraff'] # only in the last synopsis
+
+    index_builder.update_indexes(dict(), out, delete=[7], tsv=tsv)
+
+    vocab = read(synopsis_dir, 'vocabulary.json')
+    assert 'giraff' not in vocab and 'stori' in vocab
+    assert read(synopsis_dir, 'inv_idx.json')[str(giraffe)] == []
+    index = search_eng.TfidfIndex.load(synopsis_dir)
+    assert str(giraffe) not in index.idf
+    assert search_eng.tfidf_top_k([giraffe], index) == {}
+    assert search_eng.tfidf_top_k([giraffe, vocab['stori']], index) == {}
+    assert set(search_eng.tfidf_query_or([giraffe, vocab['stori']], index)) == {6}
+
+    # the id isn't given to another word
+    index_builder.update_indexes({8: {'title': 'Anime 8', 'synopsis': 'Unicorn story', 'staff': None, 'voices': None,
+                                      'characters': None}}, out, tsv=tsv)
+    vocab = read(synopsis_dir, 'vocabulary.json')
+    assert vocab['unicorn'] == len(read(synopsis_dir, 'inv_idx.json')) - 1 != giraffe
+
+
+def row(synopsis):
+    return {'title': 'Anime', 'synopsis': synopsis, 'staff': None, 'voices': None, 'characters': None}
+
+
+def assert_tfidf_of_doc_terms(synopsis_dir):
+    '''
+        The tf-idf index in synopsis_dir is the one computed from scratch from its doc_terms.json
+    '''
+    tfidf, idf, norms = index_builder.build_tfidf(read(synopsis_dir, 'doc_terms.json'))
+    assert_same_tfidf(synopsis_dir, (json.loads(json.dumps(tfidf)), idf, norms))
+
+
+def test_update_tfidf_from_the_counts(tmp_path, tsv, simple_preprocessing):
+    out = str(tmp_path / 'indexes')
+    index_builder.build_indexes(tsv, out, workers=1)
+    synopsis_dir = os.path.join(out, 'synopsis')
+
+    # no tsv: the counts in doc_terms.json are enough
+    index_builder.update_indexes({2: row('Dragon school dragon unicorn')}, out) # same number of documents
+    assert_tfidf_of_doc_terms(synopsis_dir)
+    index_builder.update_indexes({8: row('Ninja pirate'), 9: row(None)}, out)
+    assert_tfidf_of_doc_terms(synopsis_dir)
+    index_builder.update_indexes(dict(), out, delete=[0, 9])
+    assert_tfidf_of_doc_terms(synopsis_dir)
+    index_builder.update_indexes({0: row('Goku fight')}, out, delete=[8])
+    assert_tfidf_of_doc_terms(synopsis_dir)
+
+    # the same as building the indexes of the tsv with the same synopses
+    synopses = ['Goku fight'] + SYNOPSES[1:]
+    synopses[2] = 'Dragon school dragon unicorn'
+    rebuilt = str(tmp_path / 'rebuilt')
+    index_builder.build_indexes(write_tsv(tmp_path / 'new.tsv', [row(s) for s in synopses]), rebuilt, workers=1)
+    by_word = []
+    for d in (synopsis_dir, os.path.join(rebuilt, 'synopsis')):
+        words = {str(term): word for word, term in read(d, 'vocabulary.json').items()}
+        by_word.append(({words[t]: dict(map(tuple, p)) for t, p in read(d, 'inv_idx_tfldf.json').items()},
+                        {words[t]: v for t, v in read(d, 'idf.json').items()},
+                        np.load(os.path.join(d, 'doc_norms.npy'))))
+    (tfidf, idf, norms), (tfidf_r, idf_r, norms_r) = by_word
+    assert tfidf.keys() == tfidf_r.keys() and idf == pytest.approx(idf_r)
+    assert all(tfidf[word] == pytest.approx(tfidf_r[word]) for word in tfidf)
+    assert np.allclose(norms, norms_r)
+
+
+def test_update_tfidf_without_counts_needs_the_tsv(tmp_path, tsv, simple_preprocessing):
+    out = str(tmp_path / 'indexes')
+    index_builder.build_indexes(tsv, out, workers=1)
+    synopsis_dir = os.path.join(out, 'synopsis')
+    # doc_terms.json as written before the counts were saved
+    doc_terms = read(synopsis_dir, 'doc_terms.json')
+    search_eng.save_dict_to_file({doc: sorted(map(int, terms)) for doc, terms in doc_terms.items()},
+                                 os.path.join(synopsis_dir, 'doc_terms.json'))
+
+    with pytest.raises(ValueError):
+        index_builder.update_indexes({2: row('Unicorn school')}, out)
+    index_builder.update_indexes({2: row('Unicorn school')}, out, tsv=tsv)
+    assert read(synopsis_dir, 'doc_terms.json')['3'] == doc_terms['3']
+    assert_tfidf_of_doc_terms(synopsis_dir)
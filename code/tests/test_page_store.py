@@ -0,0 +1,30 @@
+from page_store import PageStore
+
+
+def test_on_flush_is_called_when_the_chunk_is_on_disk(tmp_path):
+    path = str(tmp_path / 'store')
+    flushed = []
+    store = PageStore(path, codec='gzip', chunk_size=3)
+    for idx in range(5):
+        store.put(idx, f"page {idx}", lambda idx=idx: flushed.append(idx))
+    # the first chunk is full, the last two pages are only in memory
+    assert flushed == [0, 1, 2]
+    assert sorted(PageStore(path).indices()) == [0, 1, 2]
+
+    assert store.flush() == [3, 4]
+    assert flushed == [0, 1, 2, 3, 4]
+    assert store.flush() == []
+    reopened = PageStore(path)
+    assert [reopened[idx] for idx in range(5)] == [f"page {idx}" for idx in range(5)]
+
+
+def test_pages_not_flushed_are_lost(tmp_path):
+    path = str(tmp_path / 'store')
+    flushed = []
+    store = PageStore(path, codec='gzip', chunk_size=4)
+    for idx in range(6):
+        store.put(idx, f"page {idx}", lambda idx=idx: flushed.append(idx))
+    del store # as if the process was killed: the store isn't closed
+
+    assert flushed == [0, 1, 2, 3]
+    assert PageStore(path).indices() == flushed
@@ -0,0 +1,79 @@
+import nltk
+import numpy as np
+import pytest
+from nltk.stem import SnowballStemmer
+
+import search_eng
+from query_cache import ResultCache
+
+
+CORPUS = [['dragon', 'ball', 'goku'],
+          ['dragon', 'slayer'],
+          ['drama', 'school'],
+          ['ball', 'school', 'goku', 'goku'],
+          ['ninja', 'school']]
+
+
+def make_index():
+    vocab = {word: idx for idx, word in enumerate(sorted({w for doc in CORPUS for w in doc}))}
+    inv_idx, idf = search_eng.create_inv_idx2(CORPUS, vocab)
+    # as saved in and read from the JSON files
+    inv_idx = {str(term): postings for term, postings in inv_idx.items()}
+    idf = {str(term): value for term, value in idf.items()}
+    norms = search_eng.create_doc_norms(inv_idx, len(CORPUS))
+    return vocab, search_eng.TfidfIndex(inv_idx, idf, norms)
+
+
+def test_prefix_query_tfidf_top_k():
+    vocab, index = make_index()
+    query = search_eng.parse_query(['dra*'], vocab, SnowballStemmer('english'))
+    assert query == [(vocab['drama'], vocab['dragon'])] or query == [(vocab['dragon'], vocab['drama'])]
+
+    results = search_eng.tfidf_top_k(query, index, 10)
+    assert set(results) == {0, 1, 2}
+    assert all(score > 0 for score in results.values())
+
+
+def test_prefix_and_word_are_both_required():
+    vocab, index = make_index()
+    query = [vocab['school'], (vocab['dragon'], vocab['drama'])]
+    assert set(search_eng.tfidf_top_k(query, index, 10)) == {2}
+
+
+def test_prefix_of_one_word_is_the_word():
+    vocab, index = make_index()
+    word = search_eng.tfidf_top_k([vocab['goku']], index, 10)
+    prefix = search_eng.tfidf_top_k([(vocab['goku'],)], index, 10)
+    assert list(word) == list(prefix)
+    assert np.allclose(list(word.values()), list(prefix.values()))
+
+
+def test_prefix_query_or_and_cached_search():
+    vocab, index = make_index()
+    query = [vocab['ninja'], (vocab['dragon'], vocab['drama'])]
+    assert set(search_eng.tfidf_query_or(query, index, 10)) == {0, 1, 2, 4}
+
+    cache = ResultCache()
+    first = search_eng.cached_search(query, index, 10, cache=cache)
+    assert search_eng.cached_search(query, index, 10, cache=cache) == first
+    assert cache.hits == 1
+
+
+def nltk_data(*resources):
+    try:
+        for resource in resources:
+            nltk.data.find(resource)
+    except LookupError:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not nltk_data('corpora/stopwords', 'tokenizers/punkt_tab'), reason="nltk data not installed")
+def test_preprocessor_same_tokens_of_preprocess():
+    texts = ["Goku's training isn't over. He fights Frieza on Namek in 1989!",
+             "A U.S. agent, Mr. Smith, meets Dr. Who... The end.",
+             "Action/Adventure anime (2006) - \"quoted\" words, café and naïve ones."]
+    stemmer = SnowballStemmer('english')
+    prep = search_eng.Preprocessor(stemmer)
+    for text in texts:
+        assert prep(text) == search_eng.preprocess(text, stemmer)
@@ -0,0 +1,238 @@
+'''
+
+    This file contains the cache of the preprocessed fields of total_pages.tsv, so that the
+    documents are tokenized and stemmed once and not at every run of the notebook.
+
+    For each field the words of each document are stored as arrays of ids of the vocabulary of the
+    field (the words in alphabetical order, as the vocabularies of index_builder):
+        <path>/manifest.json            key, fields and number of documents
+        <path>/<field>.terms.json       the words, the id of a word is its position
+        <path>/<field>.tokens.npy       the ids of the words of all the documents, one after the other
+                                        (uint16 when the vocabulary is small enough, otherwise uint32)
+        <path>/<field>.offsets.npy      where the words of each document start (one more than the documents)
+
+    A missing field ('' or 'None' in the tsv) has no words, as in the indexes of index_builder
+    (the notebook preprocessing of the dataframe gave ['nan'] for it).
+
+    The key is the hash of the content of the tsv and of the preprocessing configuration (stemmer,
+    bad words and nltk version): when one of them changes the cache is built again.
+    The arrays are memory mapped, and the corpus of a field can be passed as it is to create_vocab,
+    create_inv_idx and create_inv_idx2 of search_eng, i.e.:
+        tokens = load_token_cache('../data/tsv_files/total_pages.tsv')
+        corpus = tokens.corpus('synopsis')
+        inv_idx, idf = create_inv_idx2(corpus, corpus.vocabulary())
+
+'''
+
+import hashlib
+import json
+import os
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import nltk
+import numpy as np
+
+from index_builder import FIELDS, bounded_map, field_text, get_preprocessor
+from search_eng import Preprocessor
+from tsv_reader import TSV_FILE, iter_chunks
+
+CACHE_DIR = os.path.join('..', 'data', 'token_cache')
+FORMAT = 2 # 2: the missing fields have no words
+
+
+def preprocessing_config():
+    '''
+        Returns the dictionary describing how the documents are preprocessed
+    '''
+    prep = Preprocessor()
+    stemmer = getattr(prep.stemmer, 'stemmer', prep.stemmer) # the language stemmer of SnowballStemmer
+    return {'format': FORMAT,
+            'stemmer': type(stemmer).__name__,
+            'bad_words': hashlib.blake2b('\n'.join(sorted(prep.bad)).encode(), digest_size=16).hexdigest(),
+            'nltk': nltk.__version__}
+
+
+def corpus_key(tsv, config):
+    '''
+        Returns the hash of the content of the tsv and of the preprocessing configuration
+    '''
+    h = hashlib.blake2b(json.dumps(config, sort_keys=True).encode(), digest_size=16)
+    with open(tsv, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+# ---------------------------------------------------------------------------- #
+#                                    Reader                                    #
+# ---------------------------------------------------------------------------- #
+
+class TokenCorpus(Sequence):
+    '''
+        The preprocessed documents of a field: corpus[doc] is the list of the words of the document
+        (as the lists of the notebook preprocessing), corpus.token_ids(doc) the array of their ids
+    '''
+
+    def __init__(self, terms, tokens, offsets):
+        self.terms = terms
+        self.tokens = tokens
+        self.offsets = offsets
+        self._vocab = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def token_ids(self, doc):
+        return self.tokens[self.offsets[doc]:self.offsets[doc + 1]]
+
+    def __getitem__(self, doc):
+        if isinstance(doc, slice):
+            return [self[i] for i in range(*doc.indices(len(self)))]
+        if doc < 0:
+            doc += len(self)
+        if not 0 <= doc < len(self):
+            raise IndexError(doc)
+        terms = self.terms
+        return [terms[t] for t in self.token_ids(doc).tolist()]
+
+    def lengths(self):
+        '''
+            Returns the array of the number of words of each document
+        '''
+        return np.diff(self.offsets)
+
+    def vocabulary(self):
+        '''
+            Returns the vocabulary {word: id} of the ids of the tokens
+        '''
+        if self._vocab is None:
+            self._vocab = {term: idx for idx, term in enumerate(self.terms)}
+        return self._vocab
+
+    def inv_idx(self):
+        '''
+            Returns the same inverted index of create_inv_idx(corpus, corpus.vocabulary()),
+            computed on the arrays of ids without going through the words
+        '''
+        n_docs = len(self)
+        docs = np.repeat(np.arange(n_docs, dtype=np.int64), self.lengths())
+        # the distinct (term, document) pairs, sorted by term and then by document
+        pairs = np.unique(np.asarray(self.tokens, dtype=np.int64) * max(n_docs, 1) + docs)
+        terms, docs = pairs // max(n_docs, 1), pairs % max(n_docs, 1)
+        bounds = np.searchsorted(terms, np.arange(len(self.terms) + 1))
+        docs = docs.astype(str).tolist()
+        return {term: docs[bounds[term]:bounds[term + 1]] for term in range(len(self.terms))}
+
+
+class TokenCache:
+    '''
+        Read only view of a token cache directory, see the description of the file
+    '''
+
+    def __init__(self, path=CACHE_DIR):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        self.key = manifest['key']
+        self.fields = manifest['fields']
+        self.n_docs = manifest['n_docs']
+        self._corpora = dict()
+
+    def corpus(self, field):
+        '''
+            Returns the TokenCorpus of the field (the arrays are memory mapped)
+        '''
+        if field not in self.fields:
+            raise KeyError(f"{field} is not in the token cache {self.path}")
+        if field not in self._corpora:
+            with open(os.path.join(self.path, f'{field}.terms.json'), 'r') as f:
+                terms = json.load(f)
+            tokens = np.load(os.path.join(self.path, f'{field}.tokens.npy'), mmap_mode='r')
+            offsets = np.load(os.path.join(self.path, f'{field}.offsets.npy'))
+            self._corpora[field] = TokenCorpus(terms, tokens, offsets)
+        return self._corpora[field]
+
+    def __getitem__(self, field):
+        return self.corpus(field)
+
+# ---------------------------------------------------------------------------- #
+#                                    Writer                                    #
+# ---------------------------------------------------------------------------- #
+
+def tokenize_shard(shard):
+    '''
+        Given a shard (first_doc, columns) as the ones of index_builder it returns
+        (first_doc, {field: [words of each document]}), keeping the order and the repetitions of the words
+    '''
+    first_doc, columns = shard
+    prep = get_preprocessor()
+    return first_doc, {field: [prep(field_text(field, value)) for value in values]
+                       for field, values in columns.items()}
+
+
+def build_token_cache(tsv=TSV_FILE, path=CACHE_DIR, fields=FIELDS, workers=None, shard_size=500):
+    '''
+        Preprocesses the fields of the tsv (streaming it in shards to 'workers' processes, 1 to do it
+        in this process) and saves the token cache in path. It returns the TokenCache
+    '''
+    start = perf_counter()
+    key = corpus_key(tsv, preprocessing_config())
+    if not os.path.exists(path):
+        os.makedirs(path)
+    manifest_file = os.path.join(path, 'manifest.json')
+    if os.path.exists(manifest_file): # the old cache isn't valid while it's being replaced
+        os.remove(manifest_file)
+
+    # the words get temporary ids in order of appearance, sorted at the end
+    first_ids = {field: dict() for field in fields}
+    tokens = {field: array('I') for field in fields}
+    offsets = {field: [0] for field in fields}
+    n_docs = 0
+
+    shards = iter_chunks(tsv, fields, shard_size, parse=False)
+    if workers == 1:
+        results = map(tokenize_shard, shards)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = bounded_map(executor, tokenize_shard, shards, 2 * (workers or os.cpu_count() or 1))
+
+    try:
+        for _, columns in results:
+            for field, docs in columns.items():
+                ids = first_ids[field]
+                for words in docs:
+                    tokens[field].extend(ids.setdefault(word, len(ids)) for word in words)
+                    offsets[field].append(len(tokens[field]))
+            n_docs = len(offsets[fields[0]]) - 1
+    finally:
+        if workers != 1:
+            executor.shutdown()
+
+    for field in fields:
+        terms = sorted(first_ids[field])
+        remap = np.empty(len(terms), dtype=np.uint32)
+        remap[[first_ids[field][term] for term in terms]] = np.arange(len(terms), dtype=np.uint32)
+        dtype = np.uint16 if len(terms) <= 2**16 else np.uint32
+        with open(os.path.join(path, f'{field}.terms.json'), 'w') as f:
+            json.dump(terms, f)
+        np.save(os.path.join(path, f'{field}.tokens.npy'), remap[np.frombuffer(tokens[field], dtype=np.uint32)].astype(dtype))
+        np.save(os.path.join(path, f'{field}.offsets.npy'), np.array(offsets[field], dtype=np.int64))
+
+    with open(manifest_file, 'w') as f:
+        json.dump({'key': key, 'tsv': tsv, 'fields': list(fields), 'n_docs': n_docs}, f)
+    print(f"[Token cache]: {n_docs} documents preprocessed and saved in {path} ({perf_counter() - start:.1f} s)")
+    return TokenCache(path)
+
+
+def load_token_cache(tsv=TSV_FILE, path=CACHE_DIR, fields=FIELDS, workers=None):
+    '''
+        Returns the TokenCache of the tsv saved in path if it's still valid (same tsv, same preprocessing
+        and all the fields), otherwise it builds it again
+    '''
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        cache = TokenCache(path)
+        if cache.key == corpus_key(tsv, preprocessing_config()) and set(fields) <= set(cache.fields):
+            return cache
+    return build_token_cache(tsv, path, fields, workers)
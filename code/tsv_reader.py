@@ -0,0 +1,139 @@
+'''
+
+    This file contains a streaming reader of total_pages.tsv (the format written by html_parser.save_tsv_info):
+    the rows are read one at a time, so the memory used doesn't grow with the number of animes.
+
+    The documents are numbered as the rows of the dataframe the notebook reads with pandas.read_table
+    (the blank lines and the rows with too many fields are skipped, the missing fields are None), so a
+    doc id here is the same doc id used by the indexes. The values are the strings of the file, except:
+        * the missing values ('' and 'None') that are None
+        * the lists (related_anime, characters, voices, staff, top_reviews), parsed with ast.literal_eval
+          only when they are accessed
+
+    The records can be read one by one (iter_records) or in chunks of consecutive documents,
+    column by column (iter_chunks), i.e.:
+        for first_doc, columns in iter_chunks(tsv, ['synopsis'], chunk_size=500):
+            ...columns['synopsis'] is the list of the synopsis of the documents first_doc, first_doc+1, ...
+
+'''
+
+import ast
+import os
+from collections.abc import Mapping
+from itertools import islice
+
+from columnar import LIST_FIELDS
+
+TSV_FILE = os.path.join('..', 'data', 'tsv_files', 'total_pages.tsv')
+
+NULLS = ('', 'None') # how a missing value is written by save_tsv_info
+
+
+def parse_value(field, raw):
+    '''
+        Given a field and its string in the tsv it returns its value (see the description of the file)
+    '''
+    if raw is None or raw in NULLS:
+        return None
+    if field in LIST_FIELDS:
+        return ast.literal_eval(raw)
+    return raw
+
+
+class Record(Mapping):
+    '''
+        A row of the tsv as a read only dictionary field -> value, with the document id in record.doc_id.
+        The lists are parsed the first time they are accessed, record.raw(field) gives the string in the file.
+    '''
+
+    __slots__ = ('doc_id', '_raw', '_parsed')
+
+    def __init__(self, doc_id, raw):
+        self.doc_id = doc_id
+        self._raw = raw
+        self._parsed = dict()
+
+    def __getitem__(self, field):
+        try:
+            return self._parsed[field]
+        except KeyError:
+            value = self._parsed[field] = parse_value(field, self._raw[field])
+            return value
+
+    def raw(self, field):
+        return self._raw[field]
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __repr__(self):
+        return f"Record({self.doc_id}, {self._raw!r})"
+
+
+def iter_rows(tsv=TSV_FILE, columns=None):
+    '''
+        Yields (doc_id, {field: string}) for each row of the tsv, with only the given columns (by default all).
+        The strings are not parsed, see parse_value.
+    '''
+    with open(tsv, 'r', encoding='utf-8') as f:
+        header = f.readline().rstrip('\n').split('\t')
+        if columns is None:
+            columns = header
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise ValueError(f"{tsv} has no columns {missing}")
+        positions = [(c, header.index(c)) for c in columns]
+        n_fields = len(header)
+
+        doc_id = 0
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            values = line.split('\t')
+            if len(values) > n_fields: # a bad line, skipped as pandas does
+                continue
+            yield doc_id, {c: values[i] if i < len(values) else None for c, i in positions}
+            doc_id += 1
+
+
+def iter_records(tsv=TSV_FILE, columns=None, start=0, stop=None):
+    '''
+        Yields the Record of each document from start to stop (excluded, None for the end of the file)
+    '''
+    for doc_id, raw in islice(iter_rows(tsv, columns), start, stop):
+        yield Record(doc_id, raw)
+
+
+def iter_chunks(tsv=TSV_FILE, columns=None, chunk_size=500, parse=True):
+    '''
+        Yields (first_doc, {field: [values]}) for chunks of chunk_size consecutive documents.
+        With parse=False the values are the strings of the file (i.e. to parse them in the workers of a pool),
+        still with None for the missing values as with parse=True.
+    '''
+    first_doc, chunk = 0, None
+    for doc_id, raw in iter_rows(tsv, columns):
+        if chunk is None:
+            first_doc, chunk = doc_id, {c: [] for c in raw}
+        for c, value in raw.items():
+            if parse:
+                value = parse_value(c, value)
+            elif value in NULLS:
+                value = None
+            chunk[c].append(value)
+        if doc_id - first_doc + 1 == chunk_size:
+            yield first_doc, chunk
+            chunk = None
+    if chunk is not None:
+        yield first_doc, chunk
+
+
+def read_column(tsv, field):
+    '''
+        Yields the (parsed) values of a column, one per document
+    '''
+    for _, raw in iter_rows(tsv, [field]):
+        yield parse_value(field, raw[field])